@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bootstrap4',
     'crispy_forms',
     'crispy_bootstrap4',
@@ -135,6 +136,28 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cache de PDFs de ventas (fuera de MEDIA_ROOT para no publicarlos)
+VENTAS_PDF_CACHE_DIR = BASE_DIR / 'cache' / 'ventas_pdf'
+VENTAS_PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Pool de procesos que renderizan los PDFs con WeasyPrint
+VENTAS_PDF_PROCESOS = int(os.environ.get('VENTAS_PDF_PROCESOS', 2))
+VENTAS_PDF_MAX_CONCURRENCIA = int(os.environ.get('VENTAS_PDF_MAX_CONCURRENCIA', 4))
+VENTAS_PDF_TIMEOUT = 30  # segundos
+# Procesos para la exportación masiva de facturas desde la web; se terminan al
+# terminar cada exportación (el comando exportar_facturas usa los suyos)
+VENTAS_EXPORTACION_PROCESOS = int(os.environ.get('VENTAS_EXPORTACION_PROCESOS', 2))
+
+# Segundos que un proceso puede mostrar precio/stock de un producto cambiado por otro proceso
+PRODUCTOS_CACHE_TTL = 30
+
+# Variantes de las imágenes de productos (lado mayor en px) y hilos que las generan
+PRODUCTOS_IMAGENES_TAMANOS = (100, 200, 400)
+PRODUCTOS_IMAGENES_HILOS = 2
+# Límites de las imágenes subidas; se controlan mientras llegan (productos.subidas)
+PRODUCTOS_IMAGEN_MAX_BYTES = 5 * 1024 * 1024
+PRODUCTOS_IMAGEN_MAX_PIXELES = 40_000_000
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -1,6 +1,12 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 
+from productos.cache import contador_stock_bajo
+
 @login_required
 def dashboard_view(request):
-    return render(request, 'dashboard.html')
\ No newline at end of file
+    context = {}
+    if request.user.has_perm('productos.view_producto'):
+        # Cuenta cacheada: el dashboard se abre seguido y no debe recorrer los productos
+        context['stock_bajo'] = contador_stock_bajo.obtener()
+    return render(request, 'dashboard.html', context)
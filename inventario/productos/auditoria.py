@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import Max, Min
+
+from .historico import stock_a_fecha
+from .models import Producto
+from .services import conciliar_stock
+
+
+def rangos(tamano):
+    """Rangos [desde, hasta) de ids que cubren todo el catálogo."""
+    limites = Producto.objects.aggregate(minimo=Min('id'), maximo=Max('id'))
+    if limites['minimo'] is None:
+        return []
+    return [(desde, desde + tamano) for desde in range(limites['minimo'], limites['maximo'] + 1, tamano)]
+
+
+def auditar_rango(desde, hasta):
+    """[(id, sku, stock, libro)] de los productos del rango cuyo stock no coincide con el libro.
+
+    Producto y libro se leen en la misma transacción (REPEATABLE READ en
+    PostgreSQL), así una venta que se confirma en el medio no aparece como
+    diferencia. Si ya hay una transacción abierta (ATOMIC_REQUESTS, un
+    TestCase) se lee dentro de ella, con su aislamiento: PostgreSQL sólo
+    deja cambiarlo antes de la primera consulta. El libro sale de
+    productos.historico: último snapshot más una suma agrupada de los
+    movimientos posteriores.
+    """
+    aislar = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with transaction.atomic():
+        if aislar:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        productos = list(
+            Producto.objects.filter(pk__gte=desde, pk__lt=hasta).order_by().values_list('pk', 'sku', 'stock')
+        )
+        libro = stock_a_fecha([pk for pk, _, _ in productos])
+    return [(pk, sku, stock, libro[pk]) for pk, sku, stock in productos if stock != libro[pk]]
+
+
+class Checkpoint:
+    """Progreso de una auditoría en un archivo JSON Lines, para retomarla si se corta.
+
+    La primera línea guarda el tamaño de los rangos; después, una línea por
+    rango terminado con sus diferencias y correcciones. Se escribe sólo al
+    final del archivo; una última línea a medio escribir se descarta al retomar.
+    """
+
+    def __init__(self, ruta, tamano):
+        self.ruta = ruta
+        self.hechos = set()
+        self.diferencias = []
+        self.corregidos = {}
+        self._lock = threading.Lock()
+        if ruta and os.path.exists(ruta):
+            self._cargar(tamano)
+        elif ruta:
+            self._escribir({'tamano': tamano})
+
+    def _cargar(self, tamano):
+        with open(self.ruta, 'r+', encoding='utf-8') as archivo:
+            contenido = archivo.read()
+            if not contenido.endswith('\n'):
+                # Se cortó escribiendo: se descarta la línea incompleta
+                contenido = contenido[:contenido.rfind('\n') + 1]
+                archivo.seek(0)
+                archivo.truncate(len(contenido.encode('utf-8')))
+        lineas = contenido.splitlines()
+        if not lineas:
+            self._escribir({'tamano': tamano})
+            return
+        cabecera = json.loads(lineas[0])
+        if cabecera['tamano'] != tamano:
+            raise ValueError(f"El checkpoint es de rangos de {cabecera['tamano']} productos, no de {tamano}.")
+        for linea in lineas[1:]:
+            rango = json.loads(linea)
+            self.hechos.add(rango['desde'])
+            self.diferencias.extend(tuple(d) for d in rango['diferencias'])
+            self.corregidos.update((int(pk), tuple(v)) for pk, v in rango['corregidos'].items())
+
+    def _escribir(self, datos):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(datos) + '\n')
+            archivo.flush()
+            os.fsync(archivo.fileno())
+
+    def registrar(self, desde, diferencias, corregidos):
+        with self._lock:
+            self.hechos.add(desde)
+            self.diferencias.extend(diferencias)
+            self.corregidos.update(corregidos)
+            if self.ruta:
+                self._escribir({'desde': desde, 'diferencias': diferencias, 'corregidos': corregidos})
+
+
+def _procesar(desde, hasta, corregir, usuario):
+    diferencias = auditar_rango(desde, hasta)
+    corregidos = {}
+    if corregir and diferencias:
+        corregidos = conciliar_stock([d[0] for d in diferencias], corregir, usuario)
+    return diferencias, corregidos
+
+
+def _procesar_en_hilo(*args):
+    close_old_connections()
+    try:
+        return _procesar(*args)
+    finally:
+        connections.close_all()
+
+
+def auditar(tamano=5000, hilos=4, corregir=None, usuario='Sistema', checkpoint=None, progreso=None):
+    """Compara Producto.stock con el libro de movimientos de todo el catálogo.
+
+    Recorre el catálogo en rangos de `tamano` ids repartidos entre `hilos`
+    hilos (cada uno con su conexión); con `corregir` ('libro' o 'stock')
+    concilia las diferencias de cada rango apenas las encuentra. Los rangos
+    que ya figuran en `checkpoint` se saltean. Devuelve el Checkpoint con
+    las diferencias y correcciones de toda la auditoría.
+    """
+    checkpoint = checkpoint or Checkpoint(None, tamano)
+    pendientes = [r for r in rangos(tamano) if r[0] not in checkpoint.hechos]
+    total = len(pendientes)
+    if hilos <= 1:
+        for hechos, (desde, hasta) in enumerate(pendientes, start=1):
+            checkpoint.registrar(desde, *_procesar(desde, hasta, corregir, usuario))
+            if progreso:
+                progreso(hechos, total)
+        return checkpoint
+
+    with ThreadPoolExecutor(hilos, thread_name_prefix='auditoria') as pool:
+        futuros = {
+            pool.submit(_procesar_en_hilo, desde, hasta, corregir, usuario): desde
+            for desde, hasta in pendientes
+        }
+        try:
+            for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                checkpoint.registrar(futuros[futuro], *futuro.result())
+                if progreso:
+                    progreso(hechos, total)
+        except BaseException:
+            # Error o Ctrl+C: lo terminado ya quedó en el checkpoint
+            pool.shutdown(cancel_futures=True)
+            raise
+    return checkpoint
@@ -0,0 +1,173 @@
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from collections import Counter
+from itertools import chain
+
+from django.db import connections
+from django.db.models import Count, F, Max, Q
+from django.db.models.expressions import RawSQL
+
+# Configuración de texto de PostgreSQL: el texto ya llega normalizado, así que
+# no hace falta stemming ni diccionario de acentos
+CONFIGURACION = 'simple'
+# Umbral de pg_trgm.word_similarity_threshold; el índice en memoria usa el mismo
+UMBRAL_SIMILITUD = 0.6
+# El índice en memoria devuelve a lo sumo estos resultados, ya ordenados
+MAX_RESULTADOS_MEMORIA = 500
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y con los espacios colapsados: 'Azúcar  Ñandú' -> 'azucar nandu'."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.casefold().split())
+
+
+def texto_busqueda(sku, nombre, descripcion):
+    """Valor de Producto.texto_busqueda: lo que se indexa para buscar."""
+    return normalizar(' '.join(filter(None, (sku, nombre, descripcion))))
+
+
+def palabras(texto):
+    return re.findall(r'\w+', normalizar(texto))
+
+
+def trigramas(texto):
+    """Trigramas por palabra como los arma pg_trgm (dos espacios al inicio, uno al final)."""
+    resultado = set()
+    for palabra in palabras(texto):
+        relleno = f'  {palabra} '
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+def buscar_productos(queryset, texto):
+    """Filtra `queryset` por `texto` sobre SKU, nombre y descripción y lo ordena por relevancia.
+
+    En PostgreSQL usa los índices tsvector y trigram sobre texto_busqueda
+    (migración 0005): coinciden los productos que tienen palabras que empiezan
+    con cada palabra buscada, o que se parecen a lo buscado aunque esté mal
+    escrito. En otros motores (SQLite, tests) usa el índice en memoria.
+    """
+    consulta = normalizar(texto)
+    if not palabras(consulta):
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        return _buscar_postgresql(queryset, consulta)
+    return _buscar_en_memoria(queryset, consulta)
+
+
+def _buscar_postgresql(queryset, consulta):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+
+    vector = SearchVector('texto_busqueda', config=CONFIGURACION)
+    # Prefijos: 'yer mat' -> 'yer:* & mat:*'; \w ya deja afuera la sintaxis de tsquery
+    prefijos = SearchQuery(
+        ' & '.join(f'{palabra}:*' for palabra in palabras(consulta)),
+        config=CONFIGURACION, search_type='raw',
+    )
+    return (
+        queryset
+        .annotate(vector_busqueda=vector)
+        .filter(Q(vector_busqueda=prefijos) | Q(texto_busqueda__trigram_word_similar=consulta))
+        .annotate(relevancia=SearchRank(F('vector_busqueda'), prefijos)
+                  + TrigramWordSimilarity(consulta, 'texto_busqueda'))
+        .order_by('-relevancia', 'nombre', 'id')
+    )
+
+
+def _buscar_en_memoria(queryset, consulta):
+    ids = indice_productos.buscar(consulta, queryset.model)
+    if not ids:
+        return queryset.none()
+    # Un CASE simple en SQL: armar cientos de When() cuesta más que la consulta
+    quote = connections[queryset.db].ops.quote_name
+    columna = f'{quote(queryset.model._meta.db_table)}.{quote(queryset.model._meta.pk.column)}'
+    posicion = RawSQL(
+        f'CASE {columna} {"WHEN %s THEN %s " * len(ids)}END',
+        [valor for i, pk in enumerate(ids) for valor in (pk, i)],
+    )
+    return queryset.filter(pk__in=ids).order_by(posicion)
+
+
+class IndiceEnMemoria:
+    """Índice invertido de productos para motores sin pg_trgm ni tsvector.
+
+    Guarda las palabras ordenadas (para buscar por prefijo con bisect) y los
+    trigramas de cada producto, y puntúa parecido a PostgreSQL: prefijos de
+    todas las palabras buscadas, o similitud de trigramas por palabra. Se
+    reconstruye cuando cambia la huella de la tabla (cantidad y último id, un
+    aggregate por búsqueda, que detecta altas y bajas aunque sean masivas) o
+    cuando productos.signals avisa que se guardó un producto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._huella = None
+        self._palabras = []        # palabras ordenadas
+        self._por_palabra = {}     # palabra -> set(ids)
+        self._por_trigrama = {}    # trigrama -> set(ids)
+        self._nombres = {}         # id -> nombre, para desempatar
+
+    def limpiar(self):
+        with self._lock:
+            self._huella = None
+
+    def _huella_actual(self, modelo):
+        return tuple(modelo.objects.aggregate(
+            cantidad=Count('id'), ultimo=Max('id'),
+        ).values())
+
+    def _construir(self, modelo):
+        por_palabra, por_trigrama, nombres = {}, {}, {}
+        filas = modelo.objects.values_list('id', 'sku', 'nombre', 'descripcion').order_by()
+        for pk, sku, nombre, descripcion in filas.iterator(chunk_size=2000):
+            texto = texto_busqueda(sku, nombre, descripcion)
+            nombres[pk] = nombre
+            for palabra in set(palabras(texto)):
+                por_palabra.setdefault(palabra, set()).add(pk)
+            for trigrama in trigramas(texto):
+                por_trigrama.setdefault(trigrama, set()).add(pk)
+        self._palabras = sorted(por_palabra)
+        self._por_palabra, self._por_trigrama, self._nombres = por_palabra, por_trigrama, nombres
+
+    def _con_prefijo(self, prefijo):
+        ids = set()
+        inicio = bisect.bisect_left(self._palabras, prefijo)
+        for palabra in self._palabras[inicio:]:
+            if not palabra.startswith(prefijo):
+                break
+            ids |= self._por_palabra[palabra]
+        return ids
+
+    def buscar(self, consulta, modelo):
+        """Ids que coinciden con `consulta` (ya normalizada), del más al menos relevante."""
+        huella = self._huella_actual(modelo)
+        with self._lock:
+            if huella != self._huella:
+                self._construir(modelo)
+                self._huella = huella
+
+            puntajes = {}
+            buscadas = palabras(consulta)
+            coinciden = set.intersection(*(self._con_prefijo(palabra) for palabra in buscadas))
+            for pk in coinciden:
+                puntajes[pk] = 1.0
+
+            # Similitud por trigramas: qué parte de los trigramas buscados tiene el producto
+            buscados = trigramas(consulta)
+            conteo = Counter(chain.from_iterable(self._por_trigrama.get(t, ()) for t in buscados))
+            minimo = UMBRAL_SIMILITUD * len(buscados)
+            for pk, comunes in conteo.items():
+                if comunes >= minimo or pk in puntajes:
+                    puntajes[pk] = puntajes.get(pk, 0) + comunes / len(buscados)
+
+            return heapq.nsmallest(
+                MAX_RESULTADOS_MEMORIA, puntajes, key=lambda pk: (-puntajes[pk], self._nombres[pk], pk),
+            )
+
+
+indice_productos = IndiceEnMemoria()
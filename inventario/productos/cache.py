@@ -0,0 +1,141 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+CAMPOS = ('id', 'sku', 'nombre', 'precio', 'stock')
+
+
+class CacheProductos:
+    """Cache de lectura en memoria del proceso con precio, stock y nombre de los productos.
+
+    Lo que falta se trae de la base en una sola consulta y queda guardado.
+    Los cambios hechos en este proceso la invalidan al confirmarse la
+    transacción (señales de Producto y productos.services); los hechos en
+    otros procesos se ven a más tardar al vencer `ttl` segundos. El stock
+    que devuelve es orientativo: la venta lo valida de nuevo al guardarse.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._filas = {}    # pk -> (vence, fila)
+        self._por_sku = {}  # sku -> pk
+        self._generacion = 0
+        self._lock = threading.Lock()
+
+    def _buscar(self, ids, skus):
+        ahora = time.monotonic()
+        encontrados = {}
+        faltan_ids = set()
+        faltan_skus = set()
+        ids = list(ids)
+        with self._lock:
+            for sku in skus:
+                pk = self._por_sku.get(sku)
+                if pk is None:
+                    faltan_skus.add(sku)
+                else:
+                    ids.append(pk)
+            for pk in ids:
+                entrada = self._filas.get(pk)
+                if entrada and entrada[0] > ahora:
+                    encontrados[pk] = entrada[1]
+                else:
+                    faltan_ids.add(pk)
+            return encontrados, faltan_ids, faltan_skus, self._generacion
+
+    def _guardar(self, filas, generacion):
+        vence = time.monotonic() + self.ttl
+        with self._lock:
+            # Si algo se invalidó mientras se consultaba, estas filas pueden ser viejas
+            if generacion != self._generacion:
+                return
+            for fila in filas:
+                self._filas[fila['id']] = (vence, fila)
+                if fila['sku']:
+                    self._por_sku[fila['sku']] = fila['id']
+
+    def _consulta(self, ids, skus):
+        from .models import Producto
+        return Producto.objects.filter(Q(pk__in=ids) | Q(sku__in=skus)).values(*CAMPOS)
+
+    def obtener(self, ids=(), skus=()):
+        """Devuelve {pk: fila} para los ids y SKU pedidos; los que no existen no aparecen."""
+        encontrados, faltan_ids, faltan_skus, generacion = self._buscar(ids, skus)
+        if faltan_ids or faltan_skus:
+            filas = list(self._consulta(faltan_ids, faltan_skus))
+            self._guardar(filas, generacion)
+            encontrados.update((fila['id'], fila) for fila in filas)
+        return encontrados
+
+    async def aobtener(self, ids=(), skus=()):
+        """Versión async de obtener(), para vistas async."""
+        encontrados, faltan_ids, faltan_skus, generacion = self._buscar(ids, skus)
+        if faltan_ids or faltan_skus:
+            filas = [fila async for fila in self._consulta(faltan_ids, faltan_skus)]
+            self._guardar(filas, generacion)
+            encontrados.update((fila['id'], fila) for fila in filas)
+        return encontrados
+
+    def invalidar(self, ids):
+        with self._lock:
+            self._generacion += 1
+            for pk in ids:
+                entrada = self._filas.pop(pk, None)
+                if entrada and entrada[1]['sku']:
+                    self._por_sku.pop(entrada[1]['sku'], None)
+
+    def invalidar_al_confirmar(self, ids):
+        """Invalida cuando la transacción actual se confirma (o ya, si no hay transacción)."""
+        ids = list(ids)
+        transaction.on_commit(lambda: self.invalidar(ids))
+
+    def limpiar(self):
+        with self._lock:
+            self._generacion += 1
+            self._filas.clear()
+            self._por_sku.clear()
+
+
+cache_productos = CacheProductos(settings.PRODUCTOS_CACHE_TTL)
+
+
+class ContadorStockBajo:
+    """Cantidad de productos con stock bajo, para el badge del dashboard.
+
+    La cuenta usa el índice parcial de stock bajo y queda guardada `ttl`
+    segundos. Se invalida al confirmarse un cambio que hace cruzar el mínimo
+    a algún producto (productos.services y señales de Producto).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._valor = None  # (vence, cantidad)
+        self._generacion = 0
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        from .models import Producto, STOCK_BAJO
+        with self._lock:
+            if self._valor and self._valor[0] > time.monotonic():
+                return self._valor[1]
+            generacion = self._generacion
+        cantidad = Producto.objects.filter(STOCK_BAJO).count()
+        with self._lock:
+            # Si algo se invalidó mientras se contaba, la cuenta puede ser vieja
+            if generacion == self._generacion:
+                self._valor = (time.monotonic() + self.ttl, cantidad)
+        return cantidad
+
+    def invalidar(self):
+        with self._lock:
+            self._generacion += 1
+            self._valor = None
+
+    def invalidar_al_confirmar(self):
+        transaction.on_commit(self.invalidar)
+
+
+contador_stock_bajo = ContadorStockBajo(settings.PRODUCTOS_CACHE_TTL)
@@ -0,0 +1,173 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, When
+from django.db.models.lookups import GreaterThan, LessThan
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+
+from .models import ConteoStock, LineaConteo, MovimientoStock, Producto
+from .recepcion import MAX_LINEAS
+from .services import ProductoInexistente, StockInsuficiente, mover_stock
+
+MODOS = ('sumar', 'reemplazar')
+MOTIVO = 'Conteo de inventario: {}'
+
+
+class ConteoInvalido(Exception):
+    """El lote o el conteo no se pueden aplicar; `errores` dice por qué."""
+
+    def __init__(self, errores):
+        self.errores = errores
+        super().__init__('; '.join(errores))
+
+
+def _abierto(conteo_id):
+    """Bloquea el conteo y verifica que siga abierto.
+
+    El bloqueo ordena los lotes de varios lectores (en modo 'sumar' dos
+    lotes del mismo producto no pueden pisarse) y hace que un lote que
+    llega mientras se aplica el conteo espere y después se rechace.
+    """
+    conteo = ConteoStock.objects.select_for_update().get(pk=conteo_id)
+    if conteo.estado != 'abierto':
+        raise ConteoInvalido([f'El conteo "{conteo.nombre}" ya fue aplicado.'])
+    return conteo
+
+
+def registrar_lote(conteo_id, lineas, modo='sumar'):
+    """Guarda un lote de cantidades contadas [(sku, cantidad)] y devuelve sus diferencias.
+
+    En modo 'sumar' la cantidad se agrega a lo ya contado del producto (el
+    mismo producto en dos estanterías); en 'reemplazar' la pisa (un
+    recuento). Cada línea guarda el stock del sistema al contarla: la
+    diferencia es contra ese stock, así las ventas y recepciones que lleguen
+    antes de aplicar el conteo no se confunden con faltantes o sobrantes.
+    Al sumar se conserva el stock del primer lote; un recuento lo vuelve a
+    tomar. Lo contado antes y los dos stocks de todo el lote salen de una
+    sola consulta, y las líneas se guardan con un único upsert. Si algún
+    SKU no existe no guarda nada. Devuelve una fila por producto:
+    {'sku', 'contado', 'stock', 'diferencia'}.
+    """
+    if modo not in MODOS:
+        raise ConteoInvalido([f'Modo inválido, use {" o ".join(MODOS)}.'])
+    if not lineas:
+        raise ConteoInvalido(['El lote no tiene líneas.'])
+    if len(lineas) > MAX_LINEAS:
+        raise ConteoInvalido([f'Como máximo {MAX_LINEAS} líneas por lote.'])
+    cantidades = Counter()
+    for sku, cantidad in lineas:
+        cantidades[sku] += cantidad
+
+    with transaction.atomic():
+        _abierto(conteo_id)
+        linea = LineaConteo.objects.filter(conteo_id=conteo_id, producto=OuterRef('pk'))
+        filas = {
+            sku: (pk, stock, anterior, al_contar)
+            for sku, pk, stock, anterior, al_contar in Producto.objects.filter(sku__in=cantidades).order_by()
+            .annotate(
+                contado=Subquery(linea.values('cantidad')[:1]),
+                al_contar=Subquery(linea.values('stock_sistema')[:1]),
+            ).values_list('sku', 'pk', 'stock', 'contado', 'al_contar')
+        }
+        faltan = [sku for sku in cantidades if sku not in filas]
+        if faltan:
+            raise ConteoInvalido([f'No existe el producto con SKU {sku}.' for sku in faltan])
+
+        resultado, nuevas = [], []
+        for sku, cantidad in cantidades.items():
+            pk, stock, anterior, al_contar = filas[sku]
+            if modo == 'sumar' and anterior is not None:
+                cantidad += anterior
+                # Las líneas de antes de guardar el stock al contar lo toman ahora
+                stock = al_contar if al_contar is not None else stock
+            nuevas.append(LineaConteo(conteo_id=conteo_id, producto_id=pk, cantidad=cantidad, stock_sistema=stock))
+            resultado.append({'sku': sku, 'contado': cantidad, 'stock': stock, 'diferencia': cantidad - stock})
+        LineaConteo.objects.bulk_create(
+            nuevas, batch_size=1000,
+            update_conflicts=True, unique_fields=['conteo', 'producto'], update_fields=['cantidad', 'stock_sistema'],
+        )
+    return resultado
+
+
+def _diferencias():
+    """Expresiones (stock, diferencia, valor) de las líneas del conteo."""
+    # Líneas sin stock al contar (anteriores a guardarlo): se comparan con el actual
+    stock = Coalesce('stock_sistema', 'producto__stock')
+    diferencia = F('cantidad') - stock
+    valor = ExpressionWrapper(diferencia * F('producto__precio'), output_field=DecimalField(decimal_places=2))
+    return stock, diferencia, valor
+
+
+def reporte_diferencias(conteo, solo_diferencias=True):
+    """Líneas del conteo con `stock`, `diferencia` y `valor` (diferencia a precio actual).
+
+    Compara cada línea con el stock que había al contarla, que es también
+    la diferencia que aplica aplicar_conteo. Ordenadas de la mayor
+    diferencia a la menor.
+    """
+    stock, diferencia, valor = _diferencias()
+    lineas = conteo.lineas.select_related('producto').annotate(stock=stock, diferencia=diferencia, valor=valor)
+    if solo_diferencias:
+        lineas = lineas.exclude(diferencia=0)
+    return lineas.order_by(Abs('diferencia').desc(), 'producto__nombre', 'pk')
+
+
+def totales_diferencias(conteo):
+    """Productos con diferencias, unidades sobrantes y faltantes y su valor neto, en una consulta."""
+    stock, diferencia, valor = _diferencias()
+    totales = conteo.lineas.exclude(cantidad=stock).aggregate(
+        productos=Count('pk'),
+        sobrantes=Sum(Case(When(GreaterThan(diferencia, 0), then=diferencia), default=0)),
+        faltantes=Sum(Case(When(LessThan(diferencia, 0), then=-diferencia), default=0)),
+        valor=Sum(valor),
+    )
+    return {clave: valor or 0 for clave, valor in totales.items()}
+
+
+def aplicar_conteo(conteo_id, usuario):
+    """Aplica las diferencias de todos los productos contados al stock, en una transacción.
+
+    La diferencia de cada línea es lo contado menos el stock que había al
+    contarla, y se suma al stock actual con services.mover_stock (bloqueo
+    en orden de pk y un solo UPDATE): las ventas, recepciones y movimientos
+    registrados entre el lote y la aplicación se conservan. Registra un
+    movimiento 'ajuste' con la diferencia con signo por cada producto que
+    cambia; los productos que no se contaron no se tocan. Si una diferencia
+    dejaría un stock negativo no aplica nada. Devuelve
+    {'productos': n, 'sobrantes': unidades, 'faltantes': unidades}.
+    """
+    with transaction.atomic():
+        conteo = _abierto(conteo_id)
+        lineas = LineaConteo.objects.filter(conteo=conteo)
+        # Líneas guardadas antes de registrar el stock al contar: toman el actual
+        lineas.filter(stock_sistema__isnull=True).update(stock_sistema=Subquery(
+            Producto.objects.filter(pk=OuterRef('producto_id')).values('stock')[:1]
+        ))
+        cambios = dict(
+            lineas.exclude(cantidad=F('stock_sistema'))
+            .annotate(cambio=F('cantidad') - F('stock_sistema')).values_list('producto_id', 'cambio')
+        )
+        try:
+            mover_stock(cambios)
+        except ProductoInexistente as e:
+            raise ConteoInvalido([str(e)])
+        except StockInsuficiente as e:
+            raise ConteoInvalido([
+                f'El stock de {e.producto.nombre} quedaría negativo: se vendió más de lo contado desde el conteo.'
+            ])
+        if cambios:
+            motivo = MOTIVO.format(conteo.nombre)
+            MovimientoStock.objects.bulk_create([
+                MovimientoStock(producto_id=pk, tipo='ajuste', cantidad=cambio, motivo=motivo, usuario=usuario)
+                for pk, cambio in cambios.items()
+            ], batch_size=1000)
+
+        conteo.estado = 'aplicado'
+        conteo.fecha_aplicado = timezone.now()
+        conteo.save(update_fields=['estado', 'fecha_aplicado'])
+    return {
+        'productos': len(cambios),
+        'sobrantes': sum(c for c in cambios.values() if c > 0),
+        'faltantes': -sum(c for c in cambios.values() if c < 0),
+    }
@@ -1,6 +1,10 @@
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from .models import Producto, MovimientoStock
+from django.core.validators import FileExtensionValidator
+from .models import ConteoStock, Producto, MovimientoStock
+from .recepcion import RecepcionInvalida, leer_csv
+from .subidas import mensaje_pixeles
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Row, Column, Submit, Reset, ButtonHolder, Field, Div, HTML
 from crispy_forms.bootstrap import AppendedText, PrependedText, FormActions
@@ -22,28 +26,45 @@ class ProductoForm(forms.ModelForm):
             "stock_minimo": "Se mostrará una alerta cuando el stock esté por debajo de ese valor",
             "sku": "Dejar vacío para generar automáticamente un SKU único",
         }
+    # Las subclases que nunca se dibujan se ahorran armar el FormHelper de crispy
+    con_helper = True
+
     def __init__(self, *args, **kwargs):
+        # Imágenes que productos.subidas cortó mientras llegaban: {campo: motivo}
+        self.errores_subida = kwargs.pop('errores_subida', None) or {}
         super().__init__(*args, **kwargs)
-        self.helper = BaseFormHelper()
-        self.helper.layout = Layout(
-            Field('nombre'),
-            Field('descripcion'),
-            PrependedText('precio', '$', placeholder="0.00"),
-            Field('stock'),
-            Field('stock_minimo'),
-            Field('imagen'),
-            ButtonHolder(
-                Submit('submit', 'Guardar', css_class='btn btn-success'),
-                Reset('reset', 'Limpiar', css_class='btn btn-outline-secondary'),
-                HTML('<a href="{% url "productos:producto_list" %}" class="btn btn-secondary">Cancelar</a>')
+        if self.con_helper:
+            self.helper = BaseFormHelper()
+            self.helper.layout = Layout(
+                Field('nombre'),
+                Field('descripcion'),
+                PrependedText('precio', '$', placeholder="0.00"),
+                Field('stock'),
+                Field('stock_minimo'),
+                Field('imagen'),
+                ButtonHolder(
+                    Submit('submit', 'Guardar', css_class='btn btn-success'),
+                    Reset('reset', 'Limpiar', css_class='btn btn-outline-secondary'),
+                    HTML('<a href="{% url "productos:producto_list" %}" class="btn btn-secondary">Cancelar</a>')
+                )
             )
-        )
     def clean_precio(self):
         precio = self.cleaned_data.get('precio')
         if precio and precio <= 0:
             raise ValidationError("El precio debe ser mayor a 0.")
         return precio
 
+    def clean_imagen(self):
+        if 'imagen' in self.errores_subida:
+            raise ValidationError(self.errores_subida['imagen'])
+        imagen = self.cleaned_data.get('imagen')
+        # `image` lo deja el ImageField con la imagen ya verificada (sólo se leyó la cabecera)
+        if getattr(imagen, 'image', None) is not None:
+            ancho, alto = imagen.image.size
+            if ancho * alto > settings.PRODUCTOS_IMAGEN_MAX_PIXELES:
+                raise ValidationError(mensaje_pixeles(ancho, alto))
+        return imagen
+
     def clean_stock(self):
         stock = self.cleaned_data.get('stock')
         if stock and stock < 0:
@@ -55,6 +76,36 @@ class ProductoForm(forms.ModelForm):
         if stock_minimo and stock_minimo < 0:
             raise ValidationError("No puede haber valor negativo en stock mínimo.")
         return stock_minimo
+class ImportacionProductoForm(ProductoForm):
+    """ProductoForm para una fila de una importación (ver productos.importacion): mismas reglas, sin imagen."""
+
+    class Meta(ProductoForm.Meta):
+        fields = ['sku', 'nombre', 'descripcion', 'precio', 'stock', 'stock_minimo']
+
+    # Se arma uno por fila y no se dibuja
+    con_helper = False
+
+    def validate_unique(self):
+        # Un SKU que ya existe no es un error: la importación actualiza ese producto.
+        # Validarlo acá costaría una consulta por fila
+        pass
+
+class ImportarProductosForm(forms.Form):
+    archivo = forms.FileField(
+        label="Archivo",
+        validators=[FileExtensionValidator(allowed_extensions=['csv', 'xlsx'])],
+        help_text="CSV o XLSX con las columnas sku, nombre, descripcion, precio, stock y stock_minimo."
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = BaseFormHelper()
+        self.helper.form_tag = False
+        self.helper.disable_csrf = True
+        self.helper.layout = Layout(
+            Field('archivo'),
+        )
+
 class MovimientoStockForm(forms.ModelForm):
     class Meta:
         model = MovimientoStock
@@ -70,6 +121,11 @@ class MovimientoStockForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.producto = kwargs.pop("producto", None)
         super().__init__(*args, **kwargs)
+        # Un ajuste tiene que mover el stock por su diferencia (AjusteStockView,
+        # conteos, auditoría); cargado acá quedaría sólo en el libro
+        self.fields['tipo'].choices = [
+            (valor, texto) for valor, texto in self.fields['tipo'].choices if valor != 'ajuste'
+        ]
         self.helper = BaseFormHelper()
         stock_info = ""
         if self.producto:
@@ -138,6 +194,106 @@ class AjusteStockForm(forms.Form):
             )
         )
 
+class RecepcionMercaderiaForm(forms.Form):
+    """Líneas `sku,cantidad` pegadas o en un archivo CSV (ver productos.recepcion)."""
+
+    lineas = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={'rows': 12, 'placeholder': 'PROD-100001,24\nPROD-100002,6'}),
+        label="Líneas",
+        help_text="Una línea por producto: SKU y cantidad separados por coma, punto y coma o tabulador."
+    )
+    archivo = forms.FileField(
+        required=False,
+        label="Archivo CSV",
+        help_text="En lugar de pegar las líneas, el CSV del remito con las mismas dos columnas."
+    )
+    motivo = forms.CharField(
+        required=False,
+        max_length=200,
+        label="Motivo",
+        help_text="Por ejemplo el número de remito (opcional)."
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = BaseFormHelper()
+        self.helper.form_tag = False
+        self.helper.disable_csrf = True
+        self.helper.layout = Layout(
+            Field('lineas'),
+            Field('archivo'),
+            Field('motivo'),
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        archivo = cleaned_data.get('archivo')
+        if archivo:
+            datos = archivo.read()
+            try:
+                texto = datos.decode('utf-8-sig')
+            except UnicodeDecodeError:
+                # Las planillas exportadas en Windows suelen venir en latin-1
+                texto = datos.decode('latin-1')
+        else:
+            texto = cleaned_data.get('lineas', '')
+        if not texto.strip():
+            raise ValidationError("Pegue las líneas o suba un archivo CSV.")
+        try:
+            cleaned_data['items'] = leer_csv(texto)
+        except RecepcionInvalida as e:
+            raise ValidationError(e.errores)
+        return cleaned_data
+
+class ConteoStockForm(forms.ModelForm):
+    class Meta:
+        model = ConteoStock
+        fields = ['nombre']
+        widgets = {
+            'nombre': forms.TextInput(attrs={'placeholder': 'Inventario anual 2026'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = BaseFormHelper()
+        self.helper.form_tag = False
+        self.helper.disable_csrf = True
+        self.helper.layout = Layout(
+            Field('nombre'),
+        )
+
+class LoteConteoForm(forms.Form):
+    """Un lote de cantidades contadas `sku,cantidad`, como las manda un lector (ver productos.conteo)."""
+
+    MODO_CHOICES = [
+        ('sumar', 'Sumar a lo ya contado'),
+        ('reemplazar', 'Reemplazar lo ya contado'),
+    ]
+
+    lineas = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 8, 'placeholder': 'PROD-100001,24\nPROD-100002,0'}),
+        label="Líneas",
+        help_text="Una línea por producto: SKU y cantidad contada."
+    )
+    modo = forms.ChoiceField(choices=MODO_CHOICES, initial='sumar', label="Modo")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = BaseFormHelper()
+        self.helper.form_tag = False
+        self.helper.disable_csrf = True
+        self.helper.layout = Layout(
+            Field('lineas'),
+            Field('modo'),
+        )
+
+    def clean_lineas(self):
+        try:
+            return leer_csv(self.cleaned_data['lineas'], minimo=0)
+        except RecepcionInvalida as e:
+            raise ValidationError(e.errores)
+
 class FiltroFormHelper(FormHelper):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -163,7 +319,8 @@ class FiltroProductosForm(forms.Form):
     buscar = forms.CharField(
         required=False,
         label="Buscar",
-        widget=forms.TextInput(attrs={'placeholder': 'Nombre, descripción...'})
+        max_length=100,
+        widget=forms.TextInput(attrs={'placeholder': 'SKU, nombre, descripción...'})
     )
 
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,110 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+CARPETA_VARIANTES = 'productos/variantes'
+# formato -> opciones de Image.save
+FORMATOS = {
+    'avif': {'quality': 55},
+    'webp': {'quality': 80, 'method': 4},
+}
+
+_pool = None
+_lock = threading.Lock()
+
+
+def formatos_disponibles():
+    return [formato for formato in FORMATOS if features.check(formato)]
+
+
+def generar_variantes(producto_id, nombre):
+    """Genera las variantes de la imagen `nombre` del producto y las registra en el modelo.
+
+    El original no se toca. Si cuando termina el producto ya tiene otra
+    imagen, descarta lo generado; si no, guarda las rutas y borra las
+    variantes de la imagen anterior. Devuelve el dict de variantes o None.
+    """
+    from .models import Producto
+
+    with default_storage.open(nombre, 'rb') as archivo:
+        original = Image.open(archivo)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    base = os.path.splitext(os.path.basename(nombre))[0]
+    variantes = {'origen': nombre}
+    for formato in formatos_disponibles():
+        variantes[formato] = {}
+        for tamano in settings.PRODUCTOS_IMAGENES_TAMANOS:
+            copia = original.copy()
+            copia.thumbnail((tamano, tamano))
+            contenido = io.BytesIO()
+            copia.save(contenido, formato.upper(), **FORMATOS[formato])
+            ruta = default_storage.save(
+                f'{CARPETA_VARIANTES}/{base}-{tamano}.{formato}', ContentFile(contenido.getvalue())
+            )
+            variantes[formato][str(tamano)] = ruta
+
+    with transaction.atomic():
+        anteriores = (
+            Producto.objects.select_for_update().filter(pk=producto_id, imagen=nombre)
+            .values_list('imagen_variantes', flat=True).first()
+        )
+        vigente = anteriores is not None
+        if vigente:
+            # update() y no save(): no vuelve a disparar el procesamiento
+            Producto.objects.filter(pk=producto_id).update(imagen_variantes=variantes)
+    if not vigente:
+        borrar_variantes(variantes)
+        return None
+    borrar_variantes(anteriores)
+    return variantes
+
+
+def borrar_variantes(variantes):
+    for formato in FORMATOS:
+        for ruta in (variantes or {}).get(formato, {}).values():
+            try:
+                default_storage.delete(ruta)
+            except OSError:
+                logger.warning('No se pudo borrar la variante %s', ruta)
+
+
+def _trabajo(producto_id, nombre):
+    close_old_connections()
+    try:
+        generar_variantes(producto_id, nombre)
+    except Exception:
+        logger.exception('Error al generar las variantes de la imagen del producto %s', producto_id)
+    finally:
+        connections.close_all()
+
+
+def _obtener_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(settings.PRODUCTOS_IMAGENES_HILOS, thread_name_prefix='imagenes')
+        return _pool
+
+
+def programar_variantes(producto):
+    """Encola la generación de variantes para cuando se confirme la transacción.
+
+    Corre en un pool de hilos del proceso, fuera del request. Si el proceso
+    se reinicia antes de terminar, `generar_variantes_imagenes` lo completa.
+    """
+    producto_id, nombre = producto.pk, producto.imagen.name
+    transaction.on_commit(lambda: _obtener_pool().submit(_trabajo, producto_id, nombre))
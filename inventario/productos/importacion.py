@@ -0,0 +1,276 @@
+import codecs
+import csv
+import os
+import tempfile
+from itertools import chain, islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .busqueda import indice_productos, texto_busqueda
+from .cache import cache_productos, contador_stock_bajo
+from .forms import ImportacionProductoForm
+from .models import SKU_PRODUCTOS, MovimientoStock, Producto
+
+COLUMNAS = ('sku', 'nombre', 'descripcion', 'precio', 'stock', 'stock_minimo')
+# Lo que se cambia de un producto que ya existe; el stock no: se mueve con
+# movimientos, recepciones o conteos para que el libro siga cuadrando
+ACTUALIZABLES = ('nombre', 'descripcion', 'precio', 'stock_minimo', 'texto_busqueda', 'fecha_modificacion')
+FORMATOS = ('csv', 'xlsx')
+LOTE = 1000
+MAX_ERRORES = 100
+MOTIVO = 'Stock inicial (importación)'
+# Una celda que empieza así Excel la evalúa como fórmula
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+TEXTOS = ('sku', 'nombre', 'descripcion')
+
+
+class ImportacionInvalida(Exception):
+    pass
+
+
+class Resumen:
+    """Resultado de una importación: cantidades y los primeros MAX_ERRORES errores por fila."""
+
+    def __init__(self):
+        self.creados = 0
+        self.actualizados = 0
+        self.con_errores = 0
+        self.errores = []  # [(fila, mensaje)]
+
+    def error(self, fila, mensaje):
+        self.con_errores += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append((fila, mensaje))
+
+
+def formato_de(nombre):
+    formato = os.path.splitext(nombre or '')[1].lower().lstrip('.')
+    if formato not in FORMATOS:
+        raise ImportacionInvalida(f'Formato no soportado: use {" o ".join(FORMATOS)}.')
+    return formato
+
+
+def _filas_csv(archivo, encoding):
+    # Línea por línea (los File de Django y los archivos binarios se recorren así)
+    lineas = codecs.iterdecode(archivo, encoding)
+    encabezado = next(lineas, '').lstrip('\ufeff')
+    try:
+        separador = csv.Sniffer().sniff(encabezado, delimiters=',;\t').delimiter
+    except csv.Error:
+        separador = ','
+    # Del encabezado sólo se toma el separador: sin comillas en él, el Sniffer
+    # también supondría que "" no escapa una comilla y rompería esos textos
+    yield from csv.reader(chain([encabezado], lineas), delimiter=separador)
+
+
+def _texto_celda(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        # Excel guarda todos los números como float: 12 llega como 12.0
+        return str(int(valor))
+    return str(valor)
+
+
+def _filas_xlsx(archivo):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportacionInvalida('Para importar XLSX hace falta instalar openpyxl.')
+    # read_only lee la hoja a medida que se recorre, sin cargarla entera
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        for fila in libro.worksheets[0].iter_rows(values_only=True):
+            yield [_texto_celda(valor) for valor in fila]
+    finally:
+        libro.close()
+
+
+def leer_filas(archivo, formato, encoding='utf-8'):
+    """Recorre un CSV o XLSX de productos y genera (número de fila, {columna: valor}).
+
+    La primera fila tiene los nombres de las columnas (las de COLUMNAS, en
+    cualquier orden; `nombre`, `descripcion` y `precio` son obligatorias). Lee el
+    archivo de a una fila: la memoria no depende de su tamaño.
+    """
+    filas = _filas_csv(archivo, encoding) if formato == 'csv' else _filas_xlsx(archivo)
+    encabezado = [columna.strip().lower() for columna in next(filas, [])]
+    faltan = {'nombre', 'descripcion', 'precio'} - set(encabezado)
+    if faltan:
+        raise ImportacionInvalida(f'Faltan las columnas: {", ".join(sorted(faltan))}.')
+    indices = [(columna, i) for i, columna in enumerate(encabezado) if columna in COLUMNAS]
+    for numero, fila in enumerate(filas, start=2):
+        if not any(valor.strip() for valor in fila):
+            continue
+        yield numero, {columna: _sin_escape(fila[i].strip()) if i < len(fila) else '' for columna, i in indices}
+
+
+def _sin_escape(valor):
+    """Deshace el apóstrofo que exportar_csv antepone a los textos que parecen fórmulas."""
+    if valor[:1] == "'" and valor[1:2] in INICIO_FORMULA:
+        return valor[1:]
+    return valor
+
+
+def _validar(lote, resumen):
+    """Valida las filas del lote con las reglas de ProductoForm y devuelve {sku: (fila, datos)}.
+
+    La unicidad del SKU no se valida acá: un SKU que ya existe actualiza
+    ese producto. Si el SKU se repite en el lote gana la última fila. Los
+    SKU generados para las filas sin SKU no repiten uno explícito del lote.
+    """
+    validas = {}
+    sin_sku = []
+    for numero, datos in lote:
+        # Columnas ausentes o vacías toman el valor por defecto del modelo
+        for campo in ('stock', 'stock_minimo'):
+            if not datos.get(campo):
+                datos[campo] = Producto._meta.get_field(campo).default
+        form = ImportacionProductoForm(data=datos)
+        if not form.is_valid():
+            mensajes = '; '.join(f'{campo}: {" ".join(errores)}' for campo, errores in form.errors.items())
+            resumen.error(numero, mensajes)
+            continue
+        if form.cleaned_data['sku']:
+            validas[form.cleaned_data['sku']] = (numero, form.cleaned_data)
+        else:
+            sin_sku.append((numero, form.cleaned_data))
+    for numero, datos in sin_sku:
+        sku = SKU_PRODUCTOS.siguiente()
+        while sku in validas:
+            # Otra fila del lote ya trae ese SKU: pisarla perdería una de las dos
+            sku = SKU_PRODUCTOS.siguiente()
+        validas[sku] = (numero, datos)
+    return validas
+
+
+def _guardar(validas, usuario, resumen):
+    """Crea o actualiza los productos de un lote validado con un solo upsert por SKU.
+
+    INSERT ... ON CONFLICT (sku) DO UPDATE: un UPDATE con un CASE por
+    columna (bulk_update) se vuelve cuadrático con lotes grandes. Qué SKUs
+    ya existían se consulta antes, para registrar el stock inicial sólo de
+    los productos nuevos.
+    """
+    existentes = set(Producto.objects.filter(sku__in=validas).order_by().values_list('sku', flat=True))
+    ahora = timezone.now()
+    productos = [
+        Producto(
+            sku=sku, nombre=datos['nombre'], descripcion=datos['descripcion'], precio=datos['precio'],
+            stock=datos['stock'], stock_minimo=datos['stock_minimo'], fecha_modificacion=ahora,
+            # bulk_create no pasa por Producto.save()
+            texto_busqueda=texto_busqueda(sku, datos['nombre'], datos['descripcion']),
+        )
+        for sku, (_, datos) in validas.items()
+    ]
+
+    with transaction.atomic():
+        Producto.objects.bulk_create(
+            productos, batch_size=LOTE,
+            update_conflicts=True, unique_fields=['sku'], update_fields=ACTUALIZABLES,
+        )
+        if productos[0].pk is None:
+            # Motores que no devuelven los ids de un INSERT múltiple
+            ids = dict(Producto.objects.filter(sku__in=validas).values_list('sku', 'pk'))
+            for producto in productos:
+                producto.pk = ids[producto.sku]
+        nuevos = [p for p in productos if p.sku not in existentes]
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(producto_id=p.pk, tipo='entrada', cantidad=p.stock, motivo=MOTIVO, usuario=usuario)
+            for p in nuevos if p.stock > 0
+        ], batch_size=LOTE)
+        # Sin post_save: se invalida lo mismo que invalidan las señales de Producto
+        cache_productos.invalidar_al_confirmar([p.pk for p in productos if p.sku in existentes])
+        contador_stock_bajo.invalidar_al_confirmar()
+        transaction.on_commit(indice_productos.limpiar)
+    resumen.creados += len(nuevos)
+    resumen.actualizados += len(productos) - len(nuevos)
+
+
+def importar_productos(archivo, formato, usuario='Sistema', encoding='utf-8', progreso=None):
+    """Importa productos desde un CSV o XLSX, por lotes de LOTE filas.
+
+    Cada lote se valida con las reglas de ProductoForm y se guarda en su
+    propia transacción con un upsert por SKU: los productos nuevos se crean
+    (con un movimiento de entrada por el stock inicial) y los que ya
+    existen se actualizan, salvo el stock. Las filas sin SKU reciben uno generado. Las filas
+    inválidas se saltean y quedan en el Resumen. Si se corta a mitad, los
+    lotes anteriores quedan guardados y volver a importar el archivo
+    actualiza en lugar de duplicar (salvo las filas sin SKU).
+    """
+    resumen = Resumen()
+    filas = leer_filas(archivo, formato, encoding)
+    try:
+        while lote := list(islice(filas, LOTE)):
+            validas = _validar(lote, resumen)
+            if validas:
+                _guardar(validas, usuario, resumen)
+            if progreso:
+                progreso(resumen)
+    except UnicodeDecodeError:
+        raise ImportacionInvalida(
+            f'El archivo no está en {encoding}; se importaron {resumen.creados + resumen.actualizados} filas.'
+        )
+    return resumen
+
+
+def productos_a_exportar():
+    # iterator() usa un cursor del lado del servidor en PostgreSQL: no trae la tabla entera
+    return Producto.objects.order_by('pk').values_list(*COLUMNAS).iterator(chunk_size=2000)
+
+
+class _Eco:
+    """Destino de csv.writer que devuelve lo escrito en lugar de guardarlo."""
+
+    def write(self, valor):
+        return valor
+
+
+def _escapar(valor):
+    # "'" al principio hace que Excel muestre el texto tal cual; importar lo quita.
+    # Un signo solo (la descripción '-') no es una fórmula
+    if len(valor) > 1 and valor[0] in INICIO_FORMULA:
+        return "'" + valor
+    return valor
+
+
+def _exportable(fila):
+    """Fila de productos_a_exportar con los textos cargados por usuarios escapados."""
+    return [_escapar(valor) if columna in TEXTOS else valor for columna, valor in zip(COLUMNAS, fila)]
+
+
+def exportar_csv():
+    """Genera el CSV de todos los productos por bloques de LOTE líneas, para una StreamingHttpResponse.
+
+    Los textos cargados por usuarios que empiezan como una fórmula (=, +,
+    -, @) se exportan con un apóstrofo adelante: el BOM hace que Excel
+    abra el archivo directamente y los evaluaría.
+    """
+    escritor = csv.writer(_Eco())
+    yield '\ufeff' + escritor.writerow(COLUMNAS)  # BOM: Excel lo abre como UTF-8
+    filas = productos_a_exportar()
+    while bloque := list(islice(filas, LOTE)):
+        yield ''.join(escritor.writerow(_exportable(fila)) for fila in bloque)
+
+
+def exportar_xlsx():
+    """Escribe el XLSX de todos los productos en un archivo temporal y lo devuelve abierto.
+
+    openpyxl en modo write_only vuelca las filas a disco a medida que se
+    agregan; el archivo se borra al cerrarlo. Los textos se escapan como en
+    exportar_csv: openpyxl guarda como fórmula todo texto que empieza con =.
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ImportacionInvalida('Para exportar XLSX hace falta instalar openpyxl.')
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Productos')
+    hoja.append(COLUMNAS)
+    for fila in productos_a_exportar():
+        hoja.append(_exportable(fila))
+    salida = tempfile.TemporaryFile(suffix='.xlsx')
+    libro.save(salida)
+    salida.seek(0)
+    return salida
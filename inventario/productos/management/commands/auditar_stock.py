@@ -0,0 +1,64 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.auditoria import Checkpoint, auditar
+
+MAX_LISTADO = 50
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el stock de cada producto con el saldo del libro de movimientos, en rangos de ids '
+        'repartidos entre varios hilos, y reporta o corrige las diferencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamano', type=int, default=5000, help='Productos por rango')
+        parser.add_argument('--hilos', type=int, default=4)
+        parser.add_argument(
+            '--corregir', choices=('libro', 'stock'),
+            help="'libro' agrega un ajuste por la diferencia; 'stock' fija el stock al saldo del libro",
+        )
+        parser.add_argument('--usuario', default='Sistema', help='Usuario de los ajustes que se registren')
+        parser.add_argument('--checkpoint', help='Archivo de progreso; si existe, la auditoría sigue desde ahí')
+        parser.add_argument('--salida', help='CSV con todas las diferencias encontradas')
+
+    def handle(self, *args, **options):
+        if options['tamano'] < 1:
+            raise CommandError('--tamano tiene que ser mayor a 0.')
+        try:
+            checkpoint = Checkpoint(options['checkpoint'], options['tamano'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if checkpoint.hechos:
+            self.stdout.write(f'Retomando: {len(checkpoint.hechos)} rangos ya auditados.')
+
+        def progreso(hechos, total):
+            self.stdout.write(f'\r{hechos}/{total} rangos', ending='')
+            self.stdout.flush()
+
+        inicio = time.perf_counter()
+        auditar(
+            options['tamano'], options['hilos'], options['corregir'], options['usuario'], checkpoint, progreso,
+        )
+        self.stdout.write('')
+
+        diferencias = sorted(checkpoint.diferencias)
+        for pk, sku, stock, libro in diferencias[:MAX_LISTADO]:
+            self.stdout.write(f'{pk:>10} {sku or "":<20} stock {stock:>8} libro {libro:>8} diferencia {stock - libro:>8}')
+        if len(diferencias) > MAX_LISTADO:
+            self.stdout.write(f'... y {len(diferencias) - MAX_LISTADO} más')
+        if options['salida']:
+            with open(options['salida'], 'w', newline='', encoding='utf-8') as archivo:
+                escritor = csv.writer(archivo)
+                escritor.writerow(['producto_id', 'sku', 'stock', 'libro', 'diferencia', 'corregido'])
+                for pk, sku, stock, libro in diferencias:
+                    escritor.writerow([pk, sku, stock, libro, stock - libro, pk in checkpoint.corregidos])
+
+        estilo = self.style.WARNING if len(diferencias) > len(checkpoint.corregidos) else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f'{len(diferencias)} productos con diferencias, {len(checkpoint.corregidos)} corregidos '
+            f'({time.perf_counter() - inicio:.1f}s).'
+        ))
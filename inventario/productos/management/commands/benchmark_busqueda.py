@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from productos.busqueda import buscar_productos, indice_productos, normalizar, texto_busqueda
+from productos.models import Producto
+
+PALABRAS = [
+    'Yerba', 'Mate', 'Azúcar', 'Café', 'Té', 'Leche', 'Galletitas', 'Dulce', 'Arroz', 'Fideos',
+    'Aceite', 'Harina', 'Jabón', 'Limón', 'Manzana', 'Chocolate', 'Queso', 'Jamón', 'Pañales', 'Champú',
+]
+MARCAS = ['Ñandú', 'Cóndor', 'Pampa', 'Andina', 'Río', 'Sur', 'Norte', 'Lapacho']
+PRESENTACIONES = ['500 g', '1 kg', '1 l', '250 ml', 'x 12', 'x 6', 'familiar', 'light']
+
+
+def producto_aleatorio(i):
+    nombre = f'{random.choice(PALABRAS)} {random.choice(MARCAS)} {random.choice(PRESENTACIONES)}'
+    descripcion = ' '.join(random.sample(PALABRAS, 3))
+    sku = f'BENCH-{i:07d}'
+    return Producto(
+        sku=sku, nombre=nombre, descripcion=descripcion, precio=1, stock=random.randint(0, 50),
+        texto_busqueda=texto_busqueda(sku, nombre, descripcion),
+    )
+
+
+def consultas_aleatorias(cantidad, productos):
+    """Mezcla de prefijos, palabras sin acento, errores de tipeo y SKUs."""
+    consultas = []
+    for _ in range(cantidad):
+        palabra = normalizar(random.choice(PALABRAS + MARCAS))
+        tipo = random.randrange(4)
+        if tipo == 0:
+            consultas.append(palabra[:4])
+        elif tipo == 1:
+            consultas.append(f'{palabra} {normalizar(random.choice(MARCAS))}')
+        elif tipo == 2 and len(palabra) > 4:
+            i = random.randrange(1, len(palabra) - 1)
+            consultas.append(palabra[:i] + palabra[i + 1] + palabra[i] + palabra[i + 2:])
+        else:
+            consultas.append(f'BENCH-{random.randrange(productos):07d}')
+    return consultas
+
+
+def medir(consultas, buscar):
+    """Milisegundos por consulta de lo que hace el listado: contar y traer la primera página."""
+    tiempos = []
+    for texto in consultas:
+        inicio = time.perf_counter()
+        queryset = buscar(texto)
+        queryset.count()
+        list(queryset[:10])
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+class Command(BaseCommand):
+    help = 'Mide la búsqueda de productos con índices contra un icontains sobre N productos de prueba.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cantidad', type=int, default=1_000_000, help='Productos de prueba a insertar')
+        parser.add_argument('--consultas', type=int, default=100)
+        parser.add_argument('--sin-icontains', action='store_true', help='No medir el recorrido con icontains')
+
+    def handle(self, *args, **options):
+        cantidad = options['cantidad']
+        base = Producto.objects.filter(sku__startswith='BENCH-')
+        # Todo se deshace al final para no dejar datos de prueba
+        with transaction.atomic():
+            inicio = time.perf_counter()
+            for desde in range(0, cantidad, 10000):
+                Producto.objects.bulk_create(
+                    [producto_aleatorio(i) for i in range(desde, min(desde + 10000, cantidad))],
+                    batch_size=2000,
+                )
+            self.stdout.write(f'Insertados {cantidad} productos en {time.perf_counter() - inicio:.1f} s')
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE productos_producto')
+            else:
+                inicio = time.perf_counter()
+                indice_productos.limpiar()
+                indice_productos.buscar('mate', Producto)
+                self.stdout.write(f'Índice en memoria construido en {time.perf_counter() - inicio:.1f} s')
+
+            consultas = consultas_aleatorias(options['consultas'], cantidad)
+            metodos = [('indice', lambda texto: buscar_productos(base, texto))]
+            if not options['sin_icontains']:
+                metodos.append(('icontains', lambda texto: base.filter(
+                    Q(sku__icontains=texto) | Q(nombre__icontains=texto) | Q(descripcion__icontains=texto)
+                ).order_by('nombre')))
+            for nombre, buscar in metodos:
+                tiempos = sorted(medir(consultas, buscar))
+                self.stdout.write(
+                    f'{nombre:>10}: p50 {statistics.median(tiempos):8.1f} ms, '
+                    f'p95 {tiempos[int(len(tiempos) * 0.95) - 1]:8.1f} ms ({len(tiempos)} consultas, {connection.vendor})'
+                )
+            transaction.set_rollback(True)
+        indice_productos.limpiar()
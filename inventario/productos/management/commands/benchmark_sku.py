@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from productos.models import Producto
+from productos.sku import AsignadorSku
+
+
+def sku_aleatorio():
+    """Generador anterior: número aleatorio de 5 dígitos + exists() en bucle."""
+    while True:
+        sku = f"PROD-{random.randint(10000, 99999)}"
+        if not Producto.objects.filter(sku=sku).exists():
+            return sku
+
+
+class Command(BaseCommand):
+    help = 'Compara el throughput de inserción de productos con el SKU aleatorio anterior y el asignador por bloques.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cantidad', type=int, default=2000, help='Productos a insertar por método')
+        parser.add_argument(
+            '--ocupacion', type=float, default=0.5,
+            help='Fracción del rango de 5 dígitos ya ocupada antes de medir (0 a 0.95)',
+        )
+
+    def handle(self, *args, **options):
+        cantidad = options['cantidad']
+        ocupacion = min(max(options['ocupacion'], 0), 0.95)
+        libres = 90000 - int(90000 * ocupacion)
+        if cantidad > libres:
+            # El generador anterior quedaría en un bucle infinito
+            raise CommandError(f'Con esa ocupación el generador aleatorio solo admite {libres} productos más.')
+        asignador = AsignadorSku('PROD', 'productos.Producto')
+
+        for nombre, generar in (('aleatorio', sku_aleatorio), ('bloques', asignador.siguiente)):
+            # Todo se deshace al final para no dejar datos de prueba
+            with transaction.atomic():
+                ocupados = random.sample(range(10000, 100000), int(90000 * ocupacion))
+                Producto.objects.bulk_create(
+                    [Producto(sku=f'PROD-{n}', nombre='Relleno', descripcion='', precio=1) for n in ocupados],
+                    batch_size=2000,
+                )
+                inicio = time.perf_counter()
+                for i in range(cantidad):
+                    Producto.objects.create(
+                        sku=generar(), nombre=f'Benchmark {i}', descripcion='', precio=1
+                    )
+                duracion = time.perf_counter() - inicio
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f'{nombre:>10}: {cantidad / duracion:8.1f} inserciones/s '
+                f'({duracion * 1000 / cantidad:.2f} ms por producto, ocupación {ocupacion:.0%})'
+            )
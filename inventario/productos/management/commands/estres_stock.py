@@ -0,0 +1,113 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+
+from clientes.models import Cliente
+from productos.models import Producto
+from productos.services import StockInsuficiente
+from ventas.models import Venta, ItemVenta
+from ventas.services import anular_ventas, registrar_venta
+
+
+class Command(BaseCommand):
+    help = 'Dispara ventas concurrentes contra un producto y reporta throughput, espera de bloqueo y sobreventa.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=8)
+        parser.add_argument('--ventas', type=int, default=50, help='Ventas por hilo')
+        parser.add_argument('--cantidad', type=int, default=1, help='Unidades por venta')
+        parser.add_argument('--stock', type=int, default=200, help='Stock inicial del producto de prueba')
+        parser.add_argument('--producto', type=int, help='Usar un producto existente en lugar de crear uno')
+
+    def handle(self, *args, **options):
+        if options['producto']:
+            try:
+                producto = Producto.objects.get(pk=options['producto'])
+            except Producto.DoesNotExist:
+                raise CommandError('El producto no existe.')
+            temporal = False
+        else:
+            producto = Producto.objects.create(
+                nombre='Producto de estrés',
+                descripcion='Creado por estres_stock',
+                precio=1,
+                stock=options['stock'],
+            )
+            temporal = True
+        cliente = Cliente.objects.create(
+            nombre='Cliente', apellido='de estrés', numero_documento=f'estres-{uuid.uuid4().hex[:12]}',
+        )
+
+        stock_inicial = producto.stock
+        cantidad = options['cantidad']
+        lock = threading.Lock()
+        resultados = {'ok': 0, 'sin_stock': 0, 'errores': 0, 'esperas': [], 'ventas': []}
+
+        def vender():
+            try:
+                for _ in range(options['ventas']):
+                    inicio = time.perf_counter()
+                    venta = None
+                    try:
+                        # El mismo camino que una venta real: reserva, venta, items, movimientos y resúmenes
+                        venta = registrar_venta(
+                            Venta(cliente=cliente),
+                            [ItemVenta(producto=producto, cantidad=cantidad, precio_unitario=producto.precio)],
+                            'estres_stock',
+                        )
+                        clave = 'ok'
+                    except StockInsuficiente:
+                        clave = 'sin_stock'
+                    except DatabaseError:
+                        clave = 'errores'
+                    espera = time.perf_counter() - inicio
+                    with lock:
+                        resultados[clave] += 1
+                        resultados['esperas'].append(espera)
+                        if venta:
+                            resultados['ventas'].append(venta.pk)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=vender) for _ in range(options['hilos'])]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        producto.refresh_from_db()
+        vendido = sum(ItemVenta.objects.filter(venta__cliente=cliente).values_list('cantidad', flat=True))
+        esperado = stock_inicial - vendido
+        negativo = max(0, -producto.stock)
+        # Stock por encima de lo esperado: ventas confirmadas que no descontaron (actualizaciones perdidas)
+        descuadre = producto.stock - esperado
+        esperas = sorted(resultados['esperas']) or [0]
+
+        self.stdout.write(f"Ventas confirmadas: {resultados['ok']} ({vendido} unidades)")
+        self.stdout.write(f"Rechazadas por stock: {resultados['sin_stock']}")
+        self.stdout.write(f"Errores de base de datos: {resultados['errores']}")
+        self.stdout.write(f"Throughput: {len(resultados['esperas']) / duracion:.1f} ventas/s")
+        self.stdout.write(
+            f"Duración por venta (incluye la espera de bloqueo): media {sum(esperas) / len(esperas) * 1000:.2f} ms, "
+            f"p95 {esperas[int(len(esperas) * 0.95) - 1] * 1000:.2f} ms, máx {esperas[-1] * 1000:.2f} ms"
+        )
+        self.stdout.write(f"Stock final: {producto.stock} (esperado {esperado})")
+        if negativo:
+            self.stdout.write(self.style.ERROR(f'Stock negativo: {negativo} unidades'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Stock negativo: 0'))
+        if descuadre:
+            self.stdout.write(self.style.ERROR(f'Diferencia con lo vendido: {descuadre:+d} unidades'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Diferencia con lo vendido: 0'))
+
+        # Deshacer las ventas de prueba devuelve el stock y descuenta los resúmenes
+        anular_ventas(resultados['ventas'], 'estres_stock')
+        cliente.delete()
+        if temporal:
+            producto.delete()
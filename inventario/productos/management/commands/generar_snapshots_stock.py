@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from productos.historico import borrar_snapshots_desde, generar_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Guarda el saldo del libro de movimientos de los productos que tuvieron movimientos '
+        'desde su último snapshot. Pensado para correr periódicamente (por ejemplo, cada noche).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help='Fecha y hora del snapshot (ISO 8601); por defecto, ahora menos 5 minutos')
+        parser.add_argument(
+            '--rehacer-desde', metavar='FECHA',
+            help='Borra los snapshots desde esa fecha antes de generar (tras cargar movimientos atrasados)',
+        )
+
+    def _fecha(self, valor):
+        try:
+            fecha = parse_datetime(valor)
+        except ValueError:
+            fecha = None
+        if fecha is None:
+            raise CommandError(f'Fecha inválida: {valor}')
+        return timezone.make_aware(fecha) if timezone.is_naive(fecha) else fecha
+
+    def handle(self, *args, **options):
+        fecha = self._fecha(options['fecha']) if options['fecha'] else None
+        if options['rehacer_desde']:
+            borrados = borrar_snapshots_desde(self._fecha(options['rehacer_desde']))
+            self.stdout.write(f'Snapshots borrados: {borrados}')
+        creados = generar_snapshots(fecha)
+        self.stdout.write(self.style.SUCCESS(f'Snapshots creados: {creados}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from productos.imagenes import generar_variantes
+from productos.models import Producto
+
+
+class Command(BaseCommand):
+    help = 'Genera las variantes WebP/AVIF de las imágenes de productos que no las tienen al día.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--todas', action='store_true', help='Regenera también las que ya están al día')
+
+    def handle(self, *args, **options):
+        productos = Producto.objects.exclude(imagen='').exclude(imagen__isnull=True).values_list(
+            'pk', 'imagen', 'imagen_variantes'
+        )
+        generadas = errores = 0
+        for pk, imagen, variantes in productos.iterator():
+            if not options['todas'] and (variantes or {}).get('origen') == imagen:
+                continue
+            try:
+                generar_variantes(pk, imagen)
+                generadas += 1
+            except Exception as e:
+                errores += 1
+                self.stderr.write(f'Producto {pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Variantes generadas para {generadas} productos ({errores} con errores).'))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.importacion import FORMATOS, ImportacionInvalida, formato_de, importar_productos
+
+
+class Command(BaseCommand):
+    help = 'Crea o actualiza productos desde un CSV o XLSX, por lotes y sin cargar el archivo entero en memoria.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo')
+        parser.add_argument('--formato', choices=FORMATOS, help='Por defecto, el de la extensión del archivo')
+        parser.add_argument('--usuario', default='Sistema', help='Usuario de los movimientos de stock inicial')
+        parser.add_argument('--encoding', default='utf-8', help='Codificación del CSV (por ejemplo latin-1)')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+
+        def progreso(resumen):
+            filas = resumen.creados + resumen.actualizados + resumen.con_errores
+            self.stdout.write(f'\r{filas} filas ({filas / (time.perf_counter() - inicio):.0f}/s)', ending='')
+            self.stdout.flush()
+
+        try:
+            formato = options['formato'] or formato_de(options['archivo'])
+            with open(options['archivo'], 'rb') as archivo:
+                resumen = importar_productos(archivo, formato, options['usuario'], options['encoding'], progreso)
+        except (ImportacionInvalida, OSError) as e:
+            raise CommandError(str(e))
+        self.stdout.write('')
+
+        for fila, mensaje in resumen.errores:
+            self.stdout.write(f'Fila {fila}: {mensaje}')
+        if resumen.con_errores > len(resumen.errores):
+            self.stdout.write(f'... y {resumen.con_errores - len(resumen.errores)} filas más con errores')
+        estilo = self.style.WARNING if resumen.con_errores else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f'{resumen.creados} productos creados, {resumen.actualizados} actualizados, '
+            f'{resumen.con_errores} filas con errores ({time.perf_counter() - inicio:.1f}s).'
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+SECUENCIAS = ['sku_prod_seq', 'sku_vent_seq']
+
+
+def crear_secuencias(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for secuencia in SECUENCIAS:
+        schema_editor.execute(f'CREATE SEQUENCE IF NOT EXISTS {secuencia} START WITH 100000 INCREMENT BY 100')
+
+
+def borrar_secuencias(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for secuencia in SECUENCIAS:
+        schema_editor.execute(f'DROP SEQUENCE IF EXISTS {secuencia}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecuenciaSku',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefijo', models.CharField(max_length=10, unique=True, verbose_name='Prefijo')),
+                ('siguiente', models.BigIntegerField(default=100000, verbose_name='Siguiente número')),
+            ],
+            options={
+                'verbose_name': 'Secuencia de SKU',
+                'verbose_name_plural': 'Secuencias de SKU',
+            },
+        ),
+        migrations.RunPython(crear_secuencias, borrar_secuencias),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+# Índices trigram sobre las mismas expresiones que genera Django para
+# istartswith/icontains en PostgreSQL (UPPER(col::text) LIKE UPPER(...)),
+# así el autocompletado de productos no recorre la tabla.
+INDICES = {
+    'productos_producto_nombre_trgm': 'nombre',
+    'productos_producto_sku_trgm': 'sku',
+}
+
+
+def crear_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for nombre, columna in INDICES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {nombre} ON productos_producto '
+            f'USING gin ((UPPER({columna}::text)) gin_trgm_ops)'
+        )
+
+
+def borrar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre in INDICES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0002_secuenciasku'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
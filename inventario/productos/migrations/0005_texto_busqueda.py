@@ -0,0 +1,69 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:09
+
+import unicodedata
+
+from django.db import migrations, models
+
+# Copia de productos.busqueda tal como estaba al crear la migración: las
+# migraciones no importan código de la app, que puede cambiar después
+CONFIGURACION = 'simple'
+
+
+def texto_busqueda(sku, nombre, descripcion):
+    texto = unicodedata.normalize('NFKD', ' '.join(filter(None, (sku, nombre, descripcion))))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.casefold().split())
+
+
+# Los mismos SQL que arma productos.busqueda en PostgreSQL: el vector es el de
+# SearchVector('texto_busqueda', config=...) y el trigram sirve a %> (trigram_word_similar)
+INDICES = {
+    'productos_producto_busqueda_tsv': (
+        f"gin (to_tsvector('{CONFIGURACION}'::regconfig, COALESCE(texto_busqueda, '')))"
+    ),
+    'productos_producto_busqueda_trgm': 'gin (texto_busqueda gin_trgm_ops)',
+}
+
+
+def completar_texto(apps, schema_editor):
+    Producto = apps.get_model('productos', 'Producto')
+    lote = []
+    for producto in Producto.objects.only('sku', 'nombre', 'descripcion').iterator(chunk_size=2000):
+        producto.texto_busqueda = texto_busqueda(producto.sku, producto.nombre, producto.descripcion)
+        lote.append(producto)
+        if len(lote) == 2000:
+            Producto.objects.bulk_update(lote, ['texto_busqueda'])
+            lote = []
+    Producto.objects.bulk_update(lote, ['texto_busqueda'])
+
+
+def crear_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for nombre, definicion in INDICES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON productos_producto USING {definicion}')
+
+
+def borrar_indices(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for nombre in INDICES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {nombre}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0004_imagen_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='texto_busqueda',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Texto de búsqueda'),
+        ),
+        migrations.RunPython(completar_texto, migrations.RunPython.noop),
+        migrations.RunPython(crear_indices, borrar_indices),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0005_texto_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('stock__lt', models.F('stock_minimo'))), fields=['stock', 'id'], name='producto_stock_bajo_idx'),
+        ),
+    ]
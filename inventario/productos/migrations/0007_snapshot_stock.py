@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, TextField, Value
+from django.db.models.functions import Cast, Coalesce, Concat
+
+
+def neutralizar_ajustes_previos(apps, schema_editor):
+    """Deja en cero los ajustes cargados antes de leer el libro con signo.
+
+    Hasta ahora un movimiento de tipo 'ajuste' se guardaba con cantidad
+    positiva y no tocaba el stock; el libro ahora suma los ajustes con su
+    signo, así que se pasan a cantidad 0 y la cantidad original queda en el
+    motivo.
+    """
+    MovimientoStock = apps.get_model('productos', 'MovimientoStock')
+    MovimientoStock.objects.filter(tipo='ajuste').exclude(cantidad=0).update(
+        motivo=Concat(
+            Coalesce(F('motivo'), Value(''), output_field=TextField()), Value(' [cantidad registrada: '),
+            Cast('cantidad', TextField()), Value('; no movió el stock]'),
+            output_field=TextField(),
+        ),
+        cantidad=0,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0006_indice_stock_bajo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField(verbose_name='Fecha')),
+                ('stock', models.IntegerField(verbose_name='Stock')),
+            ],
+            options={
+                'verbose_name': 'Snapshot de stock',
+                'verbose_name_plural': 'Snapshots de stock',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='movimientostock',
+            index=models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='snapshotstock',
+            name='producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='productos.producto'),
+        ),
+        migrations.AddConstraint(
+            model_name='snapshotstock',
+            constraint=models.UniqueConstraint(fields=('producto', 'fecha'), name='snapshot_stock_producto_fecha_unico'),
+        ),
+        migrations.RunPython(neutralizar_ajustes_previos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_snapshot_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, verbose_name='Nombre')),
+                ('estado', models.CharField(choices=[('abierto', 'Abierto'), ('aplicado', 'Aplicado')], default='abierto', max_length=20, verbose_name='Estado')),
+                ('usuario', models.CharField(max_length=50, verbose_name='Usuario')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('fecha_aplicado', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de aplicación')),
+            ],
+            options={
+                'verbose_name': 'Conteo de stock',
+                'verbose_name_plural': 'Conteos de stock',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LineaConteo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField(verbose_name='Cantidad contada')),
+                ('stock_sistema', models.IntegerField(blank=True, null=True, verbose_name='Stock del sistema')),
+                ('conteo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas', to='productos.conteostock')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas_conteo', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Línea de conteo',
+                'verbose_name_plural': 'Líneas de conteo',
+                'constraints': [models.UniqueConstraint(fields=('conteo', 'producto'), name='linea_conteo_producto_unica')],
+            },
+        ),
+    ]
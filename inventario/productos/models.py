@@ -4,16 +4,26 @@ from django.db import models
 from django.db import models
 import os
 import uuid
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from PIL import Image
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.utils import timezone
-import random
-import string
+from .busqueda import texto_busqueda
+from .imagenes import borrar_variantes, programar_variantes
+from .sku import AsignadorSku
+
+SKU_PRODUCTOS = AsignadorSku('PROD', 'productos.Producto')
+
+# Condición de stock bajo. Es la misma del índice parcial de Producto: las
+# consultas tienen que usar exactamente esta expresión para aprovecharlo
+STOCK_BAJO = models.Q(stock__lt=models.F('stock_minimo'))
 
 def validate_image_size(image):
+   # Las subidas desde los formularios ya se cortan en productos.subidas; esto cubre el resto
    filesize = image.file.size
-   megabyte_limit = 5.0
-   if filesize > megabyte_limit * 1024 * 1024:
+   megabyte_limit = settings.PRODUCTOS_IMAGEN_MAX_BYTES / (1024 * 1024)
+   if filesize > settings.PRODUCTOS_IMAGEN_MAX_BYTES:
        raise ValidationError(f"El tamaño maximo permitido es {megabyte_limit} MB.")
 
 def get_image_path(instance, filename):
@@ -35,6 +45,10 @@ class Producto(models.Model):
        blank=True, 
        null=True,
        help_text='Formatos permitidos: JPG, PNG, GIF, WEBP, AVIF. Tamaño máximo: 5 MB.')
+    # {'origen': imagen, 'webp': {'100': ruta, ...}, 'avif': {...}} (ver productos.imagenes)
+    imagen_variantes = models.JSONField('Variantes de la imagen', default=dict, blank=True, editable=False)
+    # SKU, nombre y descripción normalizados (ver productos.busqueda); lo mantiene save()
+    texto_busqueda = models.TextField('Texto de búsqueda', default='', blank=True, editable=False)
     fecha_creacion = models.DateTimeField('Fecha de creación',
        auto_now_add=True)
     fecha_modificacion = models.DateTimeField('Fecha de modificación', 
@@ -44,31 +58,64 @@ class Producto(models.Model):
        verbose_name = 'Producto'
        verbose_name_plural = 'Productos'
        ordering = ['nombre']
+       indexes = [
+           # Sólo tiene las filas con stock bajo: listarlas y contarlas cuesta lo
+           # que haya bajo el mínimo, no el tamaño del catálogo
+           models.Index(fields=['stock', 'id'], condition=STOCK_BAJO, name='producto_stock_bajo_idx'),
+       ]
        
+    @classmethod
+    def from_db(cls, db, field_names, values):
+       instancia = super().from_db(db, field_names, values)
+       # Nombre de la imagen tal como está en la base, para saber en save() si cambió
+       if 'imagen' in instancia.__dict__:
+           instancia._imagen_guardada = instancia.imagen.name or ''
+       return instancia
+
     def save(self, *args, **kwargs):
        if not self.sku:
             self.sku = self.generar_sku_unico()
+       self.texto_busqueda = texto_busqueda(self.sku, self.nombre, self.descripcion)
+       campos = kwargs.get('update_fields')
+       if campos is not None and {'sku', 'nombre', 'descripcion'} & set(campos):
+           kwargs['update_fields'] = {*campos, 'texto_busqueda'}
+       anterior = getattr(self, '_imagen_guardada', '')
+       imagen_cambio = (self.imagen.name or '') != anterior or not getattr(self.imagen, '_committed', True)
+       variantes_viejas = None
+       if imagen_cambio and self.imagen_variantes:
+           variantes_viejas, self.imagen_variantes = self.imagen_variantes, {}
        super().save(*args, **kwargs)
-       if self.imagen:
-           try:
-               img = Image.open(self.imagen.path)
-               if img.height > 300 or img.width > 300:
-                   output_size = (300, 300)
-                   img.thumbnail(output_size)
-                   img.save(self.imagen.path)
-           except Exception as e:
-               print(f"Error al procesar la imagen: {e}")
+       self._imagen_guardada = self.imagen.name or ''
+       # Las variantes se generan en segundo plano y sólo si la imagen cambió
+       if imagen_cambio:
+           if variantes_viejas:
+               transaction.on_commit(lambda: borrar_variantes(variantes_viejas))
+           if self.imagen:
+               programar_variantes(self)
     
     def generar_sku_unico(self):
        """Genera un SKU único automáticamente"""
-       while True:
-           sku = f"PROD-{random.randint(10000, 99999)}"
-           if not Producto.objects.filter(sku=sku).exists():
-                return sku
+       return SKU_PRODUCTOS.siguiente()
     
     def __str__(self):
        return f"{self.sku} - {self.nombre}"
     
+    def _srcset(self, formato):
+       if self.imagen_variantes.get('origen') != self.imagen.name:
+           return ''
+       return ', '.join(
+           f'{default_storage.url(ruta)} {tamano}w'
+           for tamano, ruta in self.imagen_variantes.get(formato, {}).items()
+       )
+
+    @property
+    def srcset_avif(self):
+       return self._srcset('avif')
+
+    @property
+    def srcset_webp(self):
+       return self._srcset('webp')
+
     @property
     def necesita_reposicion(self):
        return self.stock < self.stock_minimo
@@ -92,6 +139,90 @@ class MovimientoStock(models.Model):
        verbose_name = 'Movimiento de Stock'
        verbose_name_plural = 'Movimientos de Stock'
        ordering = ['-fecha']
+       indexes = [
+           # Movimientos de un producto en un rango de fechas (ver productos.historico)
+           models.Index(fields=['producto', 'fecha'], name='movimiento_producto_fecha_idx'),
+       ]
        
     def __str__(self):
-       return f" {self.producto.nombre} - {self.tipo} - {self.cantidad}"
\ No newline at end of file
+       return f" {self.producto.nombre} - {self.tipo} - {self.cantidad}"
+
+
+class SnapshotStock(models.Model):
+    """Saldo del libro de movimientos de un producto a una fecha (ver productos.historico).
+
+    Incluye los movimientos con fecha <= `fecha`; para saber el stock a una
+    fecha posterior alcanza con sumarle los movimientos que vinieron después.
+    """
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='snapshots')
+    fecha = models.DateTimeField('Fecha')
+    stock = models.IntegerField('Stock')
+
+    class Meta:
+       verbose_name = 'Snapshot de stock'
+       verbose_name_plural = 'Snapshots de stock'
+       constraints = [
+           # También es el índice para buscar el último snapshot antes de una fecha
+           models.UniqueConstraint(fields=['producto', 'fecha'], name='snapshot_stock_producto_fecha_unico'),
+       ]
+
+    def __str__(self):
+       return f"{self.producto_id} @ {self.fecha:%Y-%m-%d %H:%M}: {self.stock}"
+
+class ConteoStock(models.Model):
+    """Sesión de inventario físico (ver productos.conteo).
+
+    Los lectores mandan las cantidades contadas por lotes mientras está
+    abierto; al aplicarlo se ajusta el stock de todos los productos
+    contados de una vez.
+    """
+    ESTADO_CHOICES = [
+       ('abierto', 'Abierto'),
+       ('aplicado', 'Aplicado'),
+    ]
+    nombre = models.CharField('Nombre', max_length=100)
+    estado = models.CharField('Estado', max_length=20, choices=ESTADO_CHOICES, default='abierto')
+    usuario = models.CharField('Usuario', max_length=50)
+    fecha_creacion = models.DateTimeField('Fecha de creación', auto_now_add=True)
+    fecha_aplicado = models.DateTimeField('Fecha de aplicación', blank=True, null=True)
+
+    class Meta:
+       verbose_name = 'Conteo de stock'
+       verbose_name_plural = 'Conteos de stock'
+       ordering = ['-fecha_creacion']
+
+    def __str__(self):
+       return f"{self.nombre} ({self.get_estado_display()})"
+
+
+class LineaConteo(models.Model):
+    """Cantidad contada de un producto en un conteo; una sola línea por producto."""
+    conteo = models.ForeignKey(ConteoStock, on_delete=models.CASCADE, related_name='lineas')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='lineas_conteo')
+    cantidad = models.IntegerField('Cantidad contada')
+    # Stock del sistema al contar la línea: aplicar el conteo suma cantidad - stock_sistema
+    stock_sistema = models.IntegerField('Stock del sistema', blank=True, null=True)
+
+    class Meta:
+       verbose_name = 'Línea de conteo'
+       verbose_name_plural = 'Líneas de conteo'
+       constraints = [
+           # También es la clave del upsert de cada lote
+           models.UniqueConstraint(fields=['conteo', 'producto'], name='linea_conteo_producto_unica'),
+       ]
+
+    def __str__(self):
+       return f"{self.conteo_id} - {self.producto_id}: {self.cantidad}"
+
+
+class SecuenciaSku(models.Model):
+    """Contador de SKUs para motores sin secuencias nativas (ver productos.sku)."""
+    prefijo = models.CharField('Prefijo', max_length=10, unique=True)
+    siguiente = models.BigIntegerField('Siguiente número', default=100000)
+
+    class Meta:
+       verbose_name = 'Secuencia de SKU'
+       verbose_name_plural = 'Secuencias de SKU'
+
+    def __str__(self):
+       return f"{self.prefijo} - {self.siguiente}"
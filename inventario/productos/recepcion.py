@@ -0,0 +1,133 @@
+import csv
+import io
+from collections import Counter
+
+from django.db import transaction
+
+from .models import MovimientoStock, Producto
+from .services import reponer_stock
+
+MAX_LINEAS = 5000
+# Columnas de stock y cantidades: integer en PostgreSQL
+MAX_CANTIDAD = 2**31 - 1
+MAX_SKU = Producto._meta.get_field('sku').max_length
+MOTIVO = 'Recepción de mercadería'
+
+
+class RecepcionInvalida(Exception):
+    """La recepción tiene líneas que no se pueden aplicar; `errores` dice cuáles."""
+
+    def __init__(self, errores):
+        self.errores = errores
+        super().__init__('; '.join(errores))
+
+
+def leer_csv(texto, minimo=1):
+    """Lee líneas `sku,cantidad` de un CSV pegado o subido y devuelve [(sku, cantidad)].
+
+    Acepta coma, punto y coma o tabulador como separador (lo que sale de
+    una planilla o de un lector) y una primera fila de encabezado. Junta
+    todos los errores en un RecepcionInvalida para mostrarlos de una vez.
+    Las cantidades tienen que ser al menos `minimo` (en un conteo vale 0).
+    """
+    muestra = texto[:4096]
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    lineas, errores = [], []
+    for numero, fila in enumerate(csv.reader(io.StringIO(texto), dialecto), start=1):
+        fila = [valor.strip() for valor in fila]
+        if not any(fila):
+            continue
+        if len(fila) < 2:
+            errores.append(f'Línea {numero}: se espera "sku,cantidad".')
+            continue
+        sku, cantidad = fila[0], fila[1]
+        if not cantidad.lstrip('-').isdigit():
+            if numero == 1:
+                continue  # encabezado
+            errores.append(f'Línea {numero}: la cantidad "{cantidad}" no es un número entero.')
+            continue
+        try:
+            lineas.append(validar_linea(sku, int(cantidad), minimo))
+        except RecepcionInvalida as e:
+            errores.append(f'Línea {numero}: {e}')
+    if errores:
+        raise RecepcionInvalida(errores)
+    return lineas
+
+
+def leer_json(datos, minimo=1):
+    """Lee [{"sku": ..., "cantidad": ...}] de la API y devuelve [(sku, cantidad)], como leer_csv."""
+    if not isinstance(datos, list):
+        raise RecepcionInvalida(['"lineas" debe ser una lista.'])
+    lineas, errores = [], []
+    for numero, linea in enumerate(datos, start=1):
+        cantidad = linea.get('cantidad') if isinstance(linea, dict) else None
+        if (not isinstance(linea, dict) or not isinstance(linea.get('sku'), str)
+                or isinstance(cantidad, bool) or not isinstance(cantidad, int)):
+            errores.append(f'Línea {numero}: se espera {{"sku": texto, "cantidad": entero}}.')
+            continue
+        try:
+            lineas.append(validar_linea(linea['sku'].strip(), cantidad, minimo))
+        except RecepcionInvalida as e:
+            errores.append(f'Línea {numero}: {e}')
+    if errores:
+        raise RecepcionInvalida(errores)
+    return lineas
+
+
+def validar_linea(sku, cantidad, minimo=1):
+    """Devuelve la línea (sku, cantidad) si es válida; si no, lanza RecepcionInvalida."""
+    if not sku or len(sku) > MAX_SKU:
+        raise RecepcionInvalida([f'el SKU debe tener entre 1 y {MAX_SKU} caracteres.'])
+    if cantidad < minimo:
+        raise RecepcionInvalida(['la cantidad debe ser mayor a 0.' if minimo else 'la cantidad no puede ser negativa.'])
+    if cantidad > MAX_CANTIDAD:
+        raise RecepcionInvalida([f'la cantidad no puede superar {MAX_CANTIDAD}.'])
+    return sku, cantidad
+
+
+def recibir_mercaderia(lineas, usuario, motivo=''):
+    """Ingresa una recepción de mercadería: suma stock y registra las entradas en una transacción.
+
+    `lineas` es [(sku, cantidad)]; un SKU repetido suma sus cantidades y
+    deja un solo movimiento. Los SKUs se resuelven en una consulta, el
+    stock se suma con el UPDATE único de services.mover_stock y los
+    movimientos se insertan con bulk_create, así el costo no crece con
+    una consulta por línea. Si algún SKU no existe no aplica nada y lanza
+    RecepcionInvalida. Devuelve {'productos': n, 'unidades': n}.
+    """
+    if not lineas:
+        raise RecepcionInvalida(['La recepción no tiene líneas.'])
+    if len(lineas) > MAX_LINEAS:
+        raise RecepcionInvalida([f'Como máximo {MAX_LINEAS} líneas por recepción.'])
+    cantidades = Counter()
+    for sku, cantidad in lineas:
+        cantidades[sku] += cantidad
+
+    productos = {
+        sku: (pk, stock)
+        for sku, pk, stock in Producto.objects.filter(sku__in=cantidades).order_by().values_list('sku', 'pk', 'stock')
+    }
+    errores = [f'No existe el producto con SKU {sku}.' for sku in cantidades if sku not in productos]
+    # Sumadas las líneas repetidas (y el stock actual) podrían no entrar en la columna
+    errores += [
+        f'El stock de {sku} superaría {MAX_CANTIDAD}.'
+        for sku, cantidad in cantidades.items() if sku in productos and productos[sku][1] + cantidad > MAX_CANTIDAD
+    ]
+    if errores:
+        raise RecepcionInvalida(errores)
+    ids = {sku: pk for sku, (pk, _) in productos.items()}
+
+    with transaction.atomic():
+        reponer_stock({ids[sku]: cantidad for sku, cantidad in cantidades.items()})
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(
+                producto_id=ids[sku], tipo='entrada', cantidad=cantidad,
+                motivo=motivo or MOTIVO, usuario=usuario,
+            )
+            for sku, cantidad in cantidades.items()
+        ], batch_size=1000)
+    return {'productos': len(cantidades), 'unidades': sum(cantidades.values())}
@@ -0,0 +1,143 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .cache import cache_productos, contador_stock_bajo
+from .historico import stock_a_fecha
+from .models import MovimientoStock, Producto
+
+
+class StockInsuficiente(Exception):
+    """Se lanza cuando algún producto no alcanza a cubrir la cantidad pedida."""
+
+    def __init__(self, producto):
+        self.producto = producto
+        super().__init__(f'Stock insuficiente para {producto.nombre}')
+
+
+class ProductoInexistente(StockInsuficiente):
+    """Algún producto del cambio ya no existe (se borró después de elegirlo)."""
+
+    def __init__(self, producto_id):
+        self.producto_id = producto_id
+        self.producto = None
+        Exception.__init__(self, f'El producto {producto_id} ya no existe')
+
+
+def _cruza_minimo(producto, nuevo_stock):
+    return (producto.stock < producto.stock_minimo) != (nuevo_stock < producto.stock_minimo)
+
+
+def _bloquear(ids):
+    """Bloquea las filas de los productos siempre en orden de pk.
+
+    Tomar los bloqueos en un orden fijo evita deadlocks entre dos ventas
+    concurrentes que comparten productos.
+    """
+    return {
+        p.pk: p
+        for p in Producto.objects.select_for_update()
+        .filter(pk__in=ids)
+        .order_by('pk')
+        .only('pk', 'nombre', 'stock', 'stock_minimo')
+    }
+
+
+def mover_stock(cambios):
+    """Aplica cambios de stock con signo de forma atómica. `cambios` es {producto_id: cambio}.
+
+    Un cambio positivo suma stock y uno negativo lo descuenta. Bloquea las
+    filas, valida que ningún producto quede en negativo y aplica todo con un
+    único UPDATE condicional; si algún descuento no alcanza lanza
+    StockInsuficiente (ProductoInexistente si el producto ya no existe) y
+    no modifica nada.
+    """
+    cambios = {producto_id: cambio for producto_id, cambio in cambios.items() if cambio}
+    if not cambios:
+        return
+    with transaction.atomic():
+        productos = _bloquear(cambios)
+        for producto_id, cambio in cambios.items():
+            if producto_id not in productos:
+                raise ProductoInexistente(producto_id)
+            if productos[producto_id].stock + cambio < 0:
+                raise StockInsuficiente(productos[producto_id])
+
+        condicion = Q()
+        casos = []
+        for producto_id, cambio in cambios.items():
+            if cambio < 0:
+                condicion |= Q(pk=producto_id, stock__gte=-cambio)
+            else:
+                condicion |= Q(pk=producto_id)
+            casos.append(When(pk=producto_id, then=F('stock') + cambio))
+        actualizados = Producto.objects.filter(condicion).update(
+            stock=Case(*casos, default=F('stock'))
+        )
+        if actualizados != len(cambios):
+            # No debería pasar con las filas bloqueadas, pero nunca dejamos stock negativo
+            raise StockInsuficiente(next(iter(productos.values())))
+        # update() no emite post_save
+        cache_productos.invalidar_al_confirmar(cambios)
+        if any(_cruza_minimo(productos[pk], productos[pk].stock + cambio) for pk, cambio in cambios.items()):
+            contador_stock_bajo.invalidar_al_confirmar()
+
+
+def descontar_stock(cantidades):
+    """Descuenta stock de forma atómica. `cantidades` es {producto_id: cantidad}."""
+    mover_stock({producto_id: -cantidad for producto_id, cantidad in cantidades.items()})
+
+
+def reponer_stock(cantidades):
+    """Suma stock de forma atómica. `cantidades` es {producto_id: cantidad}."""
+    mover_stock(cantidades)
+
+
+def ajustar_stock(producto_id, nueva_cantidad):
+    """Fija el stock de un producto y devuelve la diferencia aplicada."""
+    with transaction.atomic():
+        producto = _bloquear([producto_id])[producto_id]
+        diferencia = nueva_cantidad - producto.stock
+        if diferencia:
+            Producto.objects.filter(pk=producto_id).update(stock=nueva_cantidad)
+            cache_productos.invalidar_al_confirmar([producto_id])
+            if _cruza_minimo(producto, nueva_cantidad):
+                contador_stock_bajo.invalidar_al_confirmar()
+        return diferencia
+
+
+def conciliar_stock(ids, corregir, usuario='Sistema'):
+    """Hace coincidir Producto.stock con el libro de movimientos para los productos `ids`.
+
+    Con corregir='libro' registra un movimiento de ajuste por la diferencia
+    (el libro no se edita: se le agrega la corrección); con corregir='stock'
+    fija el stock al saldo del libro, salvo que ese saldo sea negativo.
+    Bloquea las filas y vuelve a calcular las diferencias antes de tocar
+    nada, así no corrige algo que una venta en curso ya dejó consistente.
+    Devuelve {producto_id: (stock, libro)} de los que se corrigieron.
+    """
+    with transaction.atomic():
+        productos = _bloquear(ids)
+        libro = stock_a_fecha(productos)
+        diferencias = {
+            pk: (producto.stock, libro[pk]) for pk, producto in productos.items()
+            if producto.stock != libro[pk] and (corregir == 'libro' or libro[pk] >= 0)
+        }
+        if not diferencias:
+            return {}
+        if corregir == 'libro':
+            MovimientoStock.objects.bulk_create([
+                MovimientoStock(
+                    producto_id=pk, tipo='ajuste', cantidad=stock - saldo,
+                    motivo='Conciliación con el stock (auditoría)', usuario=usuario,
+                )
+                for pk, (stock, saldo) in diferencias.items()
+            ])
+            return diferencias
+        Producto.objects.filter(pk__in=diferencias).update(stock=Case(
+            *[When(pk=pk, then=Value(saldo)) for pk, (_, saldo) in diferencias.items()],
+            default=F('stock'),
+        ))
+        cache_productos.invalidar_al_confirmar(diferencias)
+        if any(_cruza_minimo(productos[pk], saldo) for pk, (_, saldo) in diferencias.items()):
+            contador_stock_bajo.invalidar_al_confirmar()
+        return diferencias
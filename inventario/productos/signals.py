@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .busqueda import indice_productos
+from .cache import cache_productos, contador_stock_bajo
+from .models import Producto
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_cache_producto(sender, instance, **kwargs):
+    cache_productos.invalidar_al_confirmar([instance.pk])
+    contador_stock_bajo.invalidar_al_confirmar()
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+def invalidar_indice_busqueda(sender, **kwargs):
+    indice_productos.limpiar()
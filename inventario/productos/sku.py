@@ -0,0 +1,97 @@
+import os
+import threading
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+
+# Cantidad de SKUs que cada proceso reserva por consulta. En PostgreSQL
+# coincide con el INCREMENT BY de las secuencias creadas en la migración.
+BLOQUE = 100
+
+
+class AsignadorSku:
+    """Genera SKUs únicos reservando bloques de números por proceso.
+
+    Cada bloque se toma de una secuencia de la base de datos; mientras queden
+    números en el bloque, generar un SKU no hace ninguna consulta. Los
+    números arrancan en 100000 para no chocar con los SKUs aleatorios de
+    5 dígitos que se generaban antes.
+    """
+
+    def __init__(self, prefijo, modelo, ancho=6):
+        self.prefijo = prefijo
+        self.modelo = modelo
+        self.ancho = ancho
+        self.secuencia = f'sku_{prefijo.lower()}_seq'
+        self._lock = threading.Lock()
+        self._pid = None
+        self._libres = []
+        # on_commit pendiente del bloque reservado dentro de la transacción del llamador
+        self._confirmar = None
+
+    def formatear(self, numero):
+        return f'{self.prefijo}-{numero:0{self.ancho}d}'
+
+    def _reservar_inicio(self):
+        conexion = transaction.get_connection()
+        if conexion.vendor == 'postgresql':
+            # nextval no es transaccional: un rollback no devuelve el bloque
+            with conexion.cursor() as cursor:
+                cursor.execute('SELECT nextval(%s)', [self.secuencia])
+                return cursor.fetchone()[0]
+
+        inicio = self._incrementar_contador()
+        if conexion.in_atomic_block:
+            # El contador se incrementó en la transacción del llamador (en
+            # SQLite otra conexión esperaría su bloqueo): si se deshace, el
+            # contador vuelve atrás y el bloque se descarta (ver siguiente).
+            def confirmar():
+                if self._confirmar is confirmar:
+                    self._confirmar = None
+
+            self._confirmar = confirmar
+            transaction.on_commit(confirmar)
+        return inicio
+
+    def _incrementar_contador(self):
+        # Otros motores (SQLite en desarrollo): contador en tabla
+        SecuenciaSku = apps.get_model('productos', 'SecuenciaSku')
+        with transaction.atomic():
+            secuencia, _ = SecuenciaSku.objects.select_for_update().get_or_create(prefijo=self.prefijo)
+            SecuenciaSku.objects.filter(pk=secuencia.pk).update(siguiente=F('siguiente') + BLOQUE)
+        return secuencia.siguiente
+
+    def _bloque_deshecho(self):
+        """El bloque se reservó en una transacción que terminó sin confirmarse.
+
+        Mientras esa transacción sigue abierta el bloque se usa; una vez
+        cerrada, si su on_commit no corrió es porque se deshizo.
+        """
+        return self._confirmar is not None and not transaction.get_connection().in_atomic_block
+
+    def _reservar_bloque(self):
+        self._confirmar = None
+        inicio = self._reservar_inicio()
+        candidatos = [self.formatear(n) for n in range(inicio, inicio + BLOQUE)]
+        # Un SKU cargado a mano podría caer dentro del bloque
+        usados = set(
+            apps.get_model(self.modelo).objects
+            .filter(sku__in=candidatos)
+            .values_list('sku', flat=True)
+        )
+        return [sku for sku in reversed(candidatos) if sku not in usados]
+
+    def siguiente(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Después de un fork el bloque heredado también lo tiene el padre
+                self._pid = os.getpid()
+                self._libres = []
+            if self._bloque_deshecho():
+                # El contador volvió atrás: otro proceso puede recibir este mismo bloque
+                self._libres = []
+                self._confirmar = None
+            while not self._libres:
+                self._libres = self._reservar_bloque()
+            return self._libres.pop()
@@ -0,0 +1,134 @@
+import io
+import warnings
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from PIL import Image
+
+# Bytes que hacen falta para reconocer cualquiera de los formatos aceptados
+BYTES_FIRMA = 12
+# Hasta cuánto del comienzo del archivo se guarda en memoria para leer las dimensiones
+BYTES_CABECERA = 256 * 1024
+
+
+def detectar_formato(cabecera):
+    """Formato de Pillow según los primeros bytes del archivo, o None si no es uno aceptado."""
+    if cabecera.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if cabecera.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if cabecera[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'WEBP'
+    if cabecera[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'AVIF'
+    return None
+
+
+def mensaje_tamano():
+    return f'El tamaño maximo permitido es {settings.PRODUCTOS_IMAGEN_MAX_BYTES / (1024 * 1024)} MB.'
+
+
+def mensaje_pixeles(ancho, alto):
+    return (f'La imagen es demasiado grande ({ancho}x{alto} px). '
+            f'Máximo: {settings.PRODUCTOS_IMAGEN_MAX_PIXELES:,} píxeles.')
+
+
+class SubidaImagenProducto(FileUploadHandler):
+    """Recibe las imágenes de productos validándolas mientras llegan.
+
+    Los archivos de `campos` van a disco a medida que llegan, así que en
+    memoria sólo quedan un chunk y la cabecera. La subida se corta (SkipFile)
+    apenas se sabe que no sirve: supera PRODUCTOS_IMAGEN_MAX_BYTES, los
+    primeros bytes no son de un formato aceptado, o la cabecera declara más
+    de PRODUCTOS_IMAGEN_MAX_PIXELES. Las dimensiones se leen de la cabecera,
+    sin decodificar la imagen. El motivo queda en `request.errores_subida`
+    para que el formulario lo muestre.
+
+    Los demás archivos siguen por los handlers por defecto.
+    """
+
+    def __init__(self, request=None, campos=('imagen',)):
+        super().__init__(request)
+        self.campos = campos
+        self.archivo = None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.archivo = None
+        if field_name not in self.campos:
+            return
+        if content_length is not None and content_length > settings.PRODUCTOS_IMAGEN_MAX_BYTES:
+            self._rechazar(mensaje_tamano())
+        self.cabecera = b''
+        self.formato = None
+        self.leyendo_cabecera = True
+        self.archivo = TemporaryUploadedFile(file_name, content_type, 0, charset, content_type_extra)
+        # Este archivo lo maneja sólo este handler
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.archivo is None:
+            return raw_data
+        if start + len(raw_data) > settings.PRODUCTOS_IMAGEN_MAX_BYTES:
+            self._rechazar(mensaje_tamano())
+        if self.leyendo_cabecera:
+            self.cabecera += raw_data[:BYTES_CABECERA - len(self.cabecera)]
+            self._revisar_cabecera()
+        self.archivo.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.archivo is None:
+            return None
+        # Lo que no se pudo decidir con la cabecera (archivos chicos o truncados)
+        # lo termina de validar el ImageField del formulario
+        self.archivo.seek(0)
+        self.archivo.size = file_size
+        archivo, self.archivo = self.archivo, None
+        return archivo
+
+    def upload_interrupted(self):
+        if self.archivo is not None:
+            self.archivo.close()
+            self.archivo = None
+
+    def _revisar_cabecera(self):
+        if self.formato is None:
+            if len(self.cabecera) < BYTES_FIRMA:
+                return
+            self.formato = detectar_formato(self.cabecera)
+            if self.formato is None:
+                self._rechazar('El archivo no es una imagen JPG, PNG, GIF, WEBP o AVIF.')
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                # open() sólo lee la cabecera; el resto de la imagen no se decodifica
+                imagen = Image.open(io.BytesIO(self.cabecera), formats=[self.formato])
+        except Image.DecompressionBombError:
+            self._rechazar('La imagen tiene demasiados píxeles.')
+        except Exception:
+            # Cabecera todavía incompleta: se reintenta con el próximo chunk
+            if len(self.cabecera) >= BYTES_CABECERA:
+                self._dejar_cabecera()
+            return
+        self._dejar_cabecera()
+        ancho, alto = imagen.size
+        if ancho * alto > settings.PRODUCTOS_IMAGEN_MAX_PIXELES:
+            self._rechazar(mensaje_pixeles(ancho, alto))
+
+    def _dejar_cabecera(self):
+        self.leyendo_cabecera = False
+        self.cabecera = b''
+
+    def _rechazar(self, mensaje):
+        if self.archivo is not None:
+            self.archivo.close()
+            self.archivo = None
+        if self.request is not None:
+            if not hasattr(self.request, 'errores_subida'):
+                self.request.errores_subida = {}
+            self.request.errores_subida[self.field_name] = mensaje
+        raise SkipFile(mensaje)
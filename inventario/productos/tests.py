@@ -1,3 +1,906 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from collections import Counter
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from PIL import Image
+
+from .auditoria import Checkpoint, auditar
+from .busqueda import buscar_productos, normalizar
+from .cache import CacheProductos, cache_productos, contador_stock_bajo
+from .conteo import ConteoInvalido, aplicar_conteo, registrar_lote, reporte_diferencias, totales_diferencias
+from .historico import generar_snapshots, stock_a_fecha
+from .importacion import ImportacionInvalida, exportar_csv, importar_productos
+from .imagenes import formatos_disponibles, generar_variantes
+from .models import ConteoStock, MovimientoStock, Producto, SnapshotStock, STOCK_BAJO
+from .recepcion import RecepcionInvalida, leer_csv, recibir_mercaderia
+from .services import ProductoInexistente, StockInsuficiente, ajustar_stock, descontar_stock, mover_stock, reponer_stock
+from .sku import AsignadorSku
+from .subidas import SubidaImagenProducto
+
+
+class MoverStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'MOV-{n}', nombre=f'Mov {n}', descripcion='-', precio=1, stock=10) for n in range(3)
+        ])
+
+    def _stock(self):
+        return list(Producto.objects.filter(pk__in=[p.pk for p in self.productos]).order_by('pk')
+                    .values_list('stock', flat=True))
+
+    def test_aplica_cambios_con_signo(self):
+        uno, dos, tres = (p.pk for p in self.productos)
+        mover_stock({uno: -10, dos: 5, tres: 0})
+        self.assertEqual(self._stock(), [0, 15, 10])
+
+    def test_una_venta_mayor_al_stock_no_cambia_nada(self):
+        with self.assertRaises(StockInsuficiente) as error:
+            descontar_stock({self.productos[0].pk: 11})
+        self.assertEqual(error.exception.producto.pk, self.productos[0].pk)
+        self.assertEqual(self._stock(), [10, 10, 10])
+
+    def test_un_lote_de_varios_productos_es_todo_o_nada(self):
+        uno, dos, tres = (p.pk for p in self.productos)
+        with self.assertRaises(StockInsuficiente) as error:
+            mover_stock({uno: -3, dos: 4, tres: -11})
+        self.assertEqual(error.exception.producto.pk, tres)
+        self.assertEqual(self._stock(), [10, 10, 10])
+
+    def test_un_producto_que_ya_no_existe(self):
+        borrado = Producto.objects.create(sku='MOV-X', nombre='Borrado', descripcion='-', precio=1, stock=5)
+        borrado.delete()
+        with self.assertRaises(ProductoInexistente) as error:
+            mover_stock({self.productos[0].pk: -1, borrado.pk: -1})
+        self.assertEqual(str(error.exception), f'El producto {borrado.pk} ya no existe')
+        self.assertEqual(self._stock(), [10, 10, 10])
+
+
+class AsignadorSkuTests(TransactionTestCase):
+
+    def test_reparte_numeros_consecutivos_de_un_bloque(self):
+        asignador = AsignadorSku('PROD', 'productos.Producto')
+        numeros = [int(asignador.siguiente().split('-')[1]) for _ in range(3)]
+        self.assertEqual(numeros, list(range(numeros[0], numeros[0] + 3)))
+
+    @skipIf(connection.vendor == 'postgresql', 'nextval no vuelve atrás con un rollback')
+    def test_descarta_el_bloque_si_la_transaccion_que_lo_reservo_se_deshace(self):
+        asignador = AsignadorSku('TST', 'productos.Producto')
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                self.assertEqual(asignador.siguiente(), 'TST-100000')
+                # Dentro de la misma transacción se sigue con el bloque
+                self.assertEqual(asignador.siguiente(), 'TST-100001')
+                1 / 0
+        # El contador volvió a 100000: seguir con el bloque lo compartiría con otro proceso
+        self.assertEqual(asignador.siguiente(), 'TST-100000')
+        with transaction.atomic():
+            self.assertEqual(asignador.siguiente(), 'TST-100001')
+        self.assertEqual(asignador.siguiente(), 'TST-100002')
+
+
+class CacheProductosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=20)
+            for n in range(5)
+        ])
+
+    def setUp(self):
+        cache_productos.limpiar()
+
+    def test_lee_de_la_base_una_sola_vez(self):
+        ids = [p.pk for p in self.productos[:3]]
+        with self.assertNumQueries(1):
+            filas = cache_productos.obtener(ids, ['PROD-4'])
+        self.assertEqual(len(filas), 4)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache_productos.obtener(ids, ['PROD-4']), filas)
+
+    def test_guardar_el_producto_invalida(self):
+        producto = self.productos[0]
+        cache_productos.obtener([producto.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.precio = 15
+            producto.save()
+        self.assertEqual(cache_productos.obtener([producto.pk])[producto.pk]['precio'], 15)
+
+    def test_descontar_stock_invalida(self):
+        producto = self.productos[1]
+        cache_productos.obtener([producto.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock({producto.pk: 3})
+        self.assertEqual(cache_productos.obtener([producto.pk])[producto.pk]['stock'], 17)
+
+    def test_no_guarda_lo_leido_antes_de_una_invalidacion(self):
+        cache = CacheProductos(ttl=60)
+        pk = self.productos[2].pk
+        _, _, _, generacion = cache._buscar([pk], [])
+        cache.invalidar([pk])
+        cache._guardar([{'id': pk, 'sku': 'PROD-2', 'nombre': 'viejo', 'precio': 1, 'stock': 1}], generacion)
+        with self.assertNumQueries(1):
+            cache.obtener([pk])
+
+    def test_vence_con_el_ttl(self):
+        cache = CacheProductos(ttl=0)
+        cache.obtener([self.productos[3].pk])
+        with self.assertNumQueries(1):
+            cache.obtener([self.productos[3].pk])
+
+
+def _imagen(nombre='foto.png', tamano=(800, 600)):
+    contenido = io.BytesIO()
+    Image.new('RGB', tamano, 'orange').save(contenido, 'PNG')
+    return SimpleUploadedFile(nombre, contenido.getvalue(), content_type='image/png')
+
+
+class ImagenesProductoTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def _producto(self, **kwargs):
+        return Producto.objects.create(nombre='Mate', descripcion='-', precio=10, **kwargs)
+
+    @mock.patch('productos.models.programar_variantes')
+    def test_solo_procesa_cuando_cambia_la_imagen(self, programar):
+        producto = self._producto(imagen=_imagen())
+        self.assertEqual(programar.call_count, 1)
+
+        producto = Producto.objects.get(pk=producto.pk)
+        producto.precio = 12
+        producto.save()
+        self.assertEqual(programar.call_count, 1)
+
+        producto.imagen = _imagen('otra.png')
+        producto.save()
+        self.assertEqual(programar.call_count, 2)
+
+    @mock.patch('productos.models.programar_variantes')
+    def test_genera_variantes_sin_tocar_el_original(self, programar):
+        producto = self._producto(imagen=_imagen())
+        with default_storage.open(producto.imagen.name, 'rb') as archivo:
+            original = archivo.read()
+
+        variantes = generar_variantes(producto.pk, producto.imagen.name)
+
+        with default_storage.open(producto.imagen.name, 'rb') as archivo:
+            self.assertEqual(archivo.read(), original)
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_variantes, variantes)
+        for formato in formatos_disponibles():
+            with default_storage.open(variantes[formato]['100']) as archivo:
+                self.assertEqual(max(Image.open(archivo).size), 100)
+        self.assertIn('100w', producto.srcset_webp)
+
+    @mock.patch('productos.models.programar_variantes')
+    def test_descarta_variantes_de_una_imagen_reemplazada(self, programar):
+        producto = self._producto(imagen=_imagen())
+        vieja = producto.imagen.name
+        producto.imagen = _imagen('nueva.png')
+        producto.save()
+
+        self.assertIsNone(generar_variantes(producto.pk, vieja))
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_variantes, {})
+        self.assertEqual(default_storage.listdir('productos/variantes')[1], [])
+
+
+def _cabecera_png(ancho, alto):
+    """Firma, IHDR y el comienzo del IDAT de un PNG: alcanza para que Pillow lea las dimensiones."""
+    ihdr = struct.pack('>IIBBBBB', ancho, alto, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr
+            + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr)) + struct.pack('>I', 0) + b'IDAT')
+
+
+@override_settings(PRODUCTOS_IMAGEN_MAX_BYTES=64 * 1024)
+class SubidaImagenProductoTests(TestCase):
+
+    def _enviar(self, chunks, tamano_chunk=8 * 1024):
+        """Pasa los chunks al handler como lo hace MultiPartParser; devuelve (handler, bytes leídos)."""
+        request = RequestFactory().post('/')
+        handler = SubidaImagenProducto(request)
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('imagen', 'foto.png', 'image/png', None)
+        leidos = 0
+        for chunk in chunks:
+            handler.receive_data_chunk(chunk, leidos)
+            leidos += len(chunk)
+        return handler, leidos
+
+    def test_corta_apenas_supera_el_limite(self):
+        def sin_fin():
+            yield _cabecera_png(100, 100)
+            while True:
+                yield b'\0' * 8 * 1024
+
+        with self.assertRaises(SkipFile):
+            self._enviar(sin_fin())
+
+    def test_corta_en_el_primer_chunk_si_no_es_una_imagen(self):
+        request = RequestFactory().post('/')
+        handler = SubidaImagenProducto(request)
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('imagen', 'foto.png', 'image/png', None)
+        with self.assertRaisesMessage(SkipFile, 'no es una imagen'):
+            handler.receive_data_chunk(b'%PDF-1.7\n' + b'x' * 100, 0)
+        self.assertIn('imagen', request.errores_subida)
+
+    @override_settings(PRODUCTOS_IMAGEN_MAX_PIXELES=1_000_000)
+    def test_corta_por_dimensiones_leyendo_solo_la_cabecera(self):
+        with self.assertRaisesMessage(SkipFile, '5000x5000'):
+            self._enviar([_cabecera_png(5000, 5000)])
+
+    def test_deja_pasar_una_imagen_valida(self):
+        contenido = _imagen().read()
+        handler, leidos = self._enviar([contenido[i:i + 1024] for i in range(0, len(contenido), 1024)])
+        archivo = handler.file_complete(leidos)
+        self.assertEqual(archivo.read(), contenido)
+        archivo.close()
+
+    def test_ignora_otros_campos(self):
+        handler = SubidaImagenProducto(RequestFactory().post('/'))
+        handler.new_file('adjunto', 'a.txt', 'text/plain', None)
+        self.assertEqual(handler.receive_data_chunk(b'hola', 0), b'hola')
+        self.assertIsNone(handler.file_complete(4))
+
+
+@override_settings(PRODUCTOS_IMAGEN_MAX_BYTES=64 * 1024)
+class FormularioImagenProductoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.client.force_login(self.usuario)
+
+    def _datos(self, imagen):
+        return {'sku': '', 'nombre': 'Mate', 'descripcion': '-', 'precio': '10',
+                'stock': '0', 'stock_minimo': '5', 'imagen': imagen}
+
+    @mock.patch('productos.models.programar_variantes')
+    def test_guarda_una_imagen_valida(self, programar):
+        respuesta = self.client.post(reverse('productos:producto_create'), self._datos(_imagen()))
+        self.assertEqual(respuesta.status_code, 302)
+        self.assertTrue(Producto.objects.get().imagen)
+
+    def test_muestra_el_error_de_una_imagen_cortada(self):
+        grande = SimpleUploadedFile('foto.png', _cabecera_png(100, 100) + b'\0' * 128 * 1024)
+        respuesta = self.client.post(reverse('productos:producto_create'), self._datos(grande))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFormError(respuesta.context['form'], 'imagen', 'El tamaño maximo permitido es 0.0625 MB.')
+        self.assertFalse(Producto.objects.exists())
+
+    def test_sigue_controlando_csrf(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.force_login(self.usuario)
+        respuesta = cliente.post(reverse('productos:producto_create'), self._datos(_imagen()))
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class BusquedaProductosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        datos = [
+            ('Yerba Mate Andina', 'Paquete de 1 kg', 3),
+            ('Materas de cuero', 'Para llevar el equipo', 20),
+            ('Azúcar Ñandú', 'Refinada', 20),
+            ('Galletitas dulces', 'Con chips de chocolate', 20),
+        ]
+        cls.productos = {
+            nombre: Producto.objects.create(nombre=nombre, descripcion=descripcion, precio=10, stock=stock)
+            for nombre, descripcion, stock in datos
+        }
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _buscar(self, **parametros):
+        respuesta = self.client.get(reverse('productos:producto_list'), parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return [producto.nombre for producto in respuesta.context['productos']]
+
+    def test_normaliza_acentos_mayusculas_y_espacios(self):
+        self.assertEqual(normalizar('  Azúcar   ÑANDÚ '), 'azucar nandu')
+        self.assertEqual(self.productos['Azúcar Ñandú'].texto_busqueda,
+                         f"{self.productos['Azúcar Ñandú'].sku.lower()} azucar nandu refinada")
+
+    def test_busca_sin_acentos_por_nombre_descripcion_y_sku(self):
+        self.assertEqual(self._buscar(buscar='azucar nandu'), ['Azúcar Ñandú'])
+        self.assertEqual(self._buscar(buscar='chocolate'), ['Galletitas dulces'])
+        sku = self.productos['Materas de cuero'].sku
+        # Los SKUs parecidos también coinciden por trigramas, pero después del exacto
+        self.assertEqual(self._buscar(buscar=sku)[0], 'Materas de cuero')
+
+    def test_tolera_errores_de_tipeo(self):
+        self.assertEqual(self._buscar(buscar='galetitas'), ['Galletitas dulces'])
+
+    def test_ordena_por_relevancia(self):
+        # 'Materas' va antes por nombre, pero 'mate' es una palabra completa de la yerba
+        self.assertEqual(self._buscar(buscar='mate'), ['Yerba Mate Andina', 'Materas de cuero'])
+
+    def test_combina_busqueda_y_filtro_de_stock(self):
+        self.assertEqual(self._buscar(buscar='mate', filtro='stock_bajo'), ['Yerba Mate Andina'])
+        self.assertEqual(self._buscar(buscar='mate', filtro='stock_ok'), ['Materas de cuero'])
+        self.assertEqual(self._buscar(stockBajo='1'), ['Yerba Mate Andina'])
+
+    def test_encuentra_productos_nuevos(self):
+        self.assertEqual(self._buscar(buscar='cafe'), [])
+        Producto.objects.create(nombre='Café molido', descripcion='-', precio=10)
+        self.assertEqual(self._buscar(buscar='cafe'), ['Café molido'])
+        # Las altas masivas no disparan señales: las detecta la huella de la tabla
+        Producto.objects.bulk_create([Producto(sku='CAFE-2', nombre='Café en grano', descripcion='-', precio=1)])
+        self.assertEqual(self._buscar(buscar='cafe'), ['Café en grano', 'Café molido'])
+
+    def test_sin_texto_devuelve_el_queryset(self):
+        queryset = Producto.objects.all()
+        self.assertIs(buscar_productos(queryset, ' ?! '), queryset)
+
+
+class StockBajoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        Producto.objects.bulk_create(
+            [Producto(sku=f'BAJO-{n}', nombre=f'Bajo {n}', descripcion='-', precio=1, stock=n % 5, stock_minimo=5)
+             for n in range(25)]
+            + [Producto(sku=f'OK-{n}', nombre=f'Ok {n}', descripcion='-', precio=1, stock=50, stock_minimo=5)
+               for n in range(30)]
+        )
+
+    def setUp(self):
+        contador_stock_bajo.invalidar()
+
+    def _plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Con tablas tan chicas el planner prefiere un seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_pagina_y_cuenta_con_el_indice_parcial(self):
+        indice = Producto._meta.indexes[0].name
+        queryset = Producto.objects.filter(STOCK_BAJO).order_by('stock', 'id')
+        self.assertIn(indice, self._plan(queryset[:20]))
+        self.assertIn(indice, self._plan(queryset.values('id')))
+
+    def test_lista_paginada(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('productos:stock_bajo_list'), {'page': 2})
+        self.assertEqual(respuesta.context['paginator'].count, 25)
+        self.assertEqual(len(respuesta.context['productos']), 5)
+        self.assertTrue(all(p.necesita_reposicion for p in respuesta.context['productos']))
+
+    def test_contador_cacheado_hasta_que_un_producto_cruza_el_minimo(self):
+        self.assertEqual(contador_stock_bajo.obtener(), 25)
+        bajo = Producto.objects.get(sku='BAJO-1')
+        ok = Producto.objects.get(sku='OK-1')
+        with self.assertNumQueries(0):
+            self.assertEqual(contador_stock_bajo.obtener(), 25)
+
+        # Sigue arriba del mínimo: no hace falta volver a contar
+        with self.captureOnCommitCallbacks(execute=True):
+            descontar_stock({ok.pk: 10})
+        with self.assertNumQueries(0):
+            contador_stock_bajo.obtener()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reponer_stock({bajo.pk: 10})
+        self.assertEqual(contador_stock_bajo.obtener(), 24)
+        with self.captureOnCommitCallbacks(execute=True):
+            ajustar_stock(ok.pk, 0)
+        self.assertEqual(contador_stock_bajo.obtener(), 25)
+
+    def test_badge_del_dashboard(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('dashboard'))
+        self.assertContains(respuesta, '25 con stock bajo')
+
+
+class HistoricoStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.inicio = timezone.now() - timedelta(days=30)
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'HIST-{n}', nombre=f'Hist {n}', descripcion='-', precio=1) for n in range(3)
+        ])
+        movimientos = []
+        for producto in cls.productos:
+            for dia in range(20):
+                fecha = cls.inicio + timedelta(days=dia)
+                movimientos.append(MovimientoStock(producto=producto, tipo='entrada', cantidad=10, fecha=fecha, usuario='t'))
+                movimientos.append(MovimientoStock(producto=producto, tipo='salida', cantidad=3, fecha=fecha, usuario='t'))
+        MovimientoStock.objects.bulk_create(movimientos)
+
+    def _dia(self, dia):
+        return self.inicio + timedelta(days=dia, hours=1)
+
+    def test_sin_snapshots_suma_todo_el_libro(self):
+        ids = [p.pk for p in self.productos]
+        self.assertEqual(stock_a_fecha(ids, self._dia(9)), {pk: 70 for pk in ids})
+        self.assertEqual(stock_a_fecha(ids, self.inicio - timedelta(days=1)), {pk: 0 for pk in ids})
+
+    def test_con_snapshot_solo_lee_los_movimientos_posteriores(self):
+        ids = [p.pk for p in self.productos]
+        self.assertEqual(generar_snapshots(self._dia(9)), 3)
+        # Sin la historia anterior al snapshot el resultado no cambia: no se lee
+        MovimientoStock.objects.filter(fecha__lte=self._dia(9)).delete()
+        with self.assertNumQueries(2):
+            self.assertEqual(stock_a_fecha(ids, self._dia(14)), {pk: 105 for pk in ids})
+        # Antes del snapshot no hay de dónde partir
+        self.assertEqual(stock_a_fecha(ids, self._dia(4)), {pk: 0 for pk in ids})
+
+    def test_solo_genera_snapshots_de_productos_con_movimientos_nuevos(self):
+        generar_snapshots(self._dia(9))
+        producto = self.productos[0]
+        MovimientoStock.objects.create(producto=producto, tipo='salida', cantidad=5,
+                                       fecha=self._dia(25), usuario='t')
+        self.assertEqual(generar_snapshots(self._dia(26)), 3)
+        self.assertEqual(generar_snapshots(self._dia(27)), 0)
+        self.assertEqual(SnapshotStock.objects.get(producto=producto, fecha=self._dia(26)).stock, 140 - 5)
+        self.assertEqual(stock_a_fecha([producto.pk], self._dia(28)), {producto.pk: 135})
+
+    def test_el_formulario_de_movimientos_no_acepta_ajustes(self):
+        # Un ajuste cargado a mano no movería Producto.stock y el libro dejaría de cuadrar
+        producto = Producto.objects.get(sku='HIST-0')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'clave'))
+        respuesta = self.client.post(reverse('productos:movimiento_stock_form', args=[producto.pk]),
+                                     {'tipo': 'ajuste', 'cantidad': 5, 'motivo': ''})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('tipo', respuesta.context['form'].errors)
+        self.assertFalse(MovimientoStock.objects.filter(tipo='ajuste').exists())
+
+    def test_la_migracion_deja_sin_efecto_los_ajustes_previos(self):
+        # Antes los ajustes se guardaban en positivo y no movían el stock
+        producto = self.productos[0]
+        MovimientoStock.objects.create(producto=producto, tipo='ajuste', cantidad=7,
+                                       motivo='Rotura', fecha=self._dia(5), usuario='t')
+        migracion = import_module('productos.migrations.0007_snapshot_stock')
+        migracion.neutralizar_ajustes_previos(apps, None)
+        ajuste = MovimientoStock.objects.get(producto=producto, tipo='ajuste')
+        self.assertEqual(ajuste.cantidad, 0)
+        self.assertEqual(ajuste.motivo, 'Rotura [cantidad registrada: 7; no movió el stock]')
+        self.assertEqual(stock_a_fecha([producto.pk], self._dia(9)), {producto.pk: 70})
+
+    def test_el_comando_rechaza_fechas_invalidas(self):
+        for valor in ('ayer', '2026-02-30 10:00'):
+            with self.subTest(valor=valor), self.assertRaisesMessage(CommandError, f'Fecha inválida: {valor}'):
+                call_command('generar_snapshots_stock', fecha=valor, stdout=io.StringIO())
+
+    def test_usa_el_indice_producto_fecha(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = MovimientoStock.objects.filter(
+            producto=self.productos[0], fecha__gt=self._dia(3), fecha__lte=self._dia(9)
+        ).order_by().explain()
+        self.assertIn(MovimientoStock._meta.indexes[0].name, plan)
+
+
+class AuditoriaStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'AUD-{n}', nombre=f'Aud {n}', descripcion='-', precio=1, stock=10) for n in range(12)
+        ])
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(producto=p, tipo='entrada', cantidad=10, usuario='t') for p in cls.productos
+        ])
+        # Dos productos desfasados: uno con stock de más y otro con una salida sin descontar
+        cls.de_mas, cls.sin_descontar = cls.productos[3], cls.productos[8]
+        Producto.objects.filter(pk=cls.de_mas.pk).update(stock=15)
+        MovimientoStock.objects.create(producto=cls.sin_descontar, tipo='salida', cantidad=4, usuario='t')
+
+    def _diferencias(self, checkpoint):
+        return {pk: (stock, libro) for pk, _, stock, libro in checkpoint.diferencias}
+
+    def _consultas(self, funcion, *args, **kwargs):
+        # Sin savepoints ni SET: cuáles aparecen depende del motor y de la transacción del TestCase
+        with CaptureQueriesContext(connection) as capturadas:
+            resultado = funcion(*args, **kwargs)
+        return resultado, len([q for q in capturadas if q['sql'].lstrip().upper().startswith('SELECT')])
+
+    def test_reporta_las_diferencias_por_rangos(self):
+        # Min/max y, por rango, productos, snapshots y movimientos
+        checkpoint, consultas = self._consultas(auditar, tamano=5, hilos=1)
+        self.assertEqual(consultas, 1 + 3 * 3)
+        self.assertEqual(self._diferencias(checkpoint), {self.de_mas.pk: (15, 10), self.sin_descontar.pk: (10, 6)})
+        self.assertEqual(checkpoint.corregidos, {})
+
+    def test_corrige_el_libro_con_ajustes(self):
+        auditar(tamano=5, hilos=1, corregir='libro', usuario='auditor')
+        ajuste = MovimientoStock.objects.get(producto=self.de_mas, tipo='ajuste')
+        self.assertEqual((ajuste.cantidad, ajuste.usuario), (5, 'auditor'))
+        self.assertEqual(MovimientoStock.objects.get(producto=self.sin_descontar, tipo='ajuste').cantidad, 4)
+        self.assertEqual(auditar(tamano=5, hilos=1).diferencias, [])
+
+    def test_corrige_el_stock_con_el_libro(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            auditar(tamano=5, hilos=1, corregir='stock')
+        self.assertEqual(Producto.objects.get(pk=self.de_mas.pk).stock, 10)
+        self.assertEqual(Producto.objects.get(pk=self.sin_descontar.pk).stock, 6)
+        self.assertEqual(auditar(tamano=5, hilos=1).diferencias, [])
+
+    def test_retoma_desde_el_checkpoint(self):
+        ruta = os.path.join(tempfile.mkdtemp(), 'auditoria.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(ruta))
+        primero = self.productos[0].pk
+        auditar(tamano=5, hilos=1, checkpoint=Checkpoint(ruta, 5))
+        # Se corta escribiendo el último rango: ese se vuelve a auditar
+        with open(ruta, 'rb+') as archivo:
+            archivo.truncate(os.path.getsize(ruta) - 10)
+
+        checkpoint = Checkpoint(ruta, 5)
+        self.assertEqual(checkpoint.hechos, {primero, primero + 5})
+        _, consultas = self._consultas(auditar, tamano=5, hilos=1, checkpoint=checkpoint)
+        self.assertEqual(consultas, 1 + 3)
+        self.assertEqual(self._diferencias(checkpoint), {self.de_mas.pk: (15, 10), self.sin_descontar.pk: (10, 6)})
+        with self.assertRaises(ValueError):
+            Checkpoint(ruta, 50)
+
+
+class AuditoriaStockHilosTests(TransactionTestCase):
+
+    def test_reparte_los_rangos_entre_hilos(self):
+        productos = Producto.objects.bulk_create([
+            Producto(sku=f'HILO-{n}', nombre=f'Hilo {n}', descripcion='-', precio=1, stock=n % 2) for n in range(20)
+        ])
+        checkpoint = auditar(tamano=3, hilos=3)
+        self.assertEqual(len(checkpoint.hechos), 7)
+        self.assertEqual(sorted(d[0] for d in checkpoint.diferencias), [p.pk for p in productos if p.stock])
+
+
+class RecepcionMercaderiaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'REC-{n}', nombre=f'Rec {n}', descripcion='-', precio=1, stock=2) for n in range(300)
+        ])
+
+    def test_lee_csv_con_encabezado_y_otros_separadores(self):
+        self.assertEqual(leer_csv('sku;cantidad\nREC-1; 5\n\nREC-2;7\n'), [('REC-1', 5), ('REC-2', 7)])
+        self.assertEqual(leer_csv('REC-1\t5\n'), [('REC-1', 5)])
+        with self.assertRaises(RecepcionInvalida) as error:
+            leer_csv('REC-1,5\nREC-2,dos\nREC-3,0\nREC-4\n')
+        self.assertEqual(len(error.exception.errores), 3)
+        self.assertTrue(error.exception.errores[0].startswith('Línea 2:'))
+
+    def test_un_camion_entero_en_pocas_consultas(self):
+        lineas = [(p.sku, 10) for p in self.productos] + [('REC-0', 5)]
+        with CaptureQueriesContext(connection) as consultas:
+            recibido = recibir_mercaderia(lineas, 'deposito', 'Remito 123')
+        # SKUs y bloqueo, un UPDATE y los INSERT que el motor necesite para 300 filas
+        sentencias = Counter(q['sql'].split()[0] for q in consultas.captured_queries)
+        self.assertEqual((sentencias['SELECT'], sentencias['UPDATE']), (2, 1))
+        self.assertLessEqual(sentencias['INSERT'], 2)
+        self.assertEqual(recibido, {'productos': 300, 'unidades': 3005})
+        self.assertEqual(Producto.objects.get(sku='REC-0').stock, 17)
+        self.assertEqual(Producto.objects.get(sku='REC-299').stock, 12)
+        movimiento = MovimientoStock.objects.get(producto__sku='REC-0')
+        self.assertEqual((movimiento.tipo, movimiento.cantidad, movimiento.motivo, movimiento.usuario),
+                         ('entrada', 15, 'Remito 123', 'deposito'))
+
+    def test_un_sku_inexistente_no_aplica_nada(self):
+        with self.assertRaises(RecepcionInvalida) as error:
+            recibir_mercaderia([('REC-1', 5), ('NO-EXISTE', 1)], 'deposito')
+        self.assertEqual(error.exception.errores, ['No existe el producto con SKU NO-EXISTE.'])
+        self.assertEqual(Producto.objects.get(sku='REC-1').stock, 2)
+        self.assertFalse(MovimientoStock.objects.exists())
+
+    def test_cantidades_que_no_entran_en_la_columna(self):
+        with self.assertRaises(RecepcionInvalida) as error:
+            leer_csv('REC-1,99999999999\nREC-2,3\n')
+        self.assertEqual(error.exception.errores, ['Línea 1: la cantidad no puede superar 2147483647.'])
+        # Cada línea entra, pero sumadas con el stock actual no
+        with self.assertRaises(RecepcionInvalida) as error:
+            recibir_mercaderia([('REC-1', 2**31 - 3), ('REC-1', 1), ('REC-2', 5)], 'deposito')
+        self.assertEqual(error.exception.errores, ['El stock de REC-1 superaría 2147483647.'])
+        self.assertEqual(Producto.objects.get(sku='REC-1').stock, 2)
+
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse('productos:api_recepcion'), 'REC-1,99999999999',
+                                     content_type='text/csv')
+        self.assertEqual(respuesta.status_code, 422)
+
+    def test_pantalla_con_archivo_csv(self):
+        self.client.force_login(self.usuario)
+        archivo = SimpleUploadedFile('remito.csv', 'sku,cantidad\nREC-1,3\nREC-2,4\n'.encode('latin-1'))
+        respuesta = self.client.post(reverse('productos:recepcion_mercaderia'), {'archivo': archivo, 'motivo': 'R-1'})
+        self.assertRedirects(respuesta, reverse('productos:producto_list'))
+        self.assertEqual(Producto.objects.get(sku='REC-2').stock, 6)
+
+        respuesta = self.client.post(reverse('productos:recepcion_mercaderia'), {'lineas': 'REC-1,3\nFALTA,1'})
+        self.assertContains(respuesta, 'No existe el producto con SKU FALTA.')
+        self.assertEqual(Producto.objects.get(sku='REC-1').stock, 5)
+
+    def test_api_json_y_csv(self):
+        self.client.force_login(self.usuario)
+        url = reverse('productos:api_recepcion')
+        respuesta = self.client.post(url, {'lineas': [{'sku': 'REC-1', 'cantidad': 2}]}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(respuesta.json(), {'productos': 1, 'unidades': 2})
+
+        respuesta = self.client.post(f'{url}?motivo=R-2', 'REC-1,1\nREC-2,1\n', content_type='text/csv')
+        self.assertEqual(respuesta.status_code, 201)
+        self.assertEqual(MovimientoStock.objects.filter(motivo='R-2').count(), 2)
+
+        respuesta = self.client.post(url, {'lineas': [{'sku': 'REC-1', 'cantidad': '2'}]}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 422)
+        respuesta = self.client.post(url, {'lineas': 'REC-1,1'})
+        self.assertEqual(respuesta.status_code, 415)
+        self.assertEqual(Producto.objects.get(sku='REC-1').stock, 5)
+
+
+class ConteoStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'CON-{n}', nombre=f'Con {n}', descripcion='-', precio=2, stock=10, stock_minimo=5)
+            for n in range(200)
+        ])
+
+    def setUp(self):
+        self.conteo = ConteoStock.objects.create(nombre='Anual', usuario='t')
+
+    def test_cada_lote_calcula_diferencias_en_una_consulta(self):
+        lote = [(p.sku, 10) for p in self.productos[:150]] + [('CON-0', 2)]
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = registrar_lote(self.conteo.pk, lote)
+        # Bloqueo del conteo, diferencias del lote y el upsert de las líneas
+        sentencias = Counter(q['sql'].split()[0] for q in consultas.captured_queries)
+        self.assertEqual((sentencias['SELECT'], sentencias['INSERT']), (2, 1))
+        self.assertEqual(resultado[0], {'sku': 'CON-0', 'contado': 12, 'stock': 10, 'diferencia': 2})
+
+        # Sumar agrega a lo contado; reemplazar lo pisa
+        registrar_lote(self.conteo.pk, [('CON-0', 3), ('CON-1', 0)])
+        resultado = registrar_lote(self.conteo.pk, [('CON-1', 7)], modo='reemplazar')
+        self.assertEqual(resultado, [{'sku': 'CON-1', 'contado': 7, 'stock': 10, 'diferencia': -3}])
+        self.assertEqual(self.conteo.lineas.get(producto__sku='CON-0').cantidad, 15)
+        self.assertEqual(self.conteo.lineas.count(), 150)
+
+    def test_un_sku_inexistente_rechaza_el_lote(self):
+        with self.assertRaises(ConteoInvalido):
+            registrar_lote(self.conteo.pk, [('CON-0', 3), ('NO-EXISTE', 1)])
+        self.assertFalse(self.conteo.lineas.exists())
+
+    def test_reporte_de_diferencias(self):
+        registrar_lote(self.conteo.pk, [('CON-0', 4), ('CON-1', 13), ('CON-2', 10), ('CON-3', 11)])
+        lineas = list(reporte_diferencias(self.conteo))
+        self.assertEqual([(l.producto.sku, l.diferencia) for l in lineas], [('CON-0', -6), ('CON-1', 3), ('CON-3', 1)])
+        self.assertEqual(totales_diferencias(self.conteo), {'productos': 3, 'sobrantes': 4, 'faltantes': 6, 'valor': -4})
+
+    def test_aplicar_ajusta_stock_y_registra_ajustes_con_signo(self):
+        registrar_lote(self.conteo.pk, [('CON-0', 4), ('CON-1', 13), ('CON-2', 10)])
+        with self.captureOnCommitCallbacks(execute=True):
+            aplicado = aplicar_conteo(self.conteo.pk, 'auditor')
+        self.assertEqual(aplicado, {'productos': 2, 'sobrantes': 3, 'faltantes': 6})
+        self.assertEqual(
+            dict(Producto.objects.filter(sku__in=['CON-0', 'CON-1', 'CON-2', 'CON-3']).values_list('sku', 'stock')),
+            {'CON-0': 4, 'CON-1': 13, 'CON-2': 10, 'CON-3': 10},
+        )
+        self.assertEqual(
+            sorted(MovimientoStock.objects.filter(tipo='ajuste').values_list('cantidad', flat=True)), [-6, 3]
+        )
+        # Los productos de prueba no tienen otros movimientos: el libro es la suma de los ajustes con signo
+        self.assertEqual(stock_a_fecha([self.productos[0].pk, self.productos[1].pk]),
+                         {self.productos[0].pk: -6, self.productos[1].pk: 3})
+        self.assertEqual(contador_stock_bajo.obtener(), 1)
+
+        # Aplicado, el reporte compara con el stock que había y no admite más lotes
+        self.conteo.refresh_from_db()
+        self.assertEqual(totales_diferencias(self.conteo)['productos'], 2)
+        with self.assertRaises(ConteoInvalido):
+            registrar_lote(self.conteo.pk, [('CON-0', 1)])
+        with self.assertRaises(ConteoInvalido):
+            aplicar_conteo(self.conteo.pk, 'auditor')
+
+    def test_las_ventas_entre_el_lote_y_la_aplicacion_se_conservan(self):
+        registrar_lote(self.conteo.pk, [('CON-0', 4), ('CON-1', 13), ('CON-2', 10)])
+        # Ventas y una recepción después de contar: no son diferencias del conteo
+        descontar_stock({self.productos[0].pk: 3, self.productos[2].pk: 2})
+        reponer_stock({self.productos[1].pk: 5})
+        self.assertEqual(totales_diferencias(self.conteo)['productos'], 2)
+        # Un recuento vuelve a tomar el stock del sistema
+        resultado = registrar_lote(self.conteo.pk, [('CON-2', 8)], modo='reemplazar')
+        self.assertEqual(resultado, [{'sku': 'CON-2', 'contado': 8, 'stock': 8, 'diferencia': 0}])
+
+        aplicado = aplicar_conteo(self.conteo.pk, 'auditor')
+        self.assertEqual(aplicado, {'productos': 2, 'sobrantes': 3, 'faltantes': 6})
+        self.assertEqual(
+            dict(Producto.objects.filter(sku__in=['CON-0', 'CON-1', 'CON-2']).values_list('sku', 'stock')),
+            {'CON-0': 1, 'CON-1': 18, 'CON-2': 8},
+        )
+
+    def test_una_diferencia_que_deja_stock_negativo_no_aplica_nada(self):
+        registrar_lote(self.conteo.pk, [('CON-0', 2), ('CON-1', 12)])
+        descontar_stock({self.productos[0].pk: 9})
+        with self.assertRaises(ConteoInvalido):
+            aplicar_conteo(self.conteo.pk, 'auditor')
+        self.assertEqual(Producto.objects.get(pk=self.productos[1].pk).stock, 10)
+        self.assertFalse(MovimientoStock.objects.filter(tipo='ajuste').exists())
+        self.conteo.refresh_from_db()
+        self.assertEqual(self.conteo.estado, 'abierto')
+
+    def test_pantallas_y_api_del_lector(self):
+        self.client.force_login(self.usuario)
+        self.assertContains(self.client.get(reverse('productos:conteo_list')), 'Anual')
+        respuesta = self.client.post(reverse('productos:conteo_create'), {'nombre': 'Depósito 2'})
+        conteo = ConteoStock.objects.get(nombre='Depósito 2')
+        self.assertRedirects(respuesta, reverse('productos:conteo_detail', args=[conteo.pk]))
+
+        url = reverse('productos:api_conteo_lote', args=[conteo.pk])
+        respuesta = self.client.post(url, {'lineas': [{'sku': 'CON-5', 'cantidad': 0}]}, content_type='application/json')
+        self.assertEqual(respuesta.json()['lineas'][0]['diferencia'], -10)
+        respuesta = self.client.post(f'{url}?modo=reemplazar', 'CON-5,8\n', content_type='text/csv')
+        self.assertEqual(respuesta.json()['lineas'][0]['diferencia'], -2)
+        self.client.post(reverse('productos:conteo_lote', args=[conteo.pk]), {'lineas': 'CON-6;12', 'modo': 'sumar'})
+
+        respuesta = self.client.get(reverse('productos:conteo_detail', args=[conteo.pk]))
+        self.assertEqual([l.producto.sku for l in respuesta.context['lineas']], ['CON-5', 'CON-6'])
+        respuesta = self.client.post(reverse('productos:conteo_aplicar', args=[conteo.pk]), follow=True)
+        self.assertContains(respuesta, '2 productos ajustados')
+        self.assertEqual(Producto.objects.get(sku='CON-5').stock, 8)
+        respuesta = self.client.post(url, {'lineas': [{'sku': 'CON-5', 'cantidad': 1}]}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 422)
+
+
+class ImportacionProductosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.existente = Producto.objects.create(sku='IMP-1', nombre='Viejo', descripcion='-', precio=1, stock=7)
+
+    def _csv(self, texto):
+        return io.BytesIO(texto.encode('utf-8'))
+
+    def test_crea_actualiza_y_reporta_errores_por_lotes(self):
+        archivo = self._csv(
+            '\ufeffsku;nombre;descripcion;precio;stock\n'
+            'IMP-1;Yerba Nueva;Paquete 1 kg;15.50;99\n'
+            'IMP-2;Azúcar;Blanca;3;12\n'
+            ';Sin código;-;4;0\n'
+            'IMP-3;Precio malo;-;-2;1\n'
+            'IMP-4;Sin descripción;;2;1\n'
+        )
+        with mock.patch('productos.importacion.LOTE', 2):
+            resumen = importar_productos(archivo, 'csv', 'importador')
+
+        self.assertEqual((resumen.creados, resumen.actualizados, resumen.con_errores), (2, 1, 2))
+        self.assertEqual([fila for fila, _ in resumen.errores], [5, 6])
+        self.assertIn('precio', resumen.errores[0][1])
+        # El stock de un producto existente no se toca; sus datos sí
+        existente = Producto.objects.get(pk=self.existente.pk)
+        self.assertEqual((existente.nombre, existente.precio, existente.stock), ('Yerba Nueva', 15.5, 7))
+        self.assertEqual(existente.texto_busqueda, 'imp-1 yerba nueva paquete 1 kg')
+        nuevo = Producto.objects.get(sku='IMP-2')
+        self.assertEqual((nuevo.stock, nuevo.stock_minimo, nuevo.texto_busqueda), (12, 5, 'imp-2 azucar blanca'))
+        self.assertTrue(Producto.objects.get(nombre='Sin código').sku.startswith('PROD-'))
+        movimiento = MovimientoStock.objects.get()
+        self.assertEqual((movimiento.producto_id, movimiento.tipo, movimiento.cantidad, movimiento.usuario),
+                         (nuevo.pk, 'entrada', 12, 'importador'))
+        self.assertEqual([p.pk for p in buscar_productos(Producto.objects.all(), 'azucar')], [nuevo.pk])
+
+    def test_consultas_por_lote_y_no_por_fila(self):
+        filas = ''.join(f'IMP-{n},Producto {n},-,2,{n % 3}\n' for n in range(2, 302))
+        with CaptureQueriesContext(connection) as consultas:
+            resumen = importar_productos(self._csv('sku,nombre,descripcion,precio,stock\n' + filas), 'csv')
+        self.assertEqual(resumen.creados, 300)
+        sentencias = Counter(q['sql'].split()[0] for q in consultas.captured_queries)
+        self.assertEqual(sentencias['SELECT'], 1)
+        self.assertLessEqual(sentencias['INSERT'], 6)
+        self.assertEqual(MovimientoStock.objects.count(), 200)
+
+    def test_columnas_obligatorias(self):
+        with self.assertRaises(ImportacionInvalida):
+            importar_productos(self._csv('sku,nombre,precio\nIMP-9,Algo,1\n'), 'csv')
+
+    def test_exporta_en_streaming_y_se_puede_volver_a_importar(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('productos:exportar_productos'))
+        self.assertTrue(respuesta.streaming)
+        contenido = b''.join(respuesta.streaming_content)
+        self.assertEqual(contenido.decode('utf-8').splitlines()[1], 'IMP-1,Viejo,-,1.00,7,5')
+        self.assertEqual(''.join(exportar_csv()).encode('utf-8'), contenido)
+
+        resumen = importar_productos(io.BytesIO(contenido), 'csv')
+        self.assertEqual((resumen.creados, resumen.actualizados, resumen.con_errores), (0, 1, 0))
+
+    def test_un_sku_generado_no_pisa_otra_fila_del_lote(self):
+        archivo = self._csv('sku,nombre,descripcion,precio\n,Sin código,-,1\nPROD-9,Con código,-,2\n')
+        with mock.patch('productos.importacion.SKU_PRODUCTOS.siguiente', side_effect=['PROD-9', 'PROD-10']):
+            resumen = importar_productos(archivo, 'csv')
+        self.assertEqual((resumen.creados, resumen.con_errores), (2, 0))
+        self.assertEqual(
+            dict(Producto.objects.filter(sku__startswith='PROD-').values_list('sku', 'nombre')),
+            {'PROD-9': 'Con código', 'PROD-10': 'Sin código'},
+        )
+
+    def test_los_textos_que_parecen_formulas_se_exportan_escapados(self):
+        Producto.objects.filter(pk=self.existente.pk).update(nombre='=HYPERLINK("http://x")', descripcion='@SUMA')
+        contenido = ''.join(exportar_csv())
+        self.assertEqual(contenido.splitlines()[1], 'IMP-1,"\'=HYPERLINK(""http://x"")",\'@SUMA,1.00,7,5')
+
+        # Al volver a importar el archivo el apóstrofo se quita
+        Producto.objects.filter(pk=self.existente.pk).update(nombre='Otro', descripcion='-')
+        importar_productos(io.BytesIO(contenido.encode('utf-8')), 'csv')
+        existente = Producto.objects.get(pk=self.existente.pk)
+        self.assertEqual((existente.nombre, existente.descripcion), ('=HYPERLINK("http://x")', '@SUMA'))
+
+    def test_xlsx_se_exporta_escapado_y_se_vuelve_a_importar(self):
+        Producto.objects.filter(pk=self.existente.pk).update(nombre='=1+1', descripcion='+54 11')
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('productos:exportar_productos'), {'formato': 'xlsx'})
+        contenido = b''.join(respuesta.streaming_content)
+        hoja = load_workbook(io.BytesIO(contenido)).active
+        self.assertEqual([c.value for c in hoja[2]], ['IMP-1', "'=1+1", "'+54 11", 1, 7, 5])
+        self.assertEqual(hoja['B2'].data_type, 's')
+
+        Producto.objects.filter(pk=self.existente.pk).update(nombre='Otro')
+        resumen = importar_productos(io.BytesIO(contenido), 'xlsx')
+        self.assertEqual((resumen.creados, resumen.actualizados, resumen.con_errores), (0, 1, 0))
+        existente = Producto.objects.get(pk=self.existente.pk)
+        self.assertEqual((existente.nombre, existente.descripcion, existente.precio), ('=1+1', '+54 11', 1))
+
+        # Excel guarda los números como float y deja celdas vacías como None
+        libro = Workbook()
+        libro.active.append(['nombre', 'descripcion', 'precio', 'stock'])
+        libro.active.append(['Harina', 'Leudante', 2.5, 12.0])
+        libro.active.append(['Sin precio', '-', None, 1])
+        archivo = io.BytesIO()
+        libro.save(archivo)
+        archivo.seek(0)
+        resumen = importar_productos(archivo, 'xlsx')
+        self.assertEqual((resumen.creados, resumen.con_errores), (1, 1))
+        self.assertEqual(Producto.objects.get(nombre='Harina').stock, 12)
+
+    def test_pantalla_de_importacion(self):
+        self.client.force_login(self.usuario)
+        archivo = SimpleUploadedFile('productos.csv', b'nombre,descripcion,precio,stock\nCafe,Molido,10,3\nSin precio,-,,1\n')
+        respuesta = self.client.post(reverse('productos:importar_productos'), {'archivo': archivo})
+        self.assertContains(respuesta, '1 productos creados')
+        self.assertContains(respuesta, 'Filas con Errores (1)')
+        archivo = SimpleUploadedFile('productos.txt', b'nombre,descripcion,precio\n')
+        respuesta = self.client.post(reverse('productos:importar_productos'), {'archivo': archivo})
+        self.assertEqual(respuesta.context['form'].errors['archivo'][0][:9], 'La extens')
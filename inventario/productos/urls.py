@@ -11,5 +11,15 @@ urlpatterns = [
     path('<int:pk>/eliminar/', views.ProductoDeleteView.as_view(), name='producto_delete'),
     path('<int:pk>/movimiento/', views.MovimientoStockCreateView.as_view(), name='movimiento_stock_form'),
     path('<int:pk>/ajustar-stock/', views.AjusteStockView.as_view(), name='ajustar_stock'),
+    path('recepcion/', views.RecepcionMercaderiaView.as_view(), name='recepcion_mercaderia'),
+    path('api/recepcion/', views.RecepcionMercaderiaApiView.as_view(), name='api_recepcion'),
+    path('conteos/', views.ConteoListView.as_view(), name='conteo_list'),
+    path('conteos/nuevo/', views.ConteoCreateView.as_view(), name='conteo_create'),
+    path('conteos/<int:pk>/', views.ConteoDetailView.as_view(), name='conteo_detail'),
+    path('conteos/<int:pk>/lote/', views.ConteoLoteView.as_view(), name='conteo_lote'),
+    path('conteos/<int:pk>/aplicar/', views.AplicarConteoView.as_view(), name='conteo_aplicar'),
+    path('api/conteos/<int:pk>/lotes/', views.ConteoLoteApiView.as_view(), name='api_conteo_lote'),
+    path('importar/', views.ImportarProductosView.as_view(), name='importar_productos'),
+    path('exportar/', views.ExportarProductosView.as_view(), name='exportar_productos'),
     path('stock-bajo/', views.StockBajoListView.as_view(), name='stock_bajo_list'),
 ]
\ No newline at end of file
@@ -7,9 +7,22 @@ from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect
 from django.db.models import Q, F
 from django.utils import timezone
-from .models import Producto, MovimientoStock
-from .forms import ProductoForm, MovimientoStockForm, AjusteStockForm
+from django.db import transaction
+from django.http import FileResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .models import ConteoStock, Producto, MovimientoStock, STOCK_BAJO
+from .conteo import ConteoInvalido, aplicar_conteo, registrar_lote, reporte_diferencias, totales_diferencias
+from .services import descontar_stock, reponer_stock, ajustar_stock, StockInsuficiente
+from .busqueda import buscar_productos
+from .forms import (ProductoForm, MovimientoStockForm, AjusteStockForm, FiltroProductosForm, RecepcionMercaderiaForm,
+                    ConteoStockForm, LoteConteoForm, ImportarProductosForm)
+from .importacion import ImportacionInvalida, exportar_csv, exportar_xlsx, formato_de, importar_productos
+from .recepcion import RecepcionInvalida, leer_csv, leer_json, recibir_mercaderia
+from .subidas import SubidaImagenProducto
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+import json
 
 class ProductoListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Producto
@@ -20,14 +33,29 @@ class ProductoListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
 
     def get_queryset(self):
         queryset = super().get_queryset()
-        stock_bajo = self.request.GET.get('stockBajo')
-        if stock_bajo:
-            queryset = queryset.filter(stock__lt=F('stock_minimo'))
+        self.form_filtro = FiltroProductosForm(self.request.GET or None)
+        filtro = buscar = ''
+        if self.form_filtro.is_valid():
+            filtro = self.form_filtro.cleaned_data['filtro']
+            buscar = self.form_filtro.cleaned_data['buscar']
+        # ?stockBajo=1 de los enlaces anteriores al formulario
+        if self.request.GET.get('stockBajo'):
+            filtro = 'stock_bajo'
+        self.filtrando = bool(filtro or buscar)
+        if filtro == 'stock_bajo':
+            queryset = queryset.filter(STOCK_BAJO)
+        elif filtro == 'stock_ok':
+            queryset = queryset.exclude(STOCK_BAJO)
+        if buscar:
+            # Ordenados por relevancia (ver productos.busqueda)
+            return buscar_productos(queryset, buscar)
         return queryset.order_by('nombre')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['stock_bajo'] = self.request.GET.get('stockBajo', '')
+        context['form_filtro'] = self.form_filtro
+        context['filtrando'] = self.filtrando
         return context
 
 class ProductoDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
@@ -44,7 +72,31 @@ class ProductoDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView
         context['form_ajuste'] = AjusteStockForm()
         return context
 
-class ProductoCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+class SubidaImagenMixin:
+    """Valida la imagen del producto mientras se sube (ver productos.subidas).
+
+    El handler tiene que instalarse antes de que se lea el POST, y
+    CsrfViewMiddleware lo lee antes de la vista: por eso la vista se exime
+    del middleware y el chequeo CSRF se hace acá, después de instalarlo.
+    Va primero entre las bases de la vista.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, SubidaImagenProducto(request))
+        return self._dispatch_protegido(request, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def _dispatch_protegido(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['errores_subida'] = getattr(self.request, 'errores_subida', None)
+        return kwargs
+
+
+class ProductoCreateView(SubidaImagenMixin, LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     model = Producto
     form_class = ProductoForm
     template_name = 'productos/producto_form.html'
@@ -70,7 +122,7 @@ class ProductoCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView
         messages.success(self.request, 'Producto creado exitosamente.')
         return response
     
-class ProductoUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
+class ProductoUpdateView(SubidaImagenMixin, LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = Producto
     form_class = ProductoForm
     template_name = 'productos/producto_form.html'
@@ -122,16 +174,16 @@ class MovimientoStockCreateView(LoginRequiredMixin, PermissionRequiredMixin, Cre
         movimiento.usuario = self.request.user.username if self.request.user.is_authenticated else 'Sistema'
         
 
-        if movimiento.tipo == 'entrada':
-            producto.stock += movimiento.cantidad
-        elif movimiento.tipo == 'salida':
-            if producto.stock >= movimiento.cantidad:
-                producto.stock -= movimiento.cantidad
-            else:
-                form.add_error('cantidad', 'No hay suficiente stock para realizar esta salida.')
-                return self.form_invalid(form)
-        movimiento.producto.save()
-        movimiento.save()
+        try:
+            with transaction.atomic():
+                if movimiento.tipo == 'entrada':
+                    reponer_stock({producto.pk: movimiento.cantidad})
+                elif movimiento.tipo == 'salida':
+                    descontar_stock({producto.pk: movimiento.cantidad})
+                movimiento.save()
+        except StockInsuficiente:
+            form.add_error('cantidad', 'No hay suficiente stock para realizar esta salida.')
+            return self.form_invalid(form)
         messages.success(self.request, 'Movimiento de stock registrado exitosamente.')
         
         return redirect('productos:producto_detail', pk=producto.pk)
@@ -161,40 +213,296 @@ class AjusteStockView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
         nueva_cantidad = form.cleaned_data["cantidad"]
         motivo = form.cleaned_data["motivo"] or "Ajuste de stock"
 
-        diferencia = nueva_cantidad - producto.stock
+        with transaction.atomic():
+            diferencia = ajustar_stock(producto.pk, nueva_cantidad)
 
-        if diferencia != 0:
-            tipo = "entrada" if diferencia > 0 else "salida" 
-            MovimientoStock.objects.create(
-                producto=producto,
-                tipo=tipo,
-                cantidad=abs(diferencia),
-                motivo=motivo,
-                fecha=timezone.now(),
-                usuario = self.request.user.username if self.request.user.is_authenticated else "Sistema"
-            )
-
-            producto.stock = nueva_cantidad
-            producto.save()
+            if diferencia != 0:
+                tipo = "entrada" if diferencia > 0 else "salida" 
+                MovimientoStock.objects.create(
+                    producto=producto,
+                    tipo=tipo,
+                    cantidad=abs(diferencia),
+                    motivo=motivo,
+                    fecha=timezone.now(),
+                    usuario = self.request.user.username if self.request.user.is_authenticated else "Sistema"
+                )
 
+        if diferencia != 0:
             messages.success(self.request, f"Stock actualizado exitosamente")
         else:
             messages.info(self.request, f"El stock no ha cambiado")
 
         return redirect("productos:producto_detail", pk=producto.pk)
     
+class RecepcionMercaderiaView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    """Ingresa de una vez todas las líneas de un remito, pegadas o en CSV."""
+    form_class = RecepcionMercaderiaForm
+    template_name = "productos/recepcion_mercaderia.html"
+
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.add_movimientostock'
+
+    def form_valid(self, form):
+        usuario = self.request.user.username if self.request.user.is_authenticated else "Sistema"
+        try:
+            recibido = recibir_mercaderia(form.cleaned_data["items"], usuario, form.cleaned_data["motivo"])
+        except RecepcionInvalida as e:
+            for error in e.errores:
+                form.add_error(None, error)
+            return self.form_invalid(form)
+        messages.success(
+            self.request,
+            f"Recepción registrada: {recibido['unidades']} unidades de {recibido['productos']} productos."
+        )
+        return redirect("productos:producto_list")
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class RecepcionMercaderiaApiView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """API de recepción: {"lineas": [{"sku": ..., "cantidad": ...}], "motivo": ...} o un CSV sku,cantidad.
+
+    Con CSV el motivo va en ?motivo=. Todo o nada: si alguna línea es
+    inválida o algún SKU no existe responde 422 con los errores y no aplica
+    ninguna. Como la API de ventas, no usa token CSRF porque sólo acepta
+    tipos de contenido que un formulario de otro sitio no puede enviar.
+    """
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.add_movimientostock'
+    raise_exception = True
+
+    def post(self, request):
+        motivo = request.GET.get('motivo', '')
+        try:
+            if request.content_type == 'application/json':
+                try:
+                    datos = json.loads(request.body)
+                except ValueError:
+                    return JsonResponse({'error': 'JSON inválido.'}, status=400)
+                if not isinstance(datos, dict):
+                    return JsonResponse({'error': 'Se espera un objeto con "lineas".'}, status=400)
+                lineas = leer_json(datos.get('lineas'))
+                motivo = datos.get('motivo') or motivo
+                if not isinstance(motivo, str):
+                    return JsonResponse({'error': '"motivo" debe ser texto.'}, status=400)
+            elif request.content_type == 'text/csv':
+                lineas = leer_csv(request.body.decode(request.encoding or 'utf-8'))
+            else:
+                return JsonResponse({'error': 'Se espera Content-Type application/json o text/csv.'}, status=415)
+
+            usuario = request.user.username if request.user.is_authenticated else 'Sistema'
+            recibido = recibir_mercaderia(lineas, usuario, motivo[:200])
+        except RecepcionInvalida as e:
+            return JsonResponse({'errores': e.errores}, status=422)
+        except UnicodeDecodeError:
+            return JsonResponse({'error': 'El CSV no está en UTF-8.'}, status=400)
+        return JsonResponse(recibido, status=201)
+
+
+class ConteoListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+    model = ConteoStock
+    template_name = "productos/conteo_list.html"
+    context_object_name = "conteos"
+    paginate_by = 20
+
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.view_conteostock'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["form"] = ConteoStockForm()
+        return context
+
+
+class ConteoCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+    model = ConteoStock
+    form_class = ConteoStockForm
+    # El formulario está en el listado de conteos
+    http_method_names = ["post"]
+
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.add_conteostock'
+
+    def form_valid(self, form):
+        form.instance.usuario = self.request.user.username if self.request.user.is_authenticated else "Sistema"
+        self.object = form.save()
+        messages.success(self.request, "Conteo iniciado. Ya se pueden cargar los lotes.")
+        return redirect("productos:conteo_detail", pk=self.object.pk)
+
+    def form_invalid(self, form):
+        messages.error(self.request, "Indique un nombre para el conteo.")
+        return redirect("productos:conteo_list")
+
+
+class ConteoDetailView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
+    """Reporte de diferencias de un conteo, de la mayor a la menor, y carga de lotes."""
+    template_name = "productos/conteo_detail.html"
+    context_object_name = "lineas"
+    paginate_by = 50
+
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.view_conteostock'
+
+    def get_queryset(self):
+        self.conteo = get_object_or_404(ConteoStock, pk=self.kwargs["pk"])
+        self.todas = bool(self.request.GET.get("todas"))
+        return reporte_diferencias(self.conteo, solo_diferencias=not self.todas)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["conteo"] = self.conteo
+        context["todas"] = self.todas
+        context["totales"] = totales_diferencias(self.conteo)
+        context["contados"] = self.conteo.lineas.count()
+        context["form_lote"] = LoteConteoForm()
+        return context
+
+
+class ConteoLoteView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Carga un lote de cantidades contadas desde la pantalla del conteo."""
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.change_conteostock'
+
+    def post(self, request, pk):
+        form = LoteConteoForm(request.POST)
+        if not form.is_valid():
+            for errores in form.errors.values():
+                for error in errores:
+                    messages.error(request, error)
+            return redirect("productos:conteo_detail", pk=pk)
+        try:
+            lote = registrar_lote(pk, form.cleaned_data["lineas"], form.cleaned_data["modo"])
+        except ConteoStock.DoesNotExist:
+            return redirect("productos:conteo_list")
+        except ConteoInvalido as e:
+            for error in e.errores:
+                messages.error(request, error)
+            return redirect("productos:conteo_detail", pk=pk)
+        diferencias = sum(1 for linea in lote if linea["diferencia"])
+        messages.success(request, f"Lote registrado: {len(lote)} productos, {diferencias} con diferencias.")
+        return redirect("productos:conteo_detail", pk=pk)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ConteoLoteApiView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """API para lectores: un lote {"lineas": [{"sku": ..., "cantidad": ...}], "modo": ...} o un CSV.
+
+    Con CSV el modo va en ?modo=. Responde con la diferencia de cada
+    producto del lote para mostrarla en el lector; si algún SKU no existe
+    responde 422 y no guarda nada. Sin token CSRF, como la API de recepción.
+    """
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.change_conteostock'
+    raise_exception = True
+
+    def post(self, request, pk):
+        modo = request.GET.get('modo', 'sumar')
+        try:
+            if request.content_type == 'application/json':
+                try:
+                    datos = json.loads(request.body)
+                except ValueError:
+                    return JsonResponse({'error': 'JSON inválido.'}, status=400)
+                if not isinstance(datos, dict):
+                    return JsonResponse({'error': 'Se espera un objeto con "lineas".'}, status=400)
+                lineas = leer_json(datos.get('lineas'), minimo=0)
+                modo = datos.get('modo', modo)
+            elif request.content_type == 'text/csv':
+                lineas = leer_csv(request.body.decode(request.encoding or 'utf-8'), minimo=0)
+            else:
+                return JsonResponse({'error': 'Se espera Content-Type application/json o text/csv.'}, status=415)
+            lote = registrar_lote(pk, lineas, modo)
+        except ConteoStock.DoesNotExist:
+            return JsonResponse({'error': 'No existe el conteo.'}, status=404)
+        except (RecepcionInvalida, ConteoInvalido) as e:
+            return JsonResponse({'errores': e.errores}, status=422)
+        except UnicodeDecodeError:
+            return JsonResponse({'error': 'El CSV no está en UTF-8.'}, status=400)
+        return JsonResponse({'lineas': lote})
+
+
+class AplicarConteoView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Ajusta el stock de todos los productos contados (ver productos.conteo.aplicar_conteo)."""
+    #Restriccion de permisos para grupo stock
+    permission_required = ('productos.change_conteostock', 'productos.change_producto')
+
+    def post(self, request, pk):
+        usuario = request.user.username if request.user.is_authenticated else "Sistema"
+        try:
+            aplicado = aplicar_conteo(pk, usuario)
+        except ConteoStock.DoesNotExist:
+            return redirect("productos:conteo_list")
+        except ConteoInvalido as e:
+            messages.error(request, e.errores[0])
+            return redirect("productos:conteo_detail", pk=pk)
+        messages.success(
+            request,
+            f"Conteo aplicado: {aplicado['productos']} productos ajustados "
+            f"({aplicado['sobrantes']} unidades sobrantes, {aplicado['faltantes']} faltantes)."
+        )
+        return redirect("productos:conteo_detail", pk=pk)
+
+
+class ImportarProductosView(LoginRequiredMixin, PermissionRequiredMixin, FormView):
+    """Alta y actualización masiva de productos desde un CSV o XLSX (ver productos.importacion).
+
+    Para archivos muy grandes conviene el comando importar_productos, que
+    no depende del tiempo máximo de un request.
+    """
+    form_class = ImportarProductosForm
+    template_name = "productos/importar_productos.html"
+
+    #Restriccion de permisos para grupo stock
+    permission_required = ('productos.add_producto', 'productos.change_producto')
+
+    def form_valid(self, form):
+        archivo = form.cleaned_data["archivo"]
+        usuario = self.request.user.username if self.request.user.is_authenticated else "Sistema"
+        try:
+            resumen = importar_productos(archivo, formato_de(archivo.name), usuario)
+        except ImportacionInvalida as e:
+            form.add_error("archivo", str(e))
+            return self.form_invalid(form)
+        mensaje = f"Importación terminada: {resumen.creados} productos creados, {resumen.actualizados} actualizados."
+        if resumen.con_errores:
+            messages.warning(self.request, f"{mensaje} {resumen.con_errores} filas con errores.")
+        else:
+            messages.success(self.request, mensaje)
+        return self.render_to_response(self.get_context_data(form=ImportarProductosForm(), resumen=resumen))
+
+
+class ExportarProductosView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Descarga todos los productos en CSV (generado a medida que se envía) o XLSX."""
+    #Restriccion de permisos para grupo stock
+    permission_required = 'productos.view_producto'
+
+    def get(self, request):
+        formato = request.GET.get("formato", "csv")
+        if formato == "csv":
+            response = StreamingHttpResponse(exportar_csv(), content_type="text/csv; charset=utf-8")
+            response["Content-Disposition"] = "attachment; filename=productos.csv"
+            return response
+        if formato == "xlsx":
+            try:
+                return FileResponse(exportar_xlsx(), as_attachment=True, filename="productos.xlsx")
+            except ImportacionInvalida as e:
+                return HttpResponseBadRequest(str(e))
+        return HttpResponseBadRequest("Formato inválido, use csv o xlsx.")
+
+
 class StockBajoListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     
     model = Producto
     template_name = "productos/stock_bajo_list.html"
     context_object_name = "productos"
+    paginate_by = 20
 
     permission_required = 'productos.view_producto'
     
     def get_queryset(self):
         
-        # Se ha corregido la sintaxis. Se usa F() para una comparación eficiente
-        return Producto.objects.filter(stock__lt=F("stock_minimo")).order_by("stock")
+        # STOCK_BAJO y el orden (stock, id) coinciden con el índice parcial
+        # producto_stock_bajo_idx: la página y el conteo no recorren el catálogo
+        return Producto.objects.filter(STOCK_BAJO).order_by("stock", "id")
 
 
 # Create your views here.
@@ -0,0 +1,65 @@
+from django.db.models import Sum
+
+from .models import VentaClientePeriodo, VentaProductoPeriodo
+from .resumen import inicio_periodo, periodo_anterior
+
+TOTALES = {'total': Sum('total'), 'unidades': Sum('unidades'), 'cantidad_ventas': Sum('cantidad_ventas')}
+
+
+def _rango(queryset, granularidad, desde=None, hasta=None):
+    queryset = queryset.filter(granularidad=granularidad)
+    if desde:
+        queryset = queryset.filter(periodo__gte=inicio_periodo(desde, granularidad))
+    if hasta:
+        queryset = queryset.filter(periodo__lte=hasta)
+    return queryset
+
+
+def top_productos(granularidad, desde=None, hasta=None, limite=10):
+    return list(
+        _rango(VentaProductoPeriodo.objects, granularidad, desde, hasta)
+        .values('producto_id', 'producto__sku', 'producto__nombre')
+        .annotate(**TOTALES)
+        .order_by('-total')[:limite]
+    )
+
+
+def ventas_por_cliente(granularidad, desde=None, hasta=None, limite=10):
+    return list(
+        _rango(VentaClientePeriodo.objects, granularidad, desde, hasta)
+        .values('cliente_id', 'cliente__nombre', 'cliente__apellido')
+        .annotate(**TOTALES)
+        .order_by('-total')[:limite]
+    )
+
+
+def serie(granularidad, desde=None, hasta=None, producto=None, cliente=None):
+    """Totales por período; de un producto, de un cliente o de todas las ventas."""
+    if producto:
+        queryset = VentaProductoPeriodo.objects.filter(producto_id=producto)
+    else:
+        # Cada venta tiene exactamente una fila por cliente, así que sumarlas da el total general
+        queryset = VentaClientePeriodo.objects.all()
+        if cliente:
+            queryset = queryset.filter(cliente_id=cliente)
+    return list(
+        _rango(queryset, granularidad, desde, hasta)
+        .values('periodo')
+        .annotate(**TOTALES)
+        .order_by('periodo')
+    )
+
+
+def _totales_periodo(granularidad, periodo):
+    totales = VentaClientePeriodo.objects.filter(granularidad=granularidad, periodo=periodo).aggregate(**TOTALES)
+    return {'periodo': periodo, **{clave: valor or 0 for clave, valor in totales.items()}}
+
+
+def comparativa(granularidad, fecha):
+    """Compara el período que contiene `fecha` con el anterior."""
+    actual = _totales_periodo(granularidad, inicio_periodo(fecha, granularidad))
+    anterior = _totales_periodo(granularidad, periodo_anterior(actual['periodo'], granularidad))
+    variacion = None
+    if anterior['total']:
+        variacion = round(float((actual['total'] - anterior['total']) / anterior['total'] * 100), 2)
+    return {'actual': actual, 'anterior': anterior, 'variacion_porcentual': variacion}
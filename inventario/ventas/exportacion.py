@@ -0,0 +1,90 @@
+import io
+import zipfile
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .pdf import PLANTILLA_PDF
+from .render import PoolRenderizado
+from .services import ventas_con_detalle
+
+FORMATOS = ('zip', 'pdf')
+
+# Pool propio para exportaciones, separado del que atiende venta_pdf: una
+# exportación a la vez, y sus procesos sólo viven mientras dura
+pool_exportacion = PoolRenderizado(settings.VENTAS_EXPORTACION_PROCESOS, 1, settings.VENTAS_PDF_TIMEOUT)
+
+
+def ventas_a_exportar(desde=None, hasta=None, cliente=None):
+    ventas = ventas_con_detalle()
+    if desde:
+        ventas = ventas.filter(fecha__gte=desde)
+    if hasta:
+        ventas = ventas.filter(fecha__lte=hasta)
+    if cliente:
+        ventas = ventas.filter(cliente_id=cliente)
+    return ventas.order_by('fecha', 'id')
+
+
+def _trabajos(ventas):
+    # iterator() con chunk_size mantiene el prefetch sin cargar todo el rango
+    for venta in ventas.iterator(chunk_size=200):
+        html = render_to_string(PLANTILLA_PDF, {'venta': venta, 'items': venta.items.all()})
+        yield f'venta_{venta.sku}.pdf', html
+
+
+class _Salida(io.RawIOBase):
+    """Destino no posicionable para ZipFile: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+def exportar_zip(ventas, pool, progreso=None):
+    """Genera el ZIP por partes, a medida que cada PDF queda renderizado."""
+    total = ventas.count()
+    salida = _Salida()
+    with zipfile.ZipFile(salida, 'w', zipfile.ZIP_STORED) as archivo_zip:
+        for hechas, (nombre, pdf) in enumerate(pool.renderizar_lote(_trabajos(ventas)), start=1):
+            archivo_zip.writestr(nombre, pdf)
+            if progreso:
+                progreso(hechas, total)
+            yield salida.vaciar()
+    yield salida.vaciar()
+
+
+def exportar_pdf_unido(ventas, pool, progreso=None):
+    """Une todas las facturas en un solo PDF.
+
+    Los renders corren en paralelo, pero un PDF solo es válido con la tabla
+    de referencias al final, así que el archivo se emite al terminar.
+    """
+    from pypdf import PdfWriter
+
+    total = ventas.count()
+    unido = PdfWriter()
+    for hechas, (_, pdf) in enumerate(pool.renderizar_lote(_trabajos(ventas)), start=1):
+        unido.append(io.BytesIO(pdf))
+        if progreso:
+            progreso(hechas, total)
+    salida = io.BytesIO()
+    unido.write(salida)
+    yield salida.getvalue()
+
+
+def exportar(ventas, formato, pool, progreso=None):
+    if formato == 'pdf':
+        return exportar_pdf_unido(ventas, pool, progreso)
+    return exportar_zip(ventas, pool, progreso)
@@ -1,5 +1,9 @@
+from collections import defaultdict
+
 from django import forms
-from django.forms import inlineformset_factory
+from django.db.models import Sum
+from django.forms import BaseInlineFormSet, inlineformset_factory
+from django.utils.functional import cached_property
 from .models import Venta, ItemVenta
 from productos.models import Producto
 
@@ -15,11 +19,61 @@ class VentaForm(forms.ModelForm):
             "sku": "Dejar vacío para generar automáticamente un SKU único",
         }
 
+class ProductoChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField que busca el producto entre los que ya cargó el formset.
+
+    Sin `productos` (formulario suelto) se comporta como un ModelChoiceField común.
+    """
+    productos = None
+
+    def to_python(self, value):
+        if self.productos is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            return self.productos[int(value)]
+        except (KeyError, ValueError, TypeError):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class ProductoAutocompletarWidget(forms.Select):
+    """Select que sólo renderiza el producto elegido; las demás opciones llegan por autocompletado.
+
+    Así el tamaño de la página no depende del catálogo. `productos` lo
+    completa el formset; sin él, se busca el producto elegido en la base.
+    """
+    productos = None
+
+    def optgroups(self, name, value, attrs=None):
+        ids = {int(valor) for valor in value if str(valor).isdigit()}
+        productos = self.productos if self.productos is not None else Producto.objects.in_bulk(ids)
+        opciones = [self.create_option(name, '', '---------', not ids, 0)]
+        for indice, pk in enumerate(sorted(ids), start=1):
+            if pk in productos:
+                opciones.append(self.create_option(name, pk, str(productos[pk]), True, indice))
+        return [(None, opciones, 0)]
+
+
+class ItemExistenteField(forms.ModelChoiceField):
+    """Campo oculto `id` del formset que busca el item entre los que el formset ya trajo."""
+
+    def __init__(self, existentes, *args, **kwargs):
+        self.existentes = existentes
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.existentes[int(value)]
+        except (KeyError, ValueError, TypeError):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class ItemVentaForm(forms.ModelForm):
-    producto = forms.ModelChoiceField(
+    producto = ProductoChoiceField(
         queryset=Producto.objects.filter(stock__gt=0),
-        widget=forms.Select(attrs={'class': 'form-control producto-select'}),
-        help_text='Solo se muestran productos con stock disponible'
+        widget=ProductoAutocompletarWidget(attrs={'class': 'form-control producto-select'}),
+        help_text='Busque por SKU o nombre; solo se muestran productos con stock disponible'
     )
     
     class Meta:
@@ -38,28 +92,94 @@ class ItemVentaForm(forms.ModelForm):
             }),
         }
     
-    def clean_cantidad(self):
-        cantidad = self.cleaned_data.get('cantidad')
-        producto = self.cleaned_data.get('producto')
-        
-        if producto and cantidad:
-            if cantidad > producto.stock:
-                raise forms.ValidationError(
-                    f'Stock insuficiente. Stock disponible: {producto.stock}'
-                )
-        return cantidad
-    
+    def _get_validation_exclusions(self):
+        exclusiones = super()._get_validation_exclusions()
+        # El producto ya se validó contra los que cargó el formset: evita un SELECT por fila
+        if self.fields['producto'].productos is not None:
+            exclusiones.add('producto')
+        return exclusiones
+
     def clean_precio_unitario(self):
         precio = self.cleaned_data.get('precio_unitario')
         if precio and precio <= 0:
             raise forms.ValidationError('El precio debe ser mayor a 0')
         return precio
 
+class BaseItemVentaFormSet(BaseInlineFormSet):
+    """Resuelve los productos de todas las filas con una sola consulta y valida el stock por canasta."""
+
+    @cached_property
+    def productos(self):
+        """{pk: Producto} con los productos enviados en todas las filas; compartido con la vista.
+
+        Sin datos enviados son los productos de los items existentes, para mostrarlos.
+        Los enviados se buscan en el queryset del campo (sólo productos con stock).
+        """
+        if not self.is_bound:
+            ids = {item.producto_id for item in self.existentes.values()}
+            return Producto.objects.in_bulk(ids) if ids else {}
+        ids = set()
+        for i in range(self.total_form_count()):
+            valor = self.data.get(f'{self.prefix}-{i}-producto')
+            if valor and str(valor).isdigit():
+                ids.add(int(valor))
+        return self.form.base_fields['producto'].queryset.in_bulk(ids) if ids else {}
+
+    @cached_property
+    def existentes(self):
+        return {item.pk: item for item in self.get_queryset()}
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        form.fields['producto'].productos = self.productos
+        form.fields['producto'].widget.productos = self.productos
+        return form
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        campo = form.fields[self._pk_field.name]
+        form.fields[self._pk_field.name] = ItemExistenteField(
+            self.existentes, campo.queryset, initial=campo.initial, required=False, widget=campo.widget,
+        )
+
+    def clean(self):
+        super().clean()
+        if any(self.errors):
+            return
+        pedidos = defaultdict(int)
+        for form in self.forms:
+            if not form.cleaned_data or self._should_delete_form(form):
+                continue
+            producto = form.cleaned_data.get('producto')
+            cantidad = form.cleaned_data.get('cantidad')
+            if producto and cantidad:
+                pedidos[producto.pk] += cantidad
+
+        # Al editar, lo que la venta ya tiene descontado vuelve a estar disponible
+        reservados = {}
+        if self.instance.pk:
+            reservados = dict(
+                self.instance.items.values_list('producto_id').annotate(Sum('cantidad')).order_by()
+            )
+        # Validación temprana; la reserva definitiva la hace productos.services
+        errores = []
+        for producto_id, cantidad in pedidos.items():
+            producto = self.productos[producto_id]
+            disponible = producto.stock + reservados.get(producto_id, 0)
+            if cantidad > disponible:
+                errores.append(forms.ValidationError(
+                    f'Stock insuficiente para {producto.nombre}. Stock disponible: {disponible}, pedido: {cantidad}'
+                ))
+        if errores:
+            raise forms.ValidationError(errores)
+
+
 # Formset para los items de venta
 ItemVentaFormSet = inlineformset_factory(
     Venta,
     ItemVenta,
     form=ItemVentaForm,
+    formset=BaseItemVentaFormSet,
     extra=1,
     can_delete=True,
     min_num=1,
@@ -0,0 +1,184 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Q
+
+from clientes.models import Cliente
+from productos.models import Producto
+from productos.services import StockInsuficiente
+from .models import ClaveIdempotencia, ItemVenta, Venta
+from .services import registrar_venta
+
+MAX_LOTE = 500
+MAX_CLAVE = ClaveIdempotencia._meta.get_field('clave').max_length
+MAX_CANTIDAD = 2**31 - 1  # PositiveIntegerField en PostgreSQL
+PRECIO = ItemVenta._meta.get_field('precio_unitario')
+TOTAL = Venta._meta.get_field('total')
+
+
+class VentaInvalida(Exception):
+    pass
+
+
+def _entero(valor, campo, minimo=None, maximo=None):
+    if isinstance(valor, bool) or not isinstance(valor, int):
+        raise VentaInvalida(f'"{campo}" debe ser un entero.')
+    if minimo is not None and valor < minimo:
+        raise VentaInvalida(f'"{campo}" debe ser al menos {minimo}.')
+    if maximo is not None and valor > maximo:
+        raise VentaInvalida(f'"{campo}" debe ser como máximo {maximo}.')
+    return valor
+
+
+def _decimal(valor, campo, nombre):
+    """Valida un Decimal contra los dígitos y decimales del DecimalField `campo`."""
+    try:
+        campo.run_validators(valor)
+    except ValidationError as e:
+        raise VentaInvalida(f'"{nombre}": {" ".join(e.messages)}')
+    return valor
+
+
+def _validar(datos):
+    """Valida la forma de una venta y devuelve (clave, cliente_id, lineas) sin tocar la base.
+
+    Cada línea es un dict con `producto` (id) o `sku`, `cantidad` y
+    opcionalmente `precio_unitario`; sin precio se usa el del producto.
+    """
+    if not isinstance(datos, dict):
+        raise VentaInvalida('Cada venta debe ser un objeto.')
+    clave = datos.get('clave')
+    if not isinstance(clave, str) or not 0 < len(clave) <= MAX_CLAVE:
+        raise VentaInvalida(f'"clave" es obligatoria y de hasta {MAX_CLAVE} caracteres.')
+    cliente_id = _entero(datos.get('cliente'), 'cliente')
+    items = datos.get('items')
+    if not isinstance(items, list) or not items:
+        raise VentaInvalida('"items" debe ser una lista no vacía.')
+
+    lineas = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise VentaInvalida('Cada item debe ser un objeto.')
+        if 'producto' in item:
+            producto = ('id', _entero(item['producto'], 'producto'))
+        elif isinstance(item.get('sku'), str):
+            producto = ('sku', item['sku'])
+        else:
+            raise VentaInvalida('Cada item necesita "producto" o "sku".')
+        precio = item.get('precio_unitario')
+        if precio is not None:
+            try:
+                precio = Decimal(str(precio))
+            except InvalidOperation:
+                raise VentaInvalida('"precio_unitario" debe ser un número.')
+            # El JSON de Python acepta NaN e Infinity
+            if not precio.is_finite():
+                raise VentaInvalida('"precio_unitario" debe ser un número.')
+            if not precio > 0:
+                raise VentaInvalida('El precio debe ser mayor a 0')
+            _decimal(precio, PRECIO, 'precio_unitario')
+        lineas.append((producto, _entero(item.get('cantidad'), 'cantidad', minimo=1, maximo=MAX_CANTIDAD), precio))
+    return clave, cliente_id, lineas
+
+
+def _resolver_productos(validas):
+    """Trae en una sola consulta todos los productos del lote, por id o por SKU."""
+    ids = set()
+    skus = set()
+    for _, _, lineas in validas:
+        for (campo, valor), _, _ in lineas:
+            (ids if campo == 'id' else skus).add(valor)
+    productos = {}
+    for producto in Producto.objects.filter(Q(pk__in=ids) | Q(sku__in=skus)).only('pk', 'sku', 'nombre', 'precio'):
+        productos['id', producto.pk] = producto
+        productos['sku', producto.sku] = producto
+    return productos
+
+
+def ingresar_ventas(lote, usuario):
+    """Registra un lote de ventas enviadas por terminales POS y devuelve un resultado por venta.
+
+    Cada venta trae una `clave` elegida por el terminal. Si la clave ya se
+    procesó se devuelve la misma respuesta sin volver a registrar nada, así
+    que un terminal puede reintentar sin miedo a duplicar ventas. Productos,
+    clientes y claves ya usadas se resuelven con una consulta cada uno para
+    todo el lote; cada venta nueva pasa por registrar_venta (mismas reglas de
+    stock y movimientos) en su propia transacción junto con su clave, de
+    modo que una venta rechazada no afecta a las demás y los bloqueos de
+    stock de cada venta se liberan al guardarla, no al terminar el lote.
+    """
+    resultados = [None] * len(lote)
+    validas = []
+    posiciones = {}
+    for posicion, datos in enumerate(lote):
+        try:
+            clave, cliente_id, lineas = _validar(datos)
+        except VentaInvalida as e:
+            resultados[posicion] = {'clave': datos.get('clave') if isinstance(datos, dict) else None,
+                                    'estado': 'error', 'error': str(e)}
+            continue
+        if clave in posiciones:
+            # Clave repetida dentro del mismo lote: se resuelve como la primera
+            posiciones[clave].append(posicion)
+            continue
+        posiciones[clave] = [posicion]
+        validas.append((clave, cliente_id, lineas))
+
+    procesadas = dict(
+        ClaveIdempotencia.objects.filter(clave__in=posiciones).values_list('clave', 'respuesta')
+    )
+    nuevas = [venta for venta in validas if venta[0] not in procesadas]
+    productos = _resolver_productos(nuevas)
+    clientes = set(Cliente.objects.filter(pk__in={cliente_id for _, cliente_id, _ in nuevas}).values_list('pk', flat=True))
+
+    respuestas = {clave: dict(respuesta, estado='duplicada') for clave, respuesta in procesadas.items()}
+    for clave, cliente_id, lineas in nuevas:
+        respuestas[clave] = _registrar(clave, cliente_id, lineas, productos, clientes, usuario)
+
+    for clave, lugares in posiciones.items():
+        respuesta = respuestas[clave]
+        resultados[lugares[0]] = respuesta
+        for lugar in lugares[1:]:
+            resultados[lugar] = dict(respuesta, estado='duplicada') if respuesta['estado'] == 'creada' else respuesta
+    return resultados
+
+
+def _registrar(clave, cliente_id, lineas, productos, clientes, usuario):
+    if cliente_id not in clientes:
+        return {'clave': clave, 'estado': 'error', 'error': f'No existe el cliente {cliente_id}.'}
+    items = []
+    for producto, cantidad, precio in lineas:
+        if producto not in productos:
+            return {'clave': clave, 'estado': 'error', 'error': f'No existe el producto {producto[1]}.'}
+        encontrado = productos[producto]
+        items.append(ItemVenta(
+            producto=encontrado,
+            cantidad=cantidad,
+            precio_unitario=precio if precio is not None else encontrado.precio,
+        ))
+
+    try:
+        # Los subtotales son positivos: si el total entra en su columna, cada subtotal también
+        _decimal(sum(item.cantidad * item.precio_unitario for item in items), TOTAL, 'total')
+    except VentaInvalida as e:
+        return {'clave': clave, 'estado': 'error', 'error': str(e)}
+
+    try:
+        with transaction.atomic():
+            venta = registrar_venta(Venta(cliente_id=cliente_id), items, usuario)
+            respuesta = {'clave': clave, 'venta': venta.pk, 'sku': venta.sku, 'total': str(venta.total)}
+            # Si otro worker registró la misma clave en paralelo, el índice único
+            # lo detecta acá y se deshace esta venta completa
+            ClaveIdempotencia.objects.create(clave=clave, respuesta=respuesta)
+    except StockInsuficiente as e:
+        return {'clave': clave, 'estado': 'error', 'error': str(e)}
+    except DataError:
+        # Un valor que la base rechaza: sólo se pierde esta venta (su transacción), no el lote
+        return {'clave': clave, 'estado': 'error', 'error': 'La base de datos rechazó los valores de la venta.'}
+    except IntegrityError:
+        respuesta = ClaveIdempotencia.objects.filter(clave=clave).values_list('respuesta', flat=True).first()
+        if respuesta is None:
+            raise
+        return dict(respuesta, estado='duplicada')
+    return dict(respuesta, estado='creada')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ventas.services import anular_ventas
+
+
+class Command(BaseCommand):
+    help = 'Anula varias ventas en una sola transacción, devolviendo su stock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Ids de las ventas a anular')
+        parser.add_argument('--archivo', help='Archivo con un id de venta por línea')
+        parser.add_argument('--usuario', default='Sistema', help='Usuario que figura en los movimientos de stock')
+
+    def handle(self, *args, **options):
+        ids = list(options['ids'])
+        if options['archivo']:
+            try:
+                with open(options['archivo']) as archivo:
+                    ids.extend(int(linea) for linea in archivo if linea.strip())
+            except ValueError:
+                raise CommandError('El archivo debe tener un id numérico por línea.')
+        if not ids:
+            raise CommandError('Indique los ids de las ventas o un --archivo.')
+
+        anuladas = anular_ventas(ids, options['usuario'])
+        faltantes = len(set(ids)) - len(anuladas)
+        if faltantes:
+            self.stdout.write(self.style.WARNING(f'{faltantes} ids no corresponden a ninguna venta.'))
+        self.stdout.write(self.style.SUCCESS(f'{len(anuladas)} ventas anuladas.'))
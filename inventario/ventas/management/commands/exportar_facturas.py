@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from ventas.exportacion import FORMATOS, ventas_a_exportar, exportar
+from ventas.render import PoolRenderizado, RenderizadoVencido
+
+
+class Command(BaseCommand):
+    help = 'Exporta las facturas de un rango de fechas o de un cliente a un ZIP o a un PDF unido, renderizando en paralelo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('salida', help='Archivo de destino')
+        parser.add_argument('--desde', help='Fecha inicial (AAAA-MM-DD)')
+        parser.add_argument('--hasta', help='Fecha final (AAAA-MM-DD)')
+        parser.add_argument('--cliente', type=int, help='Id del cliente')
+        parser.add_argument('--formato', choices=FORMATOS, default='zip')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        try:
+            desde = parse_date(options['desde']) if options['desde'] else None
+            hasta = parse_date(options['hasta']) if options['hasta'] else None
+        except ValueError:
+            raise CommandError('Fecha inválida.')
+        ventas = ventas_a_exportar(desde, hasta, options['cliente'])
+        if not ventas.exists():
+            raise CommandError('No hay ventas para exportar con esos filtros.')
+
+        def progreso(hechas, total):
+            self.stdout.write(f'\r{hechas}/{total} facturas', ending='')
+            self.stdout.flush()
+
+        pool = PoolRenderizado(options['procesos'], 1, settings.VENTAS_PDF_TIMEOUT)
+        inicio = time.perf_counter()
+        try:
+            with open(options['salida'], 'wb') as archivo:
+                for parte in exportar(ventas, options['formato'], pool, progreso):
+                    archivo.write(parte)
+        except RenderizadoVencido:
+            raise CommandError('Una factura tardó más que VENTAS_PDF_TIMEOUT en renderizarse.')
+        finally:
+            pool.cerrar()
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Exportado {options['salida']} en {time.perf_counter() - inicio:.1f}s con {options['procesos']} procesos"
+        ))
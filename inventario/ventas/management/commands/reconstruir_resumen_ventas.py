@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ventas.resumen import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el resumen diario y el cubo de analítica de ventas a partir de Venta e ItemVenta.'
+
+    def handle(self, *args, **options):
+        dias = reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes reconstruidos: {dias} días.'))
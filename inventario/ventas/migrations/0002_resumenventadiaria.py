@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:48
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def poblar_resumen(apps, schema_editor):
+    Venta = apps.get_model('ventas', 'Venta')
+    ItemVenta = apps.get_model('ventas', 'ItemVenta')
+    ResumenVentaDiaria = apps.get_model('ventas', 'ResumenVentaDiaria')
+    resumenes = {
+        fila['fecha']: ResumenVentaDiaria(fecha=fila['fecha'], cantidad_ventas=fila['cantidad'])
+        for fila in Venta.objects.values('fecha').annotate(cantidad=Count('id')).order_by()
+    }
+    for fila in ItemVenta.objects.values('venta__fecha').annotate(total=Sum('subtotal'), unidades=Sum('cantidad')).order_by():
+        resumenes[fila['venta__fecha']].total = fila['total']
+        resumenes[fila['venta__fecha']].unidades = fila['unidades']
+    ResumenVentaDiaria.objects.bulk_create(resumenes.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ventas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenVentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total')),
+                ('cantidad_ventas', models.IntegerField(default=0, verbose_name='Cantidad de ventas')),
+                ('unidades', models.IntegerField(default=0, verbose_name='Unidades vendidas')),
+            ],
+            options={
+                'verbose_name': 'Resumen de ventas diario',
+                'verbose_name_plural': 'Resúmenes de ventas diarios',
+                'ordering': ['fecha'],
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+TRUNCAR = {'dia': TruncDay, 'semana': TruncWeek, 'mes': TruncMonth}
+
+
+def poblar_cubo(apps, schema_editor):
+    # Lo mismo que ventas.resumen.reconstruir, con los modelos de esta migración
+    Venta = apps.get_model('ventas', 'Venta')
+    ItemVenta = apps.get_model('ventas', 'ItemVenta')
+    VentaProductoPeriodo = apps.get_model('ventas', 'VentaProductoPeriodo')
+    VentaClientePeriodo = apps.get_model('ventas', 'VentaClientePeriodo')
+    for granularidad, truncar in TRUNCAR.items():
+        filas = (
+            ItemVenta.objects
+            .annotate(periodo=truncar('venta__fecha'))
+            .values('periodo', 'producto_id')
+            .annotate(total=Sum('subtotal'), unidades=Sum('cantidad'), ventas=Count('venta', distinct=True))
+            .order_by()
+        )
+        VentaProductoPeriodo.objects.bulk_create((
+            VentaProductoPeriodo(
+                granularidad=granularidad, periodo=fila['periodo'], producto_id=fila['producto_id'],
+                total=fila['total'], unidades=fila['unidades'], cantidad_ventas=fila['ventas'],
+            )
+            for fila in filas.iterator()
+        ), batch_size=1000)
+
+        clientes = {
+            (fila['periodo'], fila['cliente_id']): VentaClientePeriodo(
+                granularidad=granularidad, periodo=fila['periodo'], cliente_id=fila['cliente_id'],
+                cantidad_ventas=fila['ventas'],
+            )
+            for fila in Venta.objects.annotate(periodo=truncar('fecha'))
+            .values('periodo', 'cliente_id').annotate(ventas=Count('id')).order_by()
+        }
+        for fila in (
+            ItemVenta.objects.annotate(periodo=truncar('venta__fecha'))
+            .values('periodo', 'venta__cliente_id').annotate(total=Sum('subtotal'), unidades=Sum('cantidad'))
+            .order_by()
+        ):
+            cliente = clientes[(fila['periodo'], fila['venta__cliente_id'])]
+            cliente.total = fila['total']
+            cliente.unidades = fila['unidades']
+        VentaClientePeriodo.objects.bulk_create(clientes.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0001_initial'),
+        ('productos', '0002_secuenciasku'),
+        ('ventas', '0002_resumenventadiaria'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VentaClientePeriodo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularidad', models.CharField(choices=[('dia', 'Día'), ('semana', 'Semana'), ('mes', 'Mes')], max_length=6, verbose_name='Granularidad')),
+                ('periodo', models.DateField(verbose_name='Inicio del período')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total')),
+                ('unidades', models.IntegerField(default=0, verbose_name='Unidades vendidas')),
+                ('cantidad_ventas', models.IntegerField(default=0, verbose_name='Cantidad de ventas')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='clientes.cliente')),
+            ],
+            options={
+                'verbose_name': 'Ventas por cliente y período',
+                'verbose_name_plural': 'Ventas por cliente y período',
+                'constraints': [models.UniqueConstraint(fields=('granularidad', 'periodo', 'cliente'), name='venta_cliente_periodo_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaProductoPeriodo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularidad', models.CharField(choices=[('dia', 'Día'), ('semana', 'Semana'), ('mes', 'Mes')], max_length=6, verbose_name='Granularidad')),
+                ('periodo', models.DateField(verbose_name='Inicio del período')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total')),
+                ('unidades', models.IntegerField(default=0, verbose_name='Unidades vendidas')),
+                ('cantidad_ventas', models.IntegerField(default=0, verbose_name='Cantidad de ventas')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Ventas por producto y período',
+                'verbose_name_plural': 'Ventas por producto y período',
+                'constraints': [models.UniqueConstraint(fields=('granularidad', 'periodo', 'producto'), name='venta_producto_periodo_unico')],
+            },
+        ),
+        migrations.RunPython(poblar_cubo, migrations.RunPython.noop),
+    ]
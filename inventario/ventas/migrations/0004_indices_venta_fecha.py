@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0001_initial'),
+        ('ventas', '0003_cubo_ventas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['fecha', 'id'], name='ventas_vent_fecha_817832_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='venta',
+            index=models.Index(fields=['cliente', 'fecha', 'id'], name='ventas_vent_cliente_6619e4_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientes', '0001_initial'),
+        ('productos', '0002_secuenciasku'),
+        ('ventas', '0005_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itemventa',
+            name='producto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='productos.producto'),
+        ),
+        migrations.AlterField(
+            model_name='venta',
+            name='cliente',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='clientes.cliente'),
+        ),
+    ]
@@ -2,8 +2,9 @@
 from django.db import models
 from clientes.models import Cliente
 from productos.models import Producto
-import random
-import string
+from productos.sku import AsignadorSku
+
+SKU_VENTAS = AsignadorSku('VENT', 'ventas.Venta')
 
 class Venta(models.Model):
     sku = models.CharField('sku', max_length=20, unique=True, editable=True,  help_text="Código único de identificación del producto", blank=True, null=True)
@@ -11,6 +12,13 @@ class Venta(models.Model):
     fecha = models.DateField(auto_now_add=True)
     total = models.DecimalField(max_digits=10, decimal_places=2,)
 
+    class Meta:
+        indexes = [
+            # Paginación por cursor y filtros por rango de fechas (ver ventas.paginacion)
+            models.Index(fields=['fecha', 'id']),
+            models.Index(fields=['cliente', 'fecha', 'id']),
+        ]
+
     def save(self, *args, **kwargs):
         # Asegúrate de calcular el total antes de guardar
         if not self.total:
@@ -20,10 +28,7 @@ class Venta(models.Model):
         super().save(*args, **kwargs)
     def generar_sku_unico(self):
        """Genera un SKU único automáticamente"""
-       while True:
-           sku = f"VENT-{random.randint(10000, 99999)}"
-           if not Venta.objects.filter(sku=sku).exists():
-                return sku
+       return SKU_VENTAS.siguiente()
 
 
     def calcular_total(self):
@@ -46,5 +51,79 @@ class ItemVenta(models.Model):
         self.subtotal = self.cantidad * self.precio_unitario
         super().save(*args, **kwargs)
     
+
+class ResumenVentaDiaria(models.Model):
+    """Totales por día, mantenidos en la misma transacción que cada venta (ver ventas.resumen)."""
+    fecha = models.DateField('Fecha', unique=True)
+    total = models.DecimalField('Total', max_digits=14, decimal_places=2, default=0)
+    cantidad_ventas = models.IntegerField('Cantidad de ventas', default=0)
+    unidades = models.IntegerField('Unidades vendidas', default=0)
+
+    class Meta:
+        verbose_name = 'Resumen de ventas diario'
+        verbose_name_plural = 'Resúmenes de ventas diarios'
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.fecha} - {self.total}"
+
+
+GRANULARIDAD_CHOICES = [
+    ('dia', 'Día'),
+    ('semana', 'Semana'),
+    ('mes', 'Mes'),
+]
+
+
+class VentaProductoPeriodo(models.Model):
+    """Ventas por producto y período (día, semana que empieza el lunes, o mes)."""
+    granularidad = models.CharField('Granularidad', max_length=6, choices=GRANULARIDAD_CHOICES)
+    periodo = models.DateField('Inicio del período')
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    total = models.DecimalField('Total', max_digits=14, decimal_places=2, default=0)
+    unidades = models.IntegerField('Unidades vendidas', default=0)
+    cantidad_ventas = models.IntegerField('Cantidad de ventas', default=0)
+
+    class Meta:
+        verbose_name = 'Ventas por producto y período'
+        verbose_name_plural = 'Ventas por producto y período'
+        constraints = [
+            models.UniqueConstraint(fields=['granularidad', 'periodo', 'producto'], name='venta_producto_periodo_unico'),
+        ]
+
+
+class VentaClientePeriodo(models.Model):
+    """Ventas por cliente y período (día, semana que empieza el lunes, o mes)."""
+    granularidad = models.CharField('Granularidad', max_length=6, choices=GRANULARIDAD_CHOICES)
+    periodo = models.DateField('Inicio del período')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='+')
+    total = models.DecimalField('Total', max_digits=14, decimal_places=2, default=0)
+    unidades = models.IntegerField('Unidades vendidas', default=0)
+    cantidad_ventas = models.IntegerField('Cantidad de ventas', default=0)
+
+    class Meta:
+        verbose_name = 'Ventas por cliente y período'
+        verbose_name_plural = 'Ventas por cliente y período'
+        constraints = [
+            models.UniqueConstraint(fields=['granularidad', 'periodo', 'cliente'], name='venta_cliente_periodo_unico'),
+        ]
+
+
+class ClaveIdempotencia(models.Model):
+    """Clave enviada por un terminal POS junto con la respuesta que recibió (ver ventas.ingesta).
+
+    Guarda la respuesta y no una FK a la venta: si la venta se anula, un
+    reintento tardío sigue recibiendo lo mismo en lugar de crearla de nuevo.
+    """
+    clave = models.CharField('Clave', max_length=64, unique=True)
+    respuesta = models.JSONField('Respuesta')
+    fecha_creacion = models.DateTimeField('Fecha de creación', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Clave de idempotencia'
+        verbose_name_plural = 'Claves de idempotencia'
+
+    def __str__(self):
+        return self.clave
    
 # Create your models here.
@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.db.models import Q
+
+
+def codificar_cursor(venta):
+    return f'{venta.fecha.isoformat()}_{venta.pk}'
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, id) o None si el cursor no es válido."""
+    try:
+        fecha, pk = cursor.split('_')
+        return date.fromisoformat(fecha), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def pagina_por_cursor(queryset, cursor, tamano):
+    """Devuelve (ventas, siguiente_cursor) ordenando por (fecha, id) descendente.
+
+    En lugar de OFFSET se filtra a partir de la última venta mostrada, así
+    que con el índice (fecha, id) cualquier página cuesta lo mismo que la
+    primera y no hace falta COUNT(*).
+    """
+    queryset = queryset.order_by('-fecha', '-id')
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if posicion:
+        fecha, pk = posicion
+        queryset = queryset.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=pk))
+    ventas = list(queryset[:tamano + 1])
+    siguiente = codificar_cursor(ventas[tamano - 1]) if len(ventas) > tamano else None
+    return ventas[:tamano], siguiente
@@ -0,0 +1,103 @@
+import functools
+import glob
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.template.loader import get_template
+
+from .render import PoolRenderizado
+
+PLANTILLA_PDF = 'ventas/venta_pdf.html'
+
+
+@functools.lru_cache(maxsize=1)
+def _version_plantilla():
+    # Si cambia la plantilla cambian todas las claves
+    origen = get_template(PLANTILLA_PDF).template.source
+    return hashlib.sha256(origen.encode()).hexdigest()[:16]
+
+
+def clave_venta(venta, items):
+    """Clave de contenido del PDF: cambia si cambian la venta, sus items o la plantilla."""
+    partes = [_version_plantilla(), venta.pk, venta.sku, str(venta.fecha), venta.cliente_id, str(venta.total)]
+    for item in items:
+        partes.append((
+            item.pk, item.producto_id, item.producto.nombre, item.producto.sku,
+            item.cantidad, str(item.precio_unitario), str(item.subtotal),
+        ))
+    return hashlib.sha256(repr(partes).encode()).hexdigest()
+
+
+class CachePdf:
+    """Cache en disco de PDFs renderizados, con desalojo LRU por tamaño total.
+
+    Los archivos se llaman `<venta_id>-<clave>.pdf`; el mtime se usa como
+    marca de último acceso.
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self.directorio = str(directorio)
+        self.max_bytes = max_bytes
+
+    def _ruta(self, venta_id, clave):
+        return os.path.join(self.directorio, f'{venta_id}-{clave}.pdf')
+
+    def obtener(self, venta_id, clave):
+        ruta = self._ruta(venta_id, clave)
+        try:
+            with open(ruta, 'rb') as archivo:
+                contenido = archivo.read()
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return contenido
+
+    def guardar(self, venta_id, clave, contenido):
+        os.makedirs(self.directorio, exist_ok=True)
+        # Escritura atómica: otro proceso nunca ve un PDF a medio escribir
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, self._ruta(venta_id, clave))
+        self.purgar()
+
+    def invalidar(self, venta_id):
+        for ruta in glob.glob(os.path.join(self.directorio, f'{venta_id}-*.pdf')):
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+    def purgar(self):
+        try:
+            entradas = [e for e in os.scandir(self.directorio) if e.name.endswith('.pdf')]
+        except FileNotFoundError:
+            return
+        archivos = []
+        total = 0
+        for entrada in entradas:
+            try:
+                info = entrada.stat()
+            except FileNotFoundError:
+                continue
+            archivos.append((info.st_mtime, info.st_size, entrada.path))
+            total += info.st_size
+        # Se eliminan primero los menos usados
+        for _, tamano, ruta in sorted(archivos):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            total -= tamano
+
+
+cache_pdf = CachePdf(settings.VENTAS_PDF_CACHE_DIR, settings.VENTAS_PDF_CACHE_MAX_BYTES)
+pool_pdf = PoolRenderizado(
+    settings.VENTAS_PDF_PROCESOS,
+    settings.VENTAS_PDF_MAX_CONCURRENCIA,
+    settings.VENTAS_PDF_TIMEOUT,
+)
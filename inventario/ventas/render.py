@@ -0,0 +1,186 @@
+"""Pool de procesos que renderizan PDFs con WeasyPrint.
+
+Este módulo no importa Django ni WeasyPrint a nivel de módulo: los workers
+se lanzan con `spawn` y solo cargan WeasyPrint una vez, en `_inicializar`.
+Así los procesos web no pagan el import ni la memoria de WeasyPrint.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+# Estado de cada worker
+_fuentes = None
+
+
+def _inicializar():
+    global _fuentes
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    _fuentes = FontConfiguration()
+    # Un render mínimo deja cargados pango, fontconfig y las fuentes
+    HTML(string='<p>.</p>').write_pdf(font_config=_fuentes)
+
+
+def _renderizar(html, base_url):
+    from weasyprint import HTML
+
+    return HTML(string=html, base_url=base_url).write_pdf(font_config=_fuentes)
+
+
+class RenderizadoOcupado(Exception):
+    """Se alcanzó el límite de renders simultáneos, o el pool se está reiniciando."""
+
+
+class RenderizadoVencido(Exception):
+    """El render no terminó dentro del tiempo límite."""
+
+
+class _Ocupado:
+    """Itera `partes` y libera el lugar del pool al terminar o al cerrarse (ver PoolRenderizado.ocupar)."""
+
+    def __init__(self, pool, partes, cerrar):
+        self._pool = pool
+        self._partes = partes
+        self._cerrar = cerrar
+        self._liberado = False
+
+    def __iter__(self):
+        try:
+            yield from self._partes
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._liberado:
+            self._liberado = True
+            try:
+                getattr(self._partes, 'close', lambda: None)()
+                if self._cerrar:
+                    self._pool.cerrar()
+            finally:
+                self._pool.liberar()
+
+
+class PoolRenderizado:
+    """Envía renders a un pool de procesos con límite de concurrencia y timeout.
+
+    El pool se crea en el primer uso y se vuelve a crear después de un fork,
+    de modo que cada proceso web tiene el suyo. Un render que se pasa del
+    timeout no se puede cancelar una vez que arrancó: se terminan los
+    procesos del pool y el próximo render arranca uno nuevo, así un render
+    trabado no sigue ocupando un worker.
+    """
+
+    def __init__(self, procesos, max_concurrencia, timeout, espera=0.5):
+        self.procesos = procesos
+        self.timeout = timeout
+        # Cuánto espera un render a que se libere un lugar antes de RenderizadoOcupado
+        self.espera = espera
+        self._semaforo = threading.BoundedSemaphore(max_concurrencia)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.procesos,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_inicializar,
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def _descartar(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+
+    def _reciclar(self, pool):
+        """Descarta el pool y termina sus procesos, incluido el que tiene el render trabado.
+
+        Los renders que corrían en ese pool terminan con BrokenProcessPool.
+        """
+        self._descartar(pool)
+        terminar = getattr(pool, 'terminate_workers', None)  # Python 3.14+
+        if terminar is not None:
+            terminar()
+            return
+        procesos = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proceso in procesos:
+            proceso.terminate()
+
+    def reservar(self):
+        """Toma un lugar del límite de concurrencia; lanza RenderizadoOcupado si no se libera pronto."""
+        if not self._semaforo.acquire(timeout=self.espera):
+            raise RenderizadoOcupado()
+
+    def liberar(self):
+        self._semaforo.release()
+
+    def ocupar(self, partes, cerrar=False):
+        """Toma un lugar del límite para un trabajo en streaming y devuelve `partes` envuelto.
+
+        El lugar se pide antes de empezar a responder (RenderizadoOcupado
+        todavía puede ser un 503) y se libera cuando la respuesta termina o
+        se cierra. Con `cerrar` también se terminan los procesos del pool,
+        para que un pool de uso ocasional no quede ocupando memoria.
+        """
+        self.reservar()
+        return _Ocupado(self, partes, cerrar)
+
+    def renderizar(self, html, base_url=None):
+        self.reservar()
+        try:
+            pool = self._executor()
+            futuro = pool.submit(_renderizar, html, base_url)
+            try:
+                return futuro.result(timeout=self.timeout)
+            except FuturesTimeout:
+                self._reciclar(pool)
+                raise RenderizadoVencido()
+            except BrokenProcessPool:
+                # Un worker murió o el pool se recicló: el próximo render arranca un pool nuevo
+                self._descartar(pool)
+                raise RenderizadoOcupado()
+        finally:
+            self.liberar()
+
+    def renderizar_lote(self, trabajos):
+        """Renderiza `(clave, html)` en paralelo y devuelve `(clave, pdf)` en el mismo orden.
+
+        Mantiene como máximo dos trabajos por proceso en vuelo, así la
+        memoria no crece con el tamaño del lote.
+        """
+        pool = self._executor()
+        pendientes = deque()
+        try:
+            for clave, html in trabajos:
+                pendientes.append((clave, pool.submit(_renderizar, html, None)))
+                if len(pendientes) >= self.procesos * 2:
+                    clave_lista, futuro = pendientes.popleft()
+                    yield clave_lista, futuro.result(timeout=self.timeout)
+            while pendientes:
+                clave_lista, futuro = pendientes.popleft()
+                yield clave_lista, futuro.result(timeout=self.timeout)
+        except FuturesTimeout:
+            self._reciclar(pool)
+            raise RenderizadoVencido()
+        except BrokenProcessPool:
+            self._descartar(pool)
+            raise
+        finally:
+            for _, futuro in pendientes:
+                futuro.cancel()
+
+    def cerrar(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(cancel_futures=True)
+            self._pool = None
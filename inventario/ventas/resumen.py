@@ -0,0 +1,199 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import (
+    GRANULARIDAD_CHOICES, ItemVenta, ResumenVentaDiaria, Venta,
+    VentaClientePeriodo, VentaProductoPeriodo,
+)
+
+GRANULARIDADES = [clave for clave, _ in GRANULARIDAD_CHOICES]
+TRUNCAR = {'dia': TruncDay, 'semana': TruncWeek, 'mes': TruncMonth}
+
+
+def inicio_periodo(fecha, granularidad):
+    if granularidad == 'semana':
+        return fecha - timedelta(days=fecha.weekday())
+    if granularidad == 'mes':
+        return fecha.replace(day=1)
+    return fecha
+
+
+def periodo_anterior(periodo, granularidad):
+    if granularidad == 'semana':
+        return periodo - timedelta(days=7)
+    if granularidad == 'mes':
+        return (periodo - timedelta(days=1)).replace(day=1)
+    return periodo - timedelta(days=1)
+
+
+def incrementar(modelo, claves, campos, filas):
+    """Suma `campos` en las filas de `modelo` identificadas por `claves`, creándolas si no existen.
+
+    Es un único INSERT ... ON CONFLICT DO UPDATE (PostgreSQL y SQLite), así
+    que dos ventas concurrentes del mismo día nunca pisan sus totales.
+    """
+    if not filas:
+        return
+    qn = connection.ops.quote_name
+    tabla = qn(modelo._meta.db_table)
+    campos_modelo = [modelo._meta.get_field(nombre) for nombre in claves + campos]
+    columnas = ', '.join(qn(campo.column) for campo in campos_modelo)
+    marcadores = '(' + ', '.join(['%s'] * len(campos_modelo)) + ')'
+    conflicto = ', '.join(qn(modelo._meta.get_field(nombre).column) for nombre in claves)
+    sumas = ', '.join(
+        f'{qn(campo.column)} = {tabla}.{qn(campo.column)} + EXCLUDED.{qn(campo.column)}'
+        for campo in campos_modelo[len(claves):]
+    )
+    parametros = []
+    for fila in filas:
+        parametros.extend(
+            campo.get_db_prep_value(fila[campo.name], connection) for campo in campos_modelo
+        )
+    sql = (
+        f'INSERT INTO {tabla} ({columnas}) VALUES {", ".join([marcadores] * len(filas))} '
+        f'ON CONFLICT ({conflicto}) DO UPDATE SET {sumas}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+
+
+def aplicar_venta(fecha, cliente_id, lineas, signo=1):
+    """Suma (signo=1) o resta (signo=-1) una venta de los resúmenes.
+
+    `lineas` es una lista de tuplas (producto_id, cantidad, subtotal).
+    Debe llamarse dentro de la transacción que crea, edita o borra la venta.
+    Actualiza el resumen diario y el cubo por producto y por cliente con
+    tres consultas, sin importar la cantidad de líneas.
+    """
+    aplicar_ventas([(fecha, cliente_id, lineas)], signo)
+
+
+def aplicar_ventas(ventas, signo=1):
+    """Como aplicar_venta, pero para varias ventas (fecha, cliente_id, lineas) a la vez.
+
+    Las filas se agrupan por clave antes de escribir, porque un mismo
+    INSERT ... ON CONFLICT no puede tocar dos veces la misma fila. Son
+    tres consultas sin importar cuántas ventas o líneas haya.
+    """
+    # clave -> [total, unidades, cantidad_ventas]
+    por_dia = defaultdict(lambda: [0, 0, 0])
+    por_producto = defaultdict(lambda: [0, 0, 0])
+    por_cliente = defaultdict(lambda: [0, 0, 0])
+    for fecha, cliente_id, lineas in ventas:
+        total = sum(subtotal for _, _, subtotal in lineas)
+        unidades = sum(cantidad for _, cantidad, _ in lineas)
+        _sumar(por_dia[fecha], total, unidades)
+
+        productos = defaultdict(lambda: [0, 0])
+        for producto_id, cantidad, subtotal in lineas:
+            productos[producto_id][0] += subtotal
+            productos[producto_id][1] += cantidad
+        for granularidad in GRANULARIDADES:
+            periodo = inicio_periodo(fecha, granularidad)
+            for producto_id, (subtotal, cantidad) in productos.items():
+                _sumar(por_producto[granularidad, periodo, producto_id], subtotal, cantidad)
+            _sumar(por_cliente[granularidad, periodo, cliente_id], total, unidades)
+
+    campos = ['total', 'unidades', 'cantidad_ventas']
+    incrementar(ResumenVentaDiaria, ['fecha'], campos, [
+        {'fecha': fecha, **_valores(valores, signo)} for fecha, valores in por_dia.items()
+    ])
+    incrementar(VentaProductoPeriodo, ['granularidad', 'periodo', 'producto'], campos, [
+        {'granularidad': granularidad, 'periodo': periodo, 'producto': producto_id, **_valores(valores, signo)}
+        for (granularidad, periodo, producto_id), valores in por_producto.items()
+    ])
+    incrementar(VentaClientePeriodo, ['granularidad', 'periodo', 'cliente'], campos, [
+        {'granularidad': granularidad, 'periodo': periodo, 'cliente': cliente_id, **_valores(valores, signo)}
+        for (granularidad, periodo, cliente_id), valores in por_cliente.items()
+    ])
+
+
+def _sumar(acumulado, total, unidades):
+    acumulado[0] += total
+    acumulado[1] += unidades
+    acumulado[2] += 1
+
+
+def _valores(acumulado, signo):
+    total, unidades, cantidad_ventas = acumulado
+    return {'total': signo * total, 'unidades': signo * unidades, 'cantidad_ventas': signo * cantidad_ventas}
+
+
+def lineas_de(items):
+    return [(item.producto_id, item.cantidad, item.subtotal) for item in items]
+
+
+def lineas_guardadas(venta):
+    """Líneas de la venta tal como están en la base, antes de editarla o borrarla."""
+    return list(venta.items.values_list('producto_id', 'cantidad', 'subtotal'))
+
+
+def reconstruir():
+    """Recalcula el resumen diario y el cubo desde cero con consultas agrupadas."""
+    with transaction.atomic():
+        ResumenVentaDiaria.objects.all().delete()
+        VentaProductoPeriodo.objects.all().delete()
+        VentaClientePeriodo.objects.all().delete()
+
+        resumenes = {
+            fila['fecha']: ResumenVentaDiaria(fecha=fila['fecha'], cantidad_ventas=fila['cantidad'])
+            for fila in Venta.objects.values('fecha').annotate(cantidad=Count('id')).order_by()
+        }
+        totales = (
+            ItemVenta.objects
+            .values('venta__fecha')
+            .annotate(total=Sum('subtotal'), unidades=Sum('cantidad'))
+            .order_by()
+        )
+        for fila in totales:
+            resumen = resumenes[fila['venta__fecha']]
+            resumen.total = fila['total']
+            resumen.unidades = fila['unidades']
+        ResumenVentaDiaria.objects.bulk_create(resumenes.values(), batch_size=1000)
+
+        for granularidad in GRANULARIDADES:
+            truncar = TRUNCAR[granularidad]
+            filas = (
+                ItemVenta.objects
+                .annotate(periodo=truncar('venta__fecha'))
+                .values('periodo', 'producto_id')
+                .annotate(total=Sum('subtotal'), unidades=Sum('cantidad'), ventas=Count('venta', distinct=True))
+                .order_by()
+            )
+            VentaProductoPeriodo.objects.bulk_create((
+                VentaProductoPeriodo(
+                    granularidad=granularidad, periodo=fila['periodo'], producto_id=fila['producto_id'],
+                    total=fila['total'], unidades=fila['unidades'], cantidad_ventas=fila['ventas'],
+                )
+                for fila in filas.iterator()
+            ), batch_size=1000)
+
+            clientes = {
+                (fila['periodo'], fila['cliente_id']): VentaClientePeriodo(
+                    granularidad=granularidad, periodo=fila['periodo'], cliente_id=fila['cliente_id'],
+                    cantidad_ventas=fila['ventas'],
+                )
+                for fila in Venta.objects
+                .annotate(periodo=truncar('fecha'))
+                .values('periodo', 'cliente_id')
+                .annotate(ventas=Count('id'))
+                .order_by()
+            }
+            totales = (
+                ItemVenta.objects
+                .annotate(periodo=truncar('venta__fecha'))
+                .values('periodo', 'venta__cliente_id')
+                .annotate(total=Sum('subtotal'), unidades=Sum('cantidad'))
+                .order_by()
+            )
+            for fila in totales:
+                cliente = clientes[(fila['periodo'], fila['venta__cliente_id'])]
+                cliente.total = fila['total']
+                cliente.unidades = fila['unidades']
+            VentaClientePeriodo.objects.bulk_create(clientes.values(), batch_size=1000)
+
+    return len(resumenes)
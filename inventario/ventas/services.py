@@ -0,0 +1,213 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Prefetch
+
+from productos.models import MovimientoStock
+from productos.services import descontar_stock, mover_stock
+from .models import Venta, ItemVenta
+from .pdf import cache_pdf
+from .resumen import aplicar_venta, aplicar_ventas, lineas_de
+
+CAMPOS_ITEM = ['producto', 'cantidad', 'precio_unitario', 'subtotal']
+
+
+def ventas_con_detalle():
+    """Ventas con cliente, items y productos cargados en dos consultas fijas.
+
+    Una para la venta y su cliente (JOIN) y otra para los items con sus
+    productos (JOIN); recorrer `venta.items.all()` después no consulta más.
+    """
+    return Venta.objects.select_related('cliente').prefetch_related(
+        Prefetch('items', queryset=ItemVenta.objects.select_related('producto').order_by('id'))
+    )
+
+
+def registrar_venta(venta, items, usuario):
+    """Guarda la venta, sus items y los movimientos de stock en bloque.
+
+    El costo en consultas es fijo sin importar la cantidad de items: la
+    reserva de stock (bloqueo + UPDATE condicional), un INSERT para la venta,
+    uno masivo para los items y uno masivo para los movimientos.
+    """
+    cantidades = defaultdict(int)
+    total_venta = 0
+    for item in items:
+        item.subtotal = item.cantidad * item.precio_unitario
+        total_venta += item.subtotal
+        cantidades[item.producto_id] += item.cantidad
+
+    with transaction.atomic():
+        # Reservar primero: bloquea los productos y valida contra el stock real
+        descontar_stock(cantidades)
+
+        venta.total = total_venta
+        venta.save()
+
+        for item in items:
+            item.venta = venta
+        ItemVenta.objects.bulk_create(items)
+
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(
+                producto=item.producto,
+                tipo='salida',
+                cantidad=item.cantidad,
+                motivo=f'Venta {venta.sku}',
+                usuario=usuario,
+            )
+            for item in items
+        ])
+        aplicar_venta(venta.fecha, venta.cliente_id, lineas_de(items))
+    return venta
+
+
+def actualizar_venta(venta, items, eliminados, usuario):
+    """Guarda la edición de una venta moviendo sólo la diferencia de stock.
+
+    `items` son los items nuevos o modificados del formset y `eliminados`
+    los que se borraron. Se compara, por producto, la cantidad guardada con
+    la que queda después de editar: lo que sobra vuelve al stock y lo que
+    falta se descuenta, todo en un único UPDATE, y cada diferencia deja su
+    movimiento. Cambiar el producto de una línea devuelve el anterior y
+    descuenta el nuevo. El costo en consultas no depende de los items.
+
+    Bloquea la venta antes de leer lo guardado, como anular_ventas: dos
+    ediciones simultáneas no calculan la diferencia desde los mismos items
+    y una venta anulada mientras se editaba lanza Venta.DoesNotExist en
+    lugar de volver a crearse.
+    """
+    with transaction.atomic():
+        anterior = Venta.objects.select_for_update().values('fecha', 'cliente_id').get(pk=venta.pk)
+        guardadas = {
+            pk: (producto_id, cantidad, subtotal)
+            for pk, producto_id, cantidad, subtotal
+            in venta.items.values_list('pk', 'producto_id', 'cantidad', 'subtotal')
+        }
+
+        # Estado final: lo guardado, sin lo eliminado y con lo editado o agregado encima
+        finales = dict(guardadas)
+        borrar = [item.pk for item in eliminados if item.pk in guardadas]
+        for pk in borrar:
+            del finales[pk]
+        nuevos = []
+        modificados = []
+        for item in items:
+            item.venta = venta
+            item.subtotal = item.cantidad * item.precio_unitario
+            if item.pk in guardadas:
+                modificados.append(item)
+                finales[item.pk] = (item.producto_id, item.cantidad, item.subtotal)
+            else:
+                nuevos.append(item)
+        lineas_anteriores = list(guardadas.values())
+        lineas_nuevas = list(finales.values()) + lineas_de(nuevos)
+
+        # Cambio de stock por producto: lo que se devuelve menos lo que se vende de nuevo
+        cambios = defaultdict(int)
+        for producto_id, cantidad, _ in lineas_anteriores:
+            cambios[producto_id] += cantidad
+        for producto_id, cantidad, _ in lineas_nuevas:
+            cambios[producto_id] -= cantidad
+        cambios = {producto_id: cambio for producto_id, cambio in cambios.items() if cambio}
+        mover_stock(cambios)
+
+        venta.total = sum(subtotal for _, _, subtotal in lineas_nuevas)
+        venta.save()
+
+        if borrar:
+            ItemVenta.objects.filter(pk__in=borrar).delete()
+        if modificados:
+            ItemVenta.objects.bulk_update(modificados, CAMPOS_ITEM)
+        if nuevos:
+            ItemVenta.objects.bulk_create(nuevos)
+
+        MovimientoStock.objects.bulk_create([
+            MovimientoStock(
+                producto_id=producto_id,
+                tipo='entrada' if cambio > 0 else 'salida',
+                cantidad=abs(cambio),
+                motivo=f'Edición de venta {venta.sku}',
+                usuario=usuario,
+            )
+            for producto_id, cambio in cambios.items()
+        ])
+
+        # Mover la venta en los resúmenes: restar la versión anterior y sumar la nueva
+        aplicar_venta(anterior['fecha'], anterior['cliente_id'], lineas_anteriores, signo=-1)
+        aplicar_venta(venta.fecha, venta.cliente_id, lineas_nuevas)
+    return venta
+
+
+def anular_ventas(ids, usuario):
+    """Elimina varias ventas devolviendo su stock, y devuelve los SKU anulados.
+
+    Todo ocurre en una transacción y con un número fijo de consultas: el
+    stock se repone con un UPDATE agrupado por producto, los movimientos se
+    insertan en bloque (uno por venta y producto) y los resúmenes se
+    descuentan de una vez. Los ids que no existen se ignoran.
+    """
+    with transaction.atomic():
+        # Bloquear las ventas evita que dos anulaciones simultáneas repongan dos veces
+        ventas = {
+            pk: (sku, fecha, cliente_id)
+            for pk, sku, fecha, cliente_id in Venta.objects.select_for_update()
+            .filter(pk__in=ids)
+            .order_by('pk')
+            .values_list('pk', 'sku', 'fecha', 'cliente_id')
+        }
+        if not ventas:
+            return []
+
+        lineas = defaultdict(list)
+        for venta_id, producto_id, cantidad, subtotal in ItemVenta.objects.filter(venta_id__in=ventas).values_list(
+            'venta_id', 'producto_id', 'cantidad', 'subtotal'
+        ):
+            lineas[venta_id].append((producto_id, cantidad, subtotal))
+
+        cambios = defaultdict(int)
+        movimientos = []
+        for venta_id, lineas_venta in lineas.items():
+            por_producto = defaultdict(int)
+            for producto_id, cantidad, _ in lineas_venta:
+                por_producto[producto_id] += cantidad
+            for producto_id, cantidad in por_producto.items():
+                cambios[producto_id] += cantidad
+                movimientos.append(MovimientoStock(
+                    producto_id=producto_id,
+                    tipo='entrada',
+                    cantidad=cantidad,
+                    motivo=f'Cancelación de venta {ventas[venta_id][0]}',
+                    usuario=usuario,
+                ))
+        mover_stock(cambios)
+        MovimientoStock.objects.bulk_create(movimientos)
+
+        aplicar_ventas(
+            [(fecha, cliente_id, lineas[pk]) for pk, (_, fecha, cliente_id) in ventas.items()],
+            signo=-1,
+        )
+        if _borrado_directo_seguro():
+            # Dos DELETE directos: el borrado normal carga cada objeto para emitir
+            # post_delete y parte la consulta en lotes. Esas señales sólo limpian
+            # la cache de PDFs, así que se limpia acá.
+            ItemVenta.objects.filter(venta_id__in=ventas)._raw_delete(ItemVenta.objects.db)
+            Venta.objects.filter(pk__in=ventas)._raw_delete(Venta.objects.db)
+            for pk in ventas:
+                cache_pdf.invalidar(pk)
+        else:
+            # Otro modelo apunta a Venta o a ItemVenta: el borrado normal aplica su on_delete
+            Venta.objects.filter(pk__in=ventas).delete()
+    return [sku for sku, _, _ in ventas.values()]
+
+
+def _borrado_directo_seguro():
+    """Los DELETE directos de anular_ventas sólo valen si ItemVenta.venta es la única FK hacia las ventas.
+
+    Saltean el colector de borrado: una FK nueva hacia Venta o ItemVenta
+    quedaría huérfana o haría fallar el DELETE en lugar de aplicar su on_delete.
+    """
+    return (
+        [relacion.remote_field for relacion in Venta._meta.related_objects] == [ItemVenta._meta.get_field('venta')]
+        and not ItemVenta._meta.related_objects
+    )
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Venta, ItemVenta
+from .pdf import cache_pdf
+
+
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+def invalidar_pdf_venta(sender, instance, **kwargs):
+    cache_pdf.invalidar(instance.pk)
+
+
+@receiver(post_save, sender=ItemVenta)
+@receiver(post_delete, sender=ItemVenta)
+def invalidar_pdf_item(sender, instance, **kwargs):
+    cache_pdf.invalidar(instance.venta_id)
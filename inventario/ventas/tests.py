@@ -1,3 +1,894 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from pypdf import PdfReader, PdfWriter
+
+from clientes.models import Cliente
+from productos.cache import cache_productos
+from productos.models import Producto, MovimientoStock
+from productos.services import StockInsuficiente
+from .models import ClaveIdempotencia, Venta, ItemVenta, ResumenVentaDiaria
+from .forms import ItemVentaFormSet
+from .ingesta import ingresar_ventas
+from .paginacion import codificar_cursor, pagina_por_cursor
+from .exportacion import pool_exportacion
+from .pdf import CachePdf, cache_pdf, clave_venta
+from .render import PoolRenderizado, RenderizadoOcupado
+from .resumen import reconstruir
+from . import analitica
+from .services import registrar_venta, actualizar_venta, anular_ventas, ventas_con_detalle, _borrado_directo_seguro
+from .views import DIAS_GRAFICO
+
+
+class RegistroVentaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=50)
+            for n in range(20)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _post(self, cantidades):
+        datos = {
+            'cliente': self.cliente.pk,
+            'items-TOTAL_FORMS': len(cantidades), 'items-INITIAL_FORMS': 0,
+            'items-MIN_NUM_FORMS': 1, 'items-MAX_NUM_FORMS': 1000,
+        }
+        for i, cantidad in enumerate(cantidades):
+            datos.update({
+                f'items-{i}-producto': self.productos[i].pk,
+                f'items-{i}-cantidad': cantidad,
+                f'items-{i}-precio_unitario': '10.00',
+            })
+        return self.client.post(reverse('ventas:venta_create'), datos)
+
+    def _stock(self, cantidad):
+        return list(Producto.objects.filter(pk__in=[p.pk for p in self.productos[:cantidad]])
+                    .order_by('pk').values_list('stock', flat=True))
+
+    def test_consultas_fijas_sin_importar_las_lineas(self):
+        # La primera venta reserva un bloque de SKUs; las siguientes lo usan sin consultar
+        self._post([2])
+        for lineas in (1, 20):
+            # Sesión, usuario, cliente (2), productos de la canasta, reserva de stock
+            # (bloqueo y UPDATE), SKU libre, venta, items, movimientos, tres resúmenes
+            # y los savepoints de las dos transacciones
+            with self.subTest(lineas=lineas), self.assertNumQueries(17):
+                respuesta = self._post([2] * lineas)
+            self.assertRedirects(respuesta, reverse('ventas:venta_list'), fetch_redirect_response=False)
+
+        self.assertEqual(self._stock(20), [44] + [48] * 19)
+        venta = Venta.objects.latest('pk')
+        self.assertEqual(venta.total, 400)
+        movimientos = MovimientoStock.objects.filter(motivo=f'Venta {venta.sku}')
+        self.assertEqual(set(movimientos.values_list('tipo', 'cantidad')), {('salida', 2)})
+        self.assertEqual(movimientos.count(), 20)
+
+    def test_stock_insuficiente_al_reservar_no_escribe_nada(self):
+        # La validación del formset pasa pero otra venta se llevó el stock antes de reservar
+        with mock.patch('ventas.forms.BaseItemVentaFormSet.clean'):
+            respuesta = self._post([2, 51])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTemplateUsed(respuesta, 'ventas/venta_form.html')
+        self.assertIn('Stock insuficiente para Producto 1', [str(m) for m in respuesta.context['messages']])
+        self.assertEqual(self._stock(2), [50, 50])
+        self.assertFalse(Venta.objects.exists())
+        self.assertFalse(MovimientoStock.objects.exists())
+        self.assertFalse(ResumenVentaDiaria.objects.exists())
+
+
+class CachePdfTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.producto = Producto.objects.create(sku='PROD-P', nombre='P', descripcion='-', precio=10, stock=50)
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        # cache_pdf toma VENTAS_PDF_CACHE_DIR al importarse: se apunta al directorio temporal
+        parche = mock.patch.object(cache_pdf, 'directorio', self.directorio)
+        parche.start()
+        self.addCleanup(parche.stop)
+        self.venta = registrar_venta(
+            Venta(cliente=self.cliente), [ItemVenta(producto=self.producto, cantidad=1, precio_unitario=10)], 'test'
+        )
+
+    def _archivos(self):
+        return sorted(os.listdir(self.directorio))
+
+    def test_desaloja_primero_lo_menos_usado(self):
+        cache = CachePdf(self.directorio, max_bytes=30)
+        for venta_id, marca in ((1, 100), (2, 200), (3, 300)):
+            cache.guardar(venta_id, 'c', b'x' * 10)
+            os.utime(os.path.join(self.directorio, f'{venta_id}-c.pdf'), (marca, marca))
+        # Leer la 1 la vuelve la más reciente; la 2 pasa a ser la menos usada
+        self.assertEqual(cache.obtener(1, 'c'), b'x' * 10)
+        cache.guardar(4, 'c', b'x' * 10)
+        self.assertEqual(self._archivos(), ['1-c.pdf', '3-c.pdf', '4-c.pdf'])
+        self.assertIsNone(cache.obtener(2, 'c'))
+
+    def test_se_invalida_al_cambiar_la_venta_o_sus_items(self):
+        cache_pdf.guardar(self.venta.pk, 'a', b'%PDF')
+        self.venta.save()
+        self.assertEqual(self._archivos(), [])
+
+        cache_pdf.guardar(self.venta.pk, 'a', b'%PDF')
+        item = self.venta.items.get()
+        item.cantidad = 2
+        item.save()
+        self.assertEqual(self._archivos(), [])
+
+        cache_pdf.guardar(self.venta.pk, 'a', b'%PDF')
+        cache_pdf.guardar(self.venta.pk + 1, 'a', b'%PDF')
+        anular_ventas([self.venta.pk], 'test')
+        self.assertEqual(self._archivos(), [f'{self.venta.pk + 1}-a.pdf'])
+
+    @mock.patch('ventas.views.pool_pdf')
+    def test_etag_y_304_dejan_de_valer_cuando_cambia_la_venta(self, pool):
+        pool.renderizar.return_value = b'%PDF-1'
+        self.client.force_login(self.usuario)
+        url = reverse('ventas:venta_pdf', args=[self.venta.pk])
+        primera = self.client.get(url)
+        self.assertEqual(primera.content, b'%PDF-1')
+        etag = primera['ETag']
+
+        # Sin cambios: 304 sin renderizar, y el PDF se sirve desde la cache
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(url).content, b'%PDF-1')
+        self.assertEqual(pool.renderizar.call_count, 1)
+
+        # Editar la venta cambia la clave: el ETag viejo ya no responde 304 y se vuelve a renderizar
+        item = self.venta.items.get()
+        item.cantidad = 3
+        actualizar_venta(self.venta, [item], [], 'test')
+        pool.renderizar.return_value = b'%PDF-2'
+        respuesta = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((respuesta.status_code, respuesta.content), (200, b'%PDF-2'))
+        self.assertNotEqual(respuesta['ETag'], etag)
+        self.assertEqual(pool.renderizar.call_count, 2)
+        self.assertEqual(len(self._archivos()), 1)
+
+
+class PoolRenderizadoTests(SimpleTestCase):
+    def test_pool_saturado_responde_sin_esperar_el_timeout(self):
+        pool = PoolRenderizado(1, 1, timeout=30, espera=0.01)
+        pool.reservar()
+        try:
+            with self.assertRaises(RenderizadoOcupado):
+                pool.renderizar('<p>Venta</p>')
+        finally:
+            pool.liberar()
+        # Sin lugar libre no llega a crear los procesos
+        self.assertIsNone(pool._pool)
+
+
+class ExportarVentasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_filtros_invalidos_responden_400(self):
+        url = reverse('ventas:exportar_ventas')
+        self.assertEqual(self.client.get(url, {'desde': '2024-02-30'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cliente': 'abc'}).status_code, 400)
+
+    def test_una_exportacion_a_la_vez(self):
+        url = reverse('ventas:exportar_ventas')
+        pool_exportacion.reservar()
+        try:
+            self.assertEqual(self.client.get(url).status_code, 503)
+        finally:
+            pool_exportacion.liberar()
+
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        b''.join(respuesta.streaming_content)
+        respuesta.close()
+        # Terminada la respuesta el lugar queda libre
+        pool_exportacion.reservar()
+        pool_exportacion.liberar()
+
+    def test_exporta_varias_ventas_a_zip_y_a_pdf_unido(self):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        producto = Producto.objects.create(sku='PROD-E', nombre='E', descripcion='-', precio=10, stock=50)
+        ventas = [
+            registrar_venta(Venta(cliente=cliente), [ItemVenta(producto=producto, cantidad=n, precio_unitario=10)], 't')
+            for n in (1, 2)
+        ]
+
+        def pagina(ancho):
+            escritor = PdfWriter()
+            escritor.add_blank_page(ancho, 100)
+            salida = io.BytesIO()
+            escritor.write(salida)
+            return salida.getvalue()
+
+        htmls = []
+
+        def renderizar_lote(trabajos):
+            # Un PDF de una página por venta, con el ancho según su orden
+            for n, (nombre, html) in enumerate(trabajos, start=1):
+                htmls.append(html)
+                yield nombre, pagina(100 * n)
+
+        url = reverse('ventas:exportar_ventas')
+        with mock.patch.object(pool_exportacion, 'renderizar_lote', side_effect=renderizar_lote), \
+                mock.patch.object(pool_exportacion, 'cerrar') as cerrar:
+            respuesta = self.client.get(url, {'formato': 'zip'})
+            archivo = zipfile.ZipFile(io.BytesIO(b''.join(respuesta.streaming_content)))
+            respuesta.close()
+            self.assertEqual(archivo.namelist(), [f'venta_{v.sku}.pdf' for v in ventas])
+            self.assertEqual(archivo.read(f'venta_{ventas[1].sku}.pdf'), pagina(200))
+            self.assertEqual(respuesta['X-Total-Ventas'], '2')
+
+            respuesta = self.client.get(url, {'formato': 'pdf'})
+            unido = PdfReader(io.BytesIO(b''.join(respuesta.streaming_content)))
+            respuesta.close()
+            self.assertEqual([float(p.mediabox.width) for p in unido.pages], [100, 200])
+        self.assertEqual(len(htmls), 4)
+        for html, venta in zip(htmls, ventas * 2):
+            self.assertIn(f'Venta #{venta.pk}', html)
+        # Los procesos del pool de exportación no quedan vivos después de cada exportación
+        self.assertEqual(cerrar.call_count, 2)
+
+
+class VentasPorDiaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        producto = Producto.objects.create(sku='PROD-1', nombre='Yerba', descripcion='-', precio=10, stock=10)
+        registrar_venta(Venta(cliente=cliente), [ItemVenta(producto=producto, cantidad=3, precio_unitario=10)], 'test')
+
+    def test_lee_el_resumen_diario(self):
+        respuesta = self.client.get(reverse('ventas:ventas_por_dia'), {'desde': '2000-01-01'})
+        self.assertEqual(respuesta.json(), [
+            {'fecha': str(Venta.objects.get().fecha), 'total': '30.00', 'cantidad_ventas': 1, 'unidades': 3},
+        ])
+
+    def test_fecha_invalida_responde_400(self):
+        respuesta = self.client.get(reverse('ventas:ventas_por_dia'), {'desde': '2024-02-30'})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_las_paginas_piden_un_rango_acotado(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'clave'))
+        hoy = timezone.localdate()
+        url = (f"{reverse('ventas:ventas_por_dia')}?desde={hoy - timedelta(days=DIAS_GRAFICO - 1)}"
+               f"&hasta={hoy}")
+        for pagina in (reverse('ventas:venta_list'), reverse('ventas:venta_detail', args=[Venta.objects.get().pk])):
+            with self.subTest(pagina=pagina):
+                self.assertContains(self.client.get(pagina), f'fetch("{url}")')
+
+
+class AnaliticaVentasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.ana = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.luis = Cliente.objects.create(nombre='Luis', apellido='Sosa', numero_documento='30111333')
+        cls.yerba = Producto.objects.create(sku='PROD-1', nombre='Yerba', descripcion='-', precio=10, stock=100)
+        cls.mate = Producto.objects.create(sku='PROD-2', nombre='Mate', descripcion='-', precio=50, stock=100)
+        ventas = [
+            (cls.ana, date(2024, 3, 4), [(cls.yerba, 2), (cls.mate, 1)]),   # lunes
+            (cls.luis, date(2024, 3, 6), [(cls.yerba, 5)]),
+            (cls.ana, date(2024, 2, 27), [(cls.mate, 1)]),                  # semana y mes anteriores
+        ]
+        for cliente, fecha, lineas in ventas:
+            venta = registrar_venta(Venta(cliente=cliente), [
+                ItemVenta(producto=producto, cantidad=cantidad, precio_unitario=producto.precio)
+                for producto, cantidad in lineas
+            ], 'test')
+            Venta.objects.filter(pk=venta.pk).update(fecha=fecha)
+        reconstruir()
+
+    def test_top_productos(self):
+        filas = analitica.top_productos('mes', date(2024, 3, 1), date(2024, 3, 31))
+        self.assertEqual([(f['producto__sku'], f['total'], f['unidades'], f['cantidad_ventas']) for f in filas],
+                         [('PROD-1', 70, 7, 2), ('PROD-2', 50, 1, 1)])
+        self.assertEqual(len(analitica.top_productos('mes', limite=1)), 1)
+
+    def test_ventas_por_cliente_y_serie(self):
+        filas = analitica.ventas_por_cliente('semana', date(2024, 3, 4), date(2024, 3, 10))
+        self.assertEqual([(f['cliente__nombre'], f['total']) for f in filas], [('Ana', 70), ('Luis', 50)])
+        self.assertEqual(
+            [(f['periodo'], f['total']) for f in analitica.serie('semana')],
+            [(date(2024, 2, 26), 50), (date(2024, 3, 4), 120)],
+        )
+        self.assertEqual(
+            [(f['periodo'], f['unidades']) for f in analitica.serie('mes', producto=self.mate.pk)],
+            [(date(2024, 2, 1), 1), (date(2024, 3, 1), 1)],
+        )
+
+    def test_comparativa_con_el_periodo_anterior(self):
+        datos = analitica.comparativa('mes', date(2024, 3, 15))
+        self.assertEqual((datos['actual']['total'], datos['anterior']['total']), (120, 50))
+        self.assertEqual(datos['variacion_porcentual'], 140.0)
+        self.assertIsNone(analitica.comparativa('mes', date(2024, 2, 1))['variacion_porcentual'])
+
+    def test_parametros_invalidos(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('ventas:analitica_productos'), {'granularidad': 'mes', 'limite': -5})
+        self.assertEqual(len(respuesta.json()), 1)
+        for parametros in ({'producto': 'abc'}, {'cliente': 'abc'}, {'desde': '2024-02-30'}):
+            respuesta = self.client.get(reverse('ventas:analitica_serie'), parametros)
+            self.assertEqual(respuesta.status_code, 400)
+
+
+class PaginacionPorCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        Venta.objects.bulk_create([
+            Venta(sku=f'VENT-{n}', cliente=cls.cliente, total=10) for n in range(25)
+        ])
+
+    def _plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Con tablas tan chicas el planner prefiere un seq scan
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_recorre_todas_las_ventas_sin_repetir(self):
+        vistas = []
+        cursor = None
+        while True:
+            ventas, cursor = pagina_por_cursor(Venta.objects.all(), cursor, 10)
+            vistas.extend(v.pk for v in ventas)
+            if not cursor:
+                break
+        self.assertEqual(sorted(vistas), sorted(Venta.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(vistas), len(set(vistas)))
+
+    def test_pagina_profunda_usa_indice_fecha_id(self):
+        ultima = Venta.objects.order_by('fecha', 'id')[5]
+        queryset = Venta.objects.order_by('-fecha', '-id')
+        ventas, _ = pagina_por_cursor(queryset, codificar_cursor(ultima), 10)
+        self.assertTrue(ventas)
+
+        indice = Venta._meta.indexes[0].name
+        plan = self._plan(
+            queryset.filter(Q(fecha__lt=ultima.fecha) | Q(fecha=ultima.fecha, id__lt=ultima.pk))[:11]
+        )
+        self.assertIn(indice, plan)
+
+    def test_filtro_por_cliente_y_rango_usa_indice_compuesto(self):
+        indice = Venta._meta.indexes[1].name
+        queryset = Venta.objects.filter(
+            cliente=self.cliente, fecha__gte='2000-01-01', fecha__lte='2100-01-01'
+        ).order_by('-fecha', '-id')[:11]
+        self.assertIn(indice, self._plan(queryset))
+
+    def test_filtros_invalidos_se_ignoran(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'clave'))
+        respuesta = self.client.get(reverse('ventas:venta_list'), {
+            'desde': '2024-02-30', 'hasta': 'ayer', 'fecha': '2024-13-01', 'cliente': 'abc',
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.context['ventas']), 10)
+
+
+class DetalleVentaConsultasTests(TestCase):
+    """El costo de mostrar una venta no debe crecer con la cantidad de items."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=100)
+            for n in range(20)
+        ])
+        cls.chica = Venta.objects.create(cliente=cliente, total=10)
+        cls.grande = Venta.objects.create(cliente=cliente, total=200)
+        ItemVenta.objects.bulk_create(
+            [ItemVenta(venta=cls.chica, producto=productos[0], cantidad=1, precio_unitario=10, subtotal=10)]
+            + [ItemVenta(venta=cls.grande, producto=p, cantidad=1, precio_unitario=10, subtotal=10) for p in productos]
+        )
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _consultas(self, url, **extra):
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url, **extra)
+        self.assertIn(response.status_code, (200, 304))
+        return len(consultas)
+
+    def test_cargador_usa_dos_consultas(self):
+        with self.assertNumQueries(2):
+            venta = ventas_con_detalle().get(pk=self.grande.pk)
+            venta.cliente.nombre_completo
+            [item.producto.nombre for item in venta.items.all()]
+            [item.producto.sku for item in venta.items.all()]
+
+    def test_detalle_no_depende_de_la_cantidad_de_items(self):
+        chica = self._consultas(reverse('ventas:venta_detail', args=[self.chica.pk]))
+        grande = self._consultas(reverse('ventas:venta_detail', args=[self.grande.pk]))
+        self.assertEqual(chica, grande)
+
+    def test_pdf_no_depende_de_la_cantidad_de_items(self):
+        # Con el ETag vigente la vista responde 304 sin renderizar, pero carga la venta igual
+        def consultas_pdf(venta):
+            cargada = ventas_con_detalle().get(pk=venta.pk)
+            etag = f'"{clave_venta(cargada, cargada.items.all())}"'
+            return self._consultas(reverse('ventas:venta_pdf', args=[venta.pk]), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(consultas_pdf(self.chica), consultas_pdf(self.grande))
+
+
+class EdicionVentaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=50)
+            for n in range(30)
+        ])
+
+    def _venta(self, cantidades):
+        venta = Venta(cliente=self.cliente)
+        items = [
+            ItemVenta(producto=self.productos[n], cantidad=cantidad, precio_unitario=10)
+            for n, cantidad in cantidades.items()
+        ]
+        return registrar_venta(venta, items, 'test')
+
+    def _stock(self, n):
+        return Producto.objects.get(pk=self.productos[n].pk).stock
+
+    def test_mueve_solo_la_diferencia(self):
+        venta = self._venta({0: 5, 1: 3, 2: 2})
+        item0, item1, item2 = venta.items.order_by('id')
+        MovimientoStock.objects.all().delete()
+
+        item0.cantidad = 8                   # vende 3 más del producto 0
+        item1.producto = self.productos[3]   # devuelve 3 del 1 y vende 3 del 3
+        nuevo = ItemVenta(producto=self.productos[4], cantidad=1, precio_unitario=10)
+        actualizar_venta(venta, [item0, item1, nuevo], [item2], 'test')
+
+        self.assertEqual(
+            [self._stock(n) for n in range(5)],
+            [42, 50, 50, 47, 49],
+        )
+        self.assertEqual(venta.total, 120)
+        self.assertEqual(venta.items.count(), 3)
+        movimientos = dict(
+            MovimientoStock.objects.values_list('producto_id', 'tipo').order_by()
+        )
+        self.assertEqual(movimientos, {
+            self.productos[0].pk: 'salida',
+            self.productos[1].pk: 'entrada',
+            self.productos[2].pk: 'entrada',
+            self.productos[3].pk: 'salida',
+            self.productos[4].pk: 'salida',
+        })
+
+    def test_sin_stock_no_modifica_nada(self):
+        venta = self._venta({0: 5})
+        item = venta.items.get()
+        item.cantidad = 56
+        with self.assertRaises(StockInsuficiente):
+            actualizar_venta(venta, [item], [], 'test')
+        self.assertEqual(self._stock(0), 45)
+        self.assertEqual(venta.items.get().cantidad, 5)
+
+    def test_consultas_constantes(self):
+        def consultas(cantidad_items):
+            venta = self._venta({n: 1 for n in range(cantidad_items)})
+            items = list(venta.items.order_by('id'))
+            for item in items[1:]:
+                item.cantidad = 2
+            nuevo = ItemVenta(producto=self.productos[29], cantidad=1, precio_unitario=10)
+            with CaptureQueriesContext(connection) as capturadas:
+                actualizar_venta(venta, items[1:] + [nuevo], items[:1], 'test')
+            return len(capturadas)
+
+        self.assertEqual(consultas(3), consultas(25))
+
+    def test_editar_una_venta_anulada_no_la_vuelve_a_crear(self):
+        venta = self._venta({0: 5})
+        item = venta.items.get()
+        anular_ventas([venta.pk], 'test')
+        item.cantidad = 7
+        with self.assertRaises(Venta.DoesNotExist):
+            actualizar_venta(venta, [item], [], 'test')
+        self.assertFalse(Venta.objects.exists())
+        self.assertEqual(self._stock(0), 50)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class EdicionVentaConcurrenteTests(TransactionTestCase):
+
+    def test_dos_ediciones_simultaneas_no_mueven_el_stock_dos_veces(self):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        producto = Producto.objects.create(sku='PROD-C', nombre='C', descripcion='-', precio=10, stock=50)
+        venta = registrar_venta(
+            Venta(cliente=cliente), [ItemVenta(producto=producto, cantidad=5, precio_unitario=10)], 'test'
+        )
+        # Las dos ediciones parten de la misma versión de la venta
+        primera, segunda = venta.items.get(), venta.items.get()
+        primera.cantidad, segunda.cantidad = 8, 6
+        editada, seguir = threading.Event(), threading.Event()
+
+        def editar(item, antes_de_confirmar=None):
+            try:
+                with transaction.atomic():
+                    actualizar_venta(Venta.objects.get(pk=venta.pk), [item], [], 'test')
+                    if antes_de_confirmar:
+                        antes_de_confirmar()
+            finally:
+                connections.close_all()
+
+        def esperar():
+            editada.set()
+            seguir.wait(5)
+
+        hilos = [threading.Thread(target=editar, args=(primera, esperar)), threading.Thread(target=editar, args=(segunda,))]
+        hilos[0].start()
+        editada.wait(5)
+        hilos[1].start()
+        # La segunda edición espera el bloqueo de la venta
+        hilos[1].join(0.5)
+        self.assertTrue(hilos[1].is_alive())
+        seguir.set()
+        for hilo in hilos:
+            hilo.join(5)
+
+        self.assertEqual(Producto.objects.get(pk=producto.pk).stock, 44)
+        self.assertEqual(venta.items.get().cantidad, 6)
+
+
+class AnulacionVentasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=100)
+            for n in range(10)
+        ])
+
+    def _ventas(self, cantidad):
+        return [
+            registrar_venta(Venta(cliente=self.cliente), [
+                ItemVenta(producto=producto, cantidad=2, precio_unitario=10) for producto in self.productos
+            ], 'test')
+            for _ in range(cantidad)
+        ]
+
+    def test_devuelve_stock_y_registra_movimientos(self):
+        ventas = self._ventas(3)
+        MovimientoStock.objects.all().delete()
+
+        anuladas = anular_ventas([venta.pk for venta in ventas[:2]] + [0], 'test')
+
+        self.assertEqual(sorted(anuladas), sorted(venta.sku for venta in ventas[:2]))
+        self.assertEqual(set(Producto.objects.values_list('stock', flat=True)), {98})
+        self.assertEqual(list(Venta.objects.values_list('pk', flat=True)), [ventas[2].pk])
+        self.assertFalse(ItemVenta.objects.filter(venta_id__in=[v.pk for v in ventas[:2]]).exists())
+        self.assertEqual(MovimientoStock.objects.filter(tipo='entrada', cantidad=2).count(), 20)
+        resumen = ResumenVentaDiaria.objects.get()
+        self.assertEqual((resumen.cantidad_ventas, resumen.unidades, resumen.total), (1, 20, 200))
+
+    def test_consultas_constantes(self):
+        def consultas(cantidad):
+            ids = [venta.pk for venta in self._ventas(cantidad)]
+            with CaptureQueriesContext(connection) as capturadas:
+                anular_ventas(ids, 'test')
+            return len(capturadas)
+
+        self.assertEqual(consultas(1), consultas(15))
+
+    def test_con_otra_fk_hacia_las_ventas_usa_el_borrado_normal(self):
+        self.assertTrue(_borrado_directo_seguro())
+        ventas = self._ventas(2)
+        with mock.patch('ventas.services._borrado_directo_seguro', return_value=False):
+            anular_ventas([venta.pk for venta in ventas], 'test')
+        self.assertFalse(Venta.objects.exists())
+        self.assertFalse(ItemVenta.objects.exists())
+
+    def test_la_api_exige_una_lista_de_ids_enteros(self):
+        venta = self._ventas(1)[0]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'clave'))
+        for ventas in (str(venta.pk), [str(venta.pk)], [True], [1.5], {'id': venta.pk}):
+            with self.subTest(ventas=ventas):
+                respuesta = self.client.post(reverse('ventas:anular_ventas'), {'ventas': ventas},
+                                             content_type='application/json')
+                self.assertEqual(respuesta.status_code, 400)
+        self.assertTrue(Venta.objects.filter(pk=venta.pk).exists())
+        respuesta = self.client.post(reverse('ventas:anular_ventas'), {'ventas': [venta.pk]},
+                                     content_type='application/json')
+        self.assertEqual(respuesta.json(), {'anuladas': [venta.sku]})
+
+
+class IngresoVentasApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('pos', 'pos@example.com', 'clave')
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=20)
+            for n in range(3)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _post(self, datos):
+        return self.client.post(reverse('ventas:api_ventas'), json.dumps(datos), content_type='application/json')
+
+    def _venta(self, clave, cantidad=2, **producto):
+        producto = producto or {'producto': self.productos[0].pk}
+        return {'clave': clave, 'cliente': self.cliente.pk, 'items': [dict(producto, cantidad=cantidad)]}
+
+    def test_reintento_no_duplica_la_venta(self):
+        primera = self._post(self._venta('pos1-0001'))
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(primera.json()['total'], '20.00')
+
+        reintento = self._post(self._venta('pos1-0001'))
+        self.assertEqual(reintento.status_code, 200)
+        self.assertEqual(reintento.json()['estado'], 'duplicada')
+        self.assertEqual(reintento.json()['sku'], primera.json()['sku'])
+        self.assertEqual(Venta.objects.count(), 1)
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).stock, 18)
+        self.assertEqual(MovimientoStock.objects.filter(tipo='salida').count(), 1)
+
+    def test_lote_con_errores_parciales(self):
+        respuesta = self._post({'ventas': [
+            self._venta('a', sku='PROD-1'),
+            self._venta('b', sku='NO-EXISTE'),
+            self._venta('c', cantidad=99),
+            self._venta('a', sku='PROD-1'),
+            {'cliente': self.cliente.pk, 'items': []},
+        ]})
+        estados = [r['estado'] for r in respuesta.json()['resultados']]
+        self.assertEqual(estados, ['creada', 'error', 'error', 'duplicada', 'error'])
+        self.assertEqual(Venta.objects.count(), 1)
+        self.assertEqual(Producto.objects.get(pk=self.productos[1].pk).stock, 18)
+        self.assertEqual(Producto.objects.get(pk=self.productos[0].pk).stock, 20)
+
+    def test_precios_y_cantidades_fuera_de_rango_son_errores_de_la_venta(self):
+        def con_precio(clave, precio, cantidad=1):
+            venta = self._venta(clave, cantidad=cantidad)
+            venta['items'][0]['precio_unitario'] = precio
+            return venta
+
+        respuesta = self._post({'ventas': [
+            con_precio('nan', float('nan')),
+            con_precio('inf', float('inf')),
+            con_precio('enorme', 1e20),
+            con_precio('decimales', 12.345),
+            con_precio('total', 99999999, cantidad=2),
+            self._venta('cantidad', cantidad=2**31),
+            self._venta('ok'),
+        ]})
+        self.assertEqual(respuesta.status_code, 200)
+        estados = [r['estado'] for r in respuesta.json()['resultados']]
+        self.assertEqual(estados, ['error'] * 6 + ['creada'])
+        self.assertEqual(Venta.objects.count(), 1)
+
+    def test_reintento_de_lote_cuesta_lo_mismo_sin_importar_el_tamano(self):
+        def consultas(cantidad, prefijo):
+            lote = {'ventas': [self._venta(f'{prefijo}-{n}', cantidad=1) for n in range(cantidad)]}
+            self._post(lote)
+            with CaptureQueriesContext(connection) as capturadas:
+                respuesta = self._post(lote)
+            self.assertEqual({r['estado'] for r in respuesta.json()['resultados']}, {'duplicada'})
+            return len(capturadas)
+
+        self.assertEqual(consultas(1, 'x'), consultas(15, 'y'))
+
+    def test_rechaza_otro_content_type(self):
+        respuesta = self.client.post(reverse('ventas:api_ventas'), {'clave': 'a'})
+        self.assertEqual(respuesta.status_code, 415)
+
+
+class IngresoVentasTransaccionesTests(TransactionTestCase):
+
+    def test_cada_venta_se_confirma_por_separado(self):
+        cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        producto = Producto.objects.create(sku='PROD-T', nombre='T', descripcion='-', precio=10, stock=20)
+        lote = [
+            {'clave': clave, 'cliente': cliente.pk, 'items': [{'producto': producto.pk, 'cantidad': 1}]}
+            for clave in ('t-1', 't-2')
+        ]
+        llamadas = []
+
+        def falla_la_segunda(*args):
+            llamadas.append(args)
+            if len(llamadas) == 2:
+                raise RuntimeError('caída del worker')
+            return registrar_venta(*args)
+
+        with mock.patch('ventas.ingesta.registrar_venta', side_effect=falla_la_segunda):
+            with self.assertRaises(RuntimeError):
+                ingresar_ventas(lote, 'pos')
+        # La primera venta ya quedó guardada con su clave: un reintento la devuelve como duplicada
+        self.assertEqual(list(ClaveIdempotencia.objects.values_list('clave', flat=True)), ['t-1'])
+        self.assertEqual(Producto.objects.get(pk=producto.pk).stock, 19)
+        self.assertEqual([r['estado'] for r in ingresar_ventas(lote, 'pos')], ['duplicada', 'creada'])
+
+
+class ProductosDatosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=n)
+            for n in range(30)
+        ])
+
+    def setUp(self):
+        cache_productos.limpiar()
+
+    def test_un_pedido_para_todas_las_lineas(self):
+        self.client.force_login(self.usuario)
+        ids = ','.join(str(p.pk) for p in self.productos[:29])
+        respuesta = self.client.get(reverse('ventas:productos_datos'), {'ids': ids, 'skus': 'PROD-29,NO-EXISTE'})
+        datos = respuesta.json()['productos']
+        self.assertEqual(len(datos), 30)
+        self.assertEqual(datos[str(self.productos[29].pk)], {'sku': 'PROD-29', 'nombre': 'Producto 29', 'precio': 10.0, 'stock': 29})
+
+        # La segunda vez sale de la cache: sólo quedan las consultas de sesión y usuario
+        with CaptureQueriesContext(connection) as capturadas:
+            self.client.get(reverse('ventas:productos_datos'), {'ids': ids})
+        self.assertFalse([q for q in capturadas if 'productos_producto' in q['sql']])
+
+    def test_requiere_permiso(self):
+        respuesta = self.client.get(reverse('ventas:productos_datos'), {'ids': '1'})
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class ItemVentaFormSetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre='Ana', apellido='Paz', numero_documento='30111222')
+        cls.productos = Producto.objects.bulk_create([
+            Producto(sku=f'PROD-{n}', nombre=f'Producto {n}', descripcion='-', precio=10, stock=5)
+            for n in range(25)
+        ])
+
+    def _datos(self, lineas, items=()):
+        datos = {
+            'items-TOTAL_FORMS': len(lineas), 'items-INITIAL_FORMS': len(items),
+            'items-MIN_NUM_FORMS': 1, 'items-MAX_NUM_FORMS': 1000,
+        }
+        for i, (producto, cantidad) in enumerate(lineas):
+            datos.update({
+                f'items-{i}-producto': producto.pk, f'items-{i}-cantidad': cantidad, f'items-{i}-precio_unitario': 10,
+            })
+            if i < len(items):
+                datos[f'items-{i}-id'] = items[i].pk
+        return datos
+
+    def test_consultas_constantes(self):
+        def consultas(cantidad):
+            datos = self._datos([(producto, 1) for producto in self.productos[:cantidad]])
+            with CaptureQueriesContext(connection) as capturadas:
+                self.assertTrue(ItemVentaFormSet(datos).is_valid())
+            return len(capturadas)
+
+        self.assertEqual(consultas(2), consultas(25))
+
+    def test_consultas_constantes_al_editar(self):
+        def consultas(cantidad):
+            venta = registrar_venta(Venta(cliente=self.cliente), [
+                ItemVenta(producto=producto, cantidad=1, precio_unitario=10) for producto in self.productos[:cantidad]
+            ], 'test')
+            datos = self._datos([(producto, 2) for producto in self.productos[:cantidad]], list(venta.items.order_by('id')))
+            with CaptureQueriesContext(connection) as capturadas:
+                self.assertTrue(ItemVentaFormSet(datos, instance=venta).is_valid())
+            return len(capturadas)
+
+        self.assertEqual(consultas(2), consultas(10))
+
+    def test_stock_se_valida_contra_la_suma_de_la_canasta(self):
+        producto = self.productos[0]
+        formset = ItemVentaFormSet(self._datos([(producto, 3), (producto, 3)]))
+        self.assertFalse(formset.is_valid())
+        self.assertIn('Stock insuficiente para Producto 0', formset.non_form_errors()[0])
+
+    def test_un_producto_sin_stock_no_es_una_opcion_valida(self):
+        producto = self.productos[3]
+        Producto.objects.filter(pk=producto.pk).update(stock=0)
+        formset = ItemVentaFormSet(self._datos([(producto, 1)]))
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.forms[0].errors.as_data()['producto'][0].code, 'invalid_choice')
+        self.assertEqual(formset.non_form_errors(), [])
+
+    def test_al_editar_cuenta_lo_que_la_venta_ya_tiene(self):
+        producto = self.productos[1]
+        venta = registrar_venta(Venta(cliente=self.cliente), [
+            ItemVenta(producto=producto, cantidad=4, precio_unitario=10)
+        ], 'test')
+        # Quedan 1 en stock + 4 de esta venta
+        item = venta.items.get()
+        self.assertTrue(ItemVentaFormSet(self._datos([(producto, 5)], [item]), instance=venta).is_valid())
+        self.assertFalse(ItemVentaFormSet(self._datos([(producto, 6)], [item]), instance=venta).is_valid())
+
+    def test_los_items_comparten_las_instancias_del_formset(self):
+        formset = ItemVentaFormSet(self._datos([(self.productos[2], 1), (self.productos[2], 1)]))
+        self.assertTrue(formset.is_valid())
+        items = formset.save(commit=False)
+        self.assertIs(items[0].producto, items[1].producto)
+        self.assertIs(items[0].producto, formset.productos[self.productos[2].pk])
+
+
+class ProductoAutocompletarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'clave')
+        Producto.objects.bulk_create([
+            Producto(sku=f'YER-{n:03}', nombre=f'Yerba {n}', descripcion='-', precio=10, stock=5) for n in range(15)
+        ] + [
+            Producto(sku='MATE-1', nombre='Mate de calabaza', descripcion='-', precio=10, stock=5),
+            Producto(sku='BOMB-1', nombre='Bombilla para yerba', descripcion='-', precio=10, stock=5),
+            Producto(sku='YER-SIN', nombre='Yerba sin stock', descripcion='-', precio=10, stock=0),
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def _buscar(self, **parametros):
+        return self.client.get(reverse('ventas:producto_autocompletar'), parametros).json()
+
+    def test_pagina_chica_y_prefijo_primero(self):
+        datos = self._buscar(q='yer')
+        self.assertEqual(len(datos['resultados']), 10)
+        self.assertTrue(datos['mas'])
+        skus = [r['sku'] for r in self._buscar(q='yer', pagina=2)['resultados']]
+        self.assertEqual(skus[-1], 'BOMB-1')
+        self.assertNotIn('YER-SIN', skus)
+
+    def test_busca_por_sku_y_nombre(self):
+        self.assertEqual([r['sku'] for r in self._buscar(q='mate-')['resultados']], ['MATE-1'])
+        self.assertEqual([r['sku'] for r in self._buscar(q='calabaza')['resultados']], ['MATE-1'])
+        self.assertEqual(self._buscar(q='m')['resultados'], [])
+
+    def test_el_formulario_no_depende_del_catalogo(self):
+        def pagina():
+            with CaptureQueriesContext(connection) as capturadas:
+                respuesta = self.client.get(reverse('ventas:venta_create'))
+            return len(capturadas), len(respuesta.content)
+
+        consultas, tamano = pagina()
+        Producto.objects.bulk_create([
+            Producto(sku=f'EXTRA-{n}', nombre=f'Extra {n}', descripcion='-', precio=10, stock=5) for n in range(300)
+        ])
+        self.assertEqual(pagina(), (consultas, tamano))
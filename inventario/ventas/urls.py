@@ -9,7 +9,16 @@ urlpatterns = [
     path('<int:pk>/', views.VentaDetailView.as_view(), name='venta_detail'),
     path('<int:pk>/editar/', views.VentaUpdateView.as_view(), name='venta_update'),
     path('<int:pk>/eliminar/', views.VentaDeleteView.as_view(), name='venta_delete'),
+    path('anular/', views.AnularVentasView.as_view(), name='anular_ventas'),
+    path('api/ventas/', views.IngresoVentasApiView.as_view(), name='api_ventas'),
     path('producto/<int:producto_id>/precio/', views.ProductoPrecioView.as_view(), name='producto_precio'),
+    path('productos/datos/', views.productos_datos, name='productos_datos'),
+    path('productos/buscar/', views.ProductoAutocompletarView.as_view(), name='producto_autocompletar'),
     path('<int:pk>/pdf/', views.venta_pdf, name='venta_pdf'),
     path('grafico/ventas-dia/', views.ventas_por_dia, name='ventas_por_dia'),
+    path('exportar/', views.ExportarVentasView.as_view(), name='exportar_ventas'),
+    path('analitica/productos/', views.AnaliticaVentasView.as_view(consulta='productos'), name='analitica_productos'),
+    path('analitica/clientes/', views.AnaliticaVentasView.as_view(consulta='clientes'), name='analitica_clientes'),
+    path('analitica/serie/', views.AnaliticaVentasView.as_view(consulta='serie'), name='analitica_serie'),
+    path('analitica/comparativa/', views.AnaliticaVentasView.as_view(consulta='comparativa'), name='analitica_comparativa'),
 ]
\ No newline at end of file
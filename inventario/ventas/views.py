@@ -6,50 +6,106 @@ from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect
 from django.db import transaction
 from django.http import JsonResponse
-from .models import Venta, ItemVenta
+from .models import Venta, ItemVenta, ResumenVentaDiaria
+from .resumen import GRANULARIDADES
+from . import analitica
+from .paginacion import pagina_por_cursor
 from .forms import VentaForm, ItemVentaFormSet
+from .services import registrar_venta, actualizar_venta, anular_ventas, ventas_con_detalle
 from productos.models import Producto, MovimientoStock
+from productos.services import StockInsuficiente
+from productos.cache import cache_productos
+from django.core.exceptions import PermissionDenied
+from django.db.models import Case, Q, When
 from clientes.models import Cliente
 from django.http import HttpResponse
 from django.template.loader import render_to_string
-from weasyprint import HTML 
-import tempfile
-from django.db.models import Sum
+from django.utils.cache import get_conditional_response
+from .pdf import cache_pdf, pool_pdf, clave_venta, PLANTILLA_PDF
+from .render import RenderizadoOcupado, RenderizadoVencido
 from django.http import JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
+from django.http import StreamingHttpResponse, HttpResponseBadRequest
+from django.utils.dateparse import parse_date
+from django.utils import timezone
+from .exportacion import FORMATOS, ventas_a_exportar, exportar, pool_exportacion
+from .ingesta import MAX_LOTE, ingresar_ventas
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+import json
+import logging
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
 
 
 
 def venta_pdf(request, pk):
-    venta = get_object_or_404(Venta, pk=pk)
+    venta = get_object_or_404(ventas_con_detalle(), pk=pk)
     items = venta.items.all() # type: ignore
 
-    html_string = render_to_string('ventas/venta_pdf.html', {
-        'venta': venta,
-        'items': items,
-        })
+    clave = clave_venta(venta, items)
+    etag = f'"{clave}"'
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        return no_modificado
+
+    pdf = cache_pdf.obtener(venta.pk, clave)
+    if pdf is None:
+        html_string = render_to_string(PLANTILLA_PDF, {
+            'venta': venta,
+            'items': items,
+            })
+        # El render corre en el pool de WeasyPrint, fuera del proceso web
+        try:
+            pdf = pool_pdf.renderizar(html_string)
+        except RenderizadoOcupado:
+            response = HttpResponse('Hay demasiados PDFs generándose, intente de nuevo.', status=503)
+            response['Retry-After'] = '5'
+            return response
+        except RenderizadoVencido:
+            return HttpResponse('La generación del PDF tardó demasiado.', status=504)
+        cache_pdf.guardar(venta.pk, clave, pdf)
 
-    response = HttpResponse(content_type='application/pdf')
+    response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = f'inline; filename=venta_{venta.sku}.pdf'
+    response['ETag'] = etag
+    return response
 
-    with tempfile.NamedTemporaryFile(delete=True) as output:
-        HTML(string=html_string).write_pdf(output.name)
-        output.seek(0)
-        response.write(output.read())
+# Días que muestra el gráfico de ventas por día de las páginas de ventas
+DIAS_GRAFICO = 30
+
+
+def _rango_grafico():
+    """(desde, hasta) que las plantillas pasan a ventas_por_dia: los últimos DIAS_GRAFICO días."""
+    hasta = timezone.localdate()
+    return hasta - timedelta(days=DIAS_GRAFICO - 1), hasta
 
-    return response
 
 def ventas_por_dia(request):
-    data = (
-        Venta.objects
-        .values('fecha')
-        .annotate(total=Sum('total'))
-        .order_by('fecha')
-        )
+    # Se lee del resumen diario: el costo depende de los días pedidos, no del historial
+    data = ResumenVentaDiaria.objects.all()
+    try:
+        desde = parse_date(request.GET.get('desde', ''))
+        hasta = parse_date(request.GET.get('hasta', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Fecha inválida.'}, status=400)
+    if desde:
+        data = data.filter(fecha__gte=desde)
+    if hasta:
+        data = data.filter(fecha__lte=hasta)
 
+    data = data.order_by('fecha').values('fecha', 'total', 'cantidad_ventas', 'unidades')
     return JsonResponse(list(data), safe=False)
     
     
+def _fecha_o_nada(valor):
+    try:
+        return parse_date(valor or '')
+    except ValueError:
+        return None
+
+
 class VentaListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     model = Venta
     template_name = 'ventas/venta_list.html'
@@ -61,20 +117,39 @@ class VentaListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     def get_queryset(self):
         queryset = super().get_queryset()
         cliente_id = self.request.GET.get('cliente')
-        fecha = self.request.GET.get('fecha')
+        # Un filtro que no es una fecha o un id válido se ignora
+        fecha = _fecha_o_nada(self.request.GET.get('fecha'))
+        desde = _fecha_o_nada(self.request.GET.get('desde'))
+        hasta = _fecha_o_nada(self.request.GET.get('hasta'))
         
-        if cliente_id:
+        if cliente_id and cliente_id.isdigit():
             queryset = queryset.filter(cliente_id=cliente_id)
         if fecha:
             queryset = queryset.filter(fecha=fecha)
+        if desde:
+            queryset = queryset.filter(fecha__gte=desde)
+        if hasta:
+            queryset = queryset.filter(fecha__lte=hasta)
             
-        return queryset.select_related('cliente')
+        return queryset.select_related('cliente').order_by('-fecha', '-id')
+
+    def paginate_queryset(self, queryset, page_size):
+        # ?page= mantiene la paginación clásica; por defecto se pagina por cursor
+        if self.request.GET.get('page'):
+            return super().paginate_queryset(queryset, page_size)
+        ventas, self.siguiente_cursor = pagina_por_cursor(queryset, self.request.GET.get('cursor'), page_size)
+        return None, None, ventas, False
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['clientes'] = Cliente.objects.all()
         context['cliente_filtro'] = self.request.GET.get('cliente', '')
         context['fecha_filtro'] = self.request.GET.get('fecha', '')
+        context['desde_filtro'] = self.request.GET.get('desde', '')
+        context['hasta_filtro'] = self.request.GET.get('hasta', '')
+        context['cursor_actual'] = self.request.GET.get('cursor', '')
+        context['siguiente_cursor'] = getattr(self, 'siguiente_cursor', None)
+        context['grafico_desde'], context['grafico_hasta'] = _rango_grafico()
         return context
 
 class VentaDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
@@ -85,6 +160,15 @@ class VentaDetailView(LoginRequiredMixin, PermissionRequiredMixin, DetailView):
     #Restriccion de permisos para grupo ventas
     permission_required = 'ventas.view_venta'
 
+    def get_queryset(self):
+        return ventas_con_detalle()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['items'] = self.object.items.all() # type: ignore
+        context['grafico_desde'], context['grafico_hasta'] = _rango_grafico()
+        return context
+
 class VentaCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     model = Venta
     form_class = VentaForm
@@ -108,67 +192,25 @@ class VentaCreateView(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
          # Si el código está vacío, se generará automáticamente en el save() del modelo
         
         form.instance.sku = None  # Esto activará la generación automática
-        with transaction.atomic():
         # NO guardar la venta todavía - usar commit=False
-            self.object = form.save(commit=False)
-        
-            if formset.is_valid():
+        self.object = form.save(commit=False)
+
+        if formset.is_valid():
             # Procesar formset pero sin guardar aún
-                items = formset.save(commit=False)
-            
-            # Validar stock antes de hacer cualquier guardado
-                for item in items:
-                    producto = item.producto
-                    if item.cantidad <= producto.stock:
-                        continue  # Stock suficiente
-                    else:
-                        messages.error(self.request, f'Stock insuficiente para {producto.nombre}')
-                        return self.form_invalid(form)
-            
-            # **PRIMERO calcular el total**
-                total_venta = 0
-                for item in items:
-                    item.subtotal = item.cantidad * item.precio_unitario
-                    total_venta += item.subtotal
-
-            # **ASIGNAR el total a la venta**
-                self.object.total = total_venta
-            
-            # **AHORA SÍ guardar la venta con el total**
-                self.object.save()
-            
-            # Establecer la instancia para el formset y guardar items
-                formset.instance = self.object
-                for item in items:
-                    item.venta = self.object  # Asegurar la relación
-                    item.save()
-                
-                # Descontar stock del producto
-                    producto = item.producto
-                    producto.stock -= item.cantidad
-                    producto.save()
-                
-                # Registrar movimiento de stock
-                    from productos.models import MovimientoStock
-                    MovimientoStock.objects.create(
-                        producto=producto,
-                        tipo='salida',
-                        cantidad=item.cantidad,
-                        motivo=f'Venta {self.object.sku}',
-                        usuario=self.request.user.username if self.request.user.is_authenticated else 'Sistema'
-                   )
-            
-            # Eliminar items marcados para borrar
-                for obj in formset.deleted_objects:
-                    obj.delete()
-            
-            # **YA NO necesitas llamar a actualizar_total() aquí**
-            # because ya calculaste el total arriba
-            
-                messages.success(self.request, f'Venta {self.object.sku} registrada exitosamente. Total: ${self.object.total}')
-                return super().form_valid(form)
-            else:
+            items = formset.save(commit=False)
+            usuario = self.request.user.username if self.request.user.is_authenticated else 'Sistema'
+
+            # Venta, items, stock y movimientos se escriben en bloque
+            try:
+                registrar_venta(self.object, items, usuario)
+            except StockInsuficiente as e:
+                messages.error(self.request, str(e))
                 return self.form_invalid(form)
+
+            messages.success(self.request, f'Venta {self.object.sku} registrada exitosamente. Total: ${self.object.total}')
+            return redirect(self.get_success_url())
+        else:
+            return self.form_invalid(form)
     
     def form_invalid(self, form):
         messages.error(self.request, 'Por favor corrija los errores en el formulario.')
@@ -188,6 +230,74 @@ class ProductoPrecioView(LoginRequiredMixin, PermissionRequiredMixin, View):
             })
     
 
+MAX_PRODUCTOS_POR_CONSULTA = 200
+
+
+async def productos_datos(request):
+    """Precio, stock y nombre de varios productos en una sola respuesta (?ids=1,2&skus=A,B).
+
+    Async y servida desde la cache del proceso, así que armar una venta de
+    muchas líneas cuesta uno o dos pedidos en lugar de uno por línea.
+    """
+    #Restriccion de permisos para grupo ventas
+    usuario = await request.auser()
+    if not await usuario.ahas_perm('productos.view_producto'):
+        raise PermissionDenied
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        return JsonResponse({'error': 'Ids inválidos.'}, status=400)
+    skus = [sku for sku in request.GET.get('skus', '').split(',') if sku]
+    if len(ids) + len(skus) > MAX_PRODUCTOS_POR_CONSULTA:
+        return JsonResponse({'error': f'Como máximo {MAX_PRODUCTOS_POR_CONSULTA} productos por consulta.'}, status=400)
+
+    filas = await cache_productos.aobtener(ids, skus)
+    return JsonResponse({'productos': {
+        pk: {'sku': fila['sku'], 'nombre': fila['nombre'], 'precio': float(fila['precio']), 'stock': fila['stock']}
+        for pk, fila in filas.items()
+    }})
+
+
+class ProductoAutocompletarView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Busca productos con stock por prefijo de SKU o parte del nombre, de a pocos resultados (JSON).
+
+    En PostgreSQL las búsquedas usan los índices trigram de productos (migración 0003).
+    """
+    #Restriccion de permisos para grupo ventas
+    permission_required = 'productos.view_producto'
+    raise_exception = True
+    tamano_pagina = 10
+    minimo_caracteres = 2
+
+    def get(self, request):
+        texto = request.GET.get('q', '').strip()
+        try:
+            pagina = max(int(request.GET.get('pagina', 1)), 1)
+        except ValueError:
+            return JsonResponse({'error': 'Página inválida.'}, status=400)
+        if len(texto) < self.minimo_caracteres:
+            return JsonResponse({'resultados': [], 'mas': False})
+
+        # Primero los que empiezan con el texto, después los que lo contienen en el nombre
+        productos = (
+            Producto.objects
+            .filter(stock__gt=0)
+            .filter(Q(sku__istartswith=texto) | Q(nombre__icontains=texto))
+            .annotate(orden=Case(
+                When(Q(sku__istartswith=texto) | Q(nombre__istartswith=texto), then=0),
+                default=1,
+            ))
+            .order_by('orden', 'nombre', 'id')
+            .values('id', 'sku', 'nombre', 'precio', 'stock')
+        )
+        inicio = (pagina - 1) * self.tamano_pagina
+        filas = list(productos[inicio:inicio + self.tamano_pagina + 1])
+        return JsonResponse({
+            'resultados': [dict(fila, precio=float(fila['precio'])) for fila in filas[:self.tamano_pagina]],
+            'mas': len(filas) > self.tamano_pagina,
+        })
+
+
 class VentaUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = Venta
     form_class = VentaForm
@@ -208,35 +318,26 @@ class VentaUpdateView(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     def form_valid(self, form):
         context = self.get_context_data()
         formset = context['formset']
-        
-        with transaction.atomic():
-            # Lógica similar a CreateView pero para actualizar
-            self.object = form.save(commit=False)
-            
-            if formset.is_valid():
-                # Calcular nuevo total
-                total_venta = 0
-                items = formset.save(commit=False)
-                
-                for item in items:
-                    item.subtotal = item.cantidad * item.precio_unitario
-                    total_venta += item.subtotal
-                
-                self.object.total = total_venta
-                self.object.save()
-                
-                formset.instance = self.object
-                for item in items:
-                    item.venta = self.object
-                    item.save()
-                
-                for obj in formset.deleted_objects:
-                    obj.delete()
-                
-                messages.success(self.request, f'Venta {self.object.sku} actualizada exitosamente.')
-                return super().form_valid(form)
-            else:
+        self.object = form.save(commit=False)
+
+        if formset.is_valid():
+            items = formset.save(commit=False)
+            usuario = self.request.user.username if self.request.user.is_authenticated else 'Sistema'
+
+            # Sólo se mueve la diferencia de stock entre la versión guardada y la editada
+            try:
+                actualizar_venta(self.object, items, formset.deleted_objects, usuario)
+            except StockInsuficiente as e:
+                messages.error(self.request, str(e))
                 return self.form_invalid(form)
+            except Venta.DoesNotExist:
+                messages.error(self.request, f'La venta {self.object.sku} se anuló mientras se editaba.')
+                return redirect(self.get_success_url())
+
+            messages.success(self.request, f'Venta {self.object.sku} actualizada exitosamente.')
+            return redirect(self.get_success_url())
+        else:
+            return self.form_invalid(form)
 
     
 class VentaDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
@@ -247,35 +348,145 @@ class VentaDeleteView(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
     #Restriccion de permisos para grupo ventas
     permission_required = 'ventas.delete_venta'
     
-    def delete(self, request, *args, **kwargs):
-        self.object = self.get_object()
-        
-        with transaction.atomic():
-            # Restaurar stock de todos los productos antes de eliminar
-            items = self.object.items.all() # type: ignore
-            
-            for item in items:
-                producto = item.producto
-                # Restaurar stock
-                producto.stock += item.cantidad
-                producto.save()
-                
-                # Registrar movimiento de stock (entrada por cancelación)
-                MovimientoStock.objects.create(
-                    producto=producto,
-                    tipo='entrada',
-                    cantidad=item.cantidad,
-                    motivo=f'Cancelación de venta {self.object.sku}', # type: ignore
-                    usuario=self.request.user.username if self.request.user.is_authenticated else 'Sistema'
-                )
-            
-            # Guardar código para el mensaje antes de eliminar
-            codigo_venta = self.object.sku # type: ignore
-            
-            # Eliminar la venta (esto eliminará también los items por CASCADE)
-            self.object.delete()
-            
-            messages.success(request, f'Venta {codigo_venta} eliminada exitosamente. Stock restaurado.')
-        
+    # Desde Django 4 el POST de DeleteView pasa por form_valid, no por delete()
+    def form_valid(self, form):
+        usuario = self.request.user.username if self.request.user.is_authenticated else 'Sistema'
+        # Stock, movimientos y resúmenes se restauran en bloque antes de eliminar
+        anular_ventas([self.object.pk], usuario)
+        messages.success(self.request, f'Venta {self.object.sku} eliminada exitosamente. Stock restaurado.') # type: ignore
         return redirect(self.success_url)
 
+
+class AnularVentasView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Anula varias ventas de una vez (por ejemplo un lote de importaciones erróneas del POS).
+
+    Recibe los ids en el campo `ventas` de un formulario o como {"ventas": [...]} en JSON.
+    """
+    #Restriccion de permisos para grupo ventas
+    permission_required = 'ventas.delete_venta'
+
+    def post(self, request):
+        es_json = request.content_type == 'application/json'
+        try:
+            if es_json:
+                ids = json.loads(request.body).get('ventas', [])
+                # Sólo una lista de enteros: un string se recorrería dígito por dígito
+                if not isinstance(ids, list) or any(type(pk) is not int for pk in ids):
+                    raise TypeError(ids)
+            else:
+                ids = [int(pk) for pk in request.POST.getlist('ventas')]
+        except (ValueError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Ids de venta inválidos.'}, status=400)
+
+        usuario = request.user.username if request.user.is_authenticated else 'Sistema'
+        anuladas = anular_ventas(ids, usuario)
+
+        if es_json:
+            return JsonResponse({'anuladas': anuladas})
+        if anuladas:
+            messages.success(request, f'{len(anuladas)} ventas anuladas. Stock restaurado.')
+        else:
+            messages.warning(request, 'No se seleccionó ninguna venta.')
+        return redirect('ventas:venta_list')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class IngresoVentasApiView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """API JSON para terminales POS: una venta o {"ventas": [...]} con una clave de idempotencia cada una.
+
+    No usa token CSRF: sólo acepta Content-Type application/json, que un
+    formulario de otro sitio no puede enviar sin pasar por CORS.
+    """
+    #Restriccion de permisos para grupo ventas
+    permission_required = 'ventas.add_venta'
+    raise_exception = True
+
+    def post(self, request):
+        if request.content_type != 'application/json':
+            return JsonResponse({'error': 'Se espera Content-Type application/json.'}, status=415)
+        try:
+            datos = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'JSON inválido.'}, status=400)
+
+        es_lote = isinstance(datos, dict) and 'ventas' in datos
+        lote = datos['ventas'] if es_lote else [datos]
+        if not isinstance(lote, list) or not lote:
+            return JsonResponse({'error': '"ventas" debe ser una lista no vacía.'}, status=400)
+        if len(lote) > MAX_LOTE:
+            return JsonResponse({'error': f'Como máximo {MAX_LOTE} ventas por lote.'}, status=400)
+
+        usuario = request.user.username if request.user.is_authenticated else 'Sistema'
+        resultados = ingresar_ventas(lote, usuario)
+        if es_lote:
+            return JsonResponse({'resultados': resultados})
+        resultado = resultados[0]
+        status = {'creada': 201, 'duplicada': 200}.get(resultado['estado'], 422)
+        return JsonResponse(resultado, status=status)
+
+
+class ExportarVentasView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Exporta las facturas de un rango de fechas o de un cliente en un ZIP o un PDF unido"""
+    permission_required = 'ventas.view_venta'
+
+    def get(self, request):
+        formato = request.GET.get('formato', 'zip')
+        if formato not in FORMATOS:
+            return HttpResponseBadRequest('Formato inválido, use zip o pdf.')
+        try:
+            desde = parse_date(request.GET.get('desde', ''))
+            hasta = parse_date(request.GET.get('hasta', ''))
+            cliente = int(request.GET['cliente']) if request.GET.get('cliente') else None
+        except ValueError:
+            return HttpResponseBadRequest('Fecha o cliente inválidos.')
+
+        ventas = ventas_a_exportar(desde, hasta, cliente)
+
+        def progreso(hechas, total):
+            logger.info('Exportación de facturas: %s/%s', hechas, total)
+
+        # Una exportación a la vez: ocupa todos los procesos de su pool, que se terminan al final
+        try:
+            contenido = pool_exportacion.ocupar(exportar(ventas, formato, pool_exportacion, progreso), cerrar=True)
+        except RenderizadoOcupado:
+            response = HttpResponse('Ya hay una exportación en curso, intente de nuevo en unos minutos.', status=503)
+            response['Retry-After'] = '60'
+            return response
+        response = StreamingHttpResponse(
+            contenido,
+            content_type='application/zip' if formato == 'zip' else 'application/pdf',
+        )
+        response['Content-Disposition'] = f'attachment; filename=facturas.{formato}'
+        response['X-Total-Ventas'] = str(ventas.count())
+        return response
+
+
+class AnaliticaVentasView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    """Consultas de analítica servidas desde el cubo pre-agregado (JSON)"""
+    permission_required = 'ventas.view_venta'
+    raise_exception = True
+    consulta = None
+
+    def get(self, request):
+        granularidad = request.GET.get('granularidad', 'dia')
+        if granularidad not in GRANULARIDADES:
+            return JsonResponse({'error': f'Granularidad inválida, use {", ".join(GRANULARIDADES)}.'}, status=400)
+        try:
+            desde = parse_date(request.GET.get('desde', ''))
+            hasta = parse_date(request.GET.get('hasta', ''))
+            fecha = parse_date(request.GET.get('fecha', '')) or timezone.localdate()
+            limite = max(1, min(int(request.GET.get('limite', 10)), 100))
+            producto = int(request.GET['producto']) if request.GET.get('producto') else None
+            cliente = int(request.GET['cliente']) if request.GET.get('cliente') else None
+        except ValueError:
+            return JsonResponse({'error': 'Parámetros inválidos.'}, status=400)
+
+        if self.consulta == 'productos':
+            data = analitica.top_productos(granularidad, desde, hasta, limite)
+        elif self.consulta == 'clientes':
+            data = analitica.ventas_por_cliente(granularidad, desde, hasta, limite)
+        elif self.consulta == 'serie':
+            data = analitica.serie(granularidad, desde, hasta, producto=producto, cliente=cliente)
+        else:
+            data = analitica.comparativa(granularidad, fecha)
+        return JsonResponse(data, safe=False)